@@ -53,6 +53,16 @@ class ServiceDiscoveryReferrer:
     # 正常稼働が確認できているものをランダムにひとつ返す。
     # どのワーカーも正常稼働していない場合はNoneを返す。
     def get_random_worker(self, worker_type: str) -> ServiceDescription | None:
+        workers: list[ServiceDescription] = self.get_healthy_workers(
+            worker_type=worker_type
+        )
+        if not workers:
+            return None
+        return random.choice(workers)
+
+    # worker_typeで指定したサービスのワーカーのうち、
+    # 正常稼働が確認できているものすべてを返す。
+    def get_healthy_workers(self, worker_type: str) -> list[ServiceDescription]:
         index: int
         workers: list
         try:
@@ -62,16 +72,16 @@ class ServiceDiscoveryReferrer:
                 f"Failed to connect to Consul agent at {self.__consul_agent_host}:{self.__consul_agent_port}"
             ) from e
 
-        if not workers:
-            return None
-        worker: dict = random.choice(workers)
-        return ServiceDescription(
-            index=index,
-            service_name=worker_type,
-            service_id=worker["Service"]["ID"],
-            service_address=worker["Service"]["Address"],
-            service_port=worker["Service"]["Port"],
-        )
+        return [
+            ServiceDescription(
+                index=index,
+                service_name=worker_type,
+                service_id=worker["Service"]["ID"],
+                service_address=worker["Service"]["Address"],
+                service_port=worker["Service"]["Port"],
+            )
+            for worker in workers
+        ]
 
     # worker_typeで指定したサービスのワーカーすべてをGeneratorとして返す。
     def get_all_workers(
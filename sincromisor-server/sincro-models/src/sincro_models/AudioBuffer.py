@@ -0,0 +1,65 @@
+import numpy as np
+
+
+# 音声データを溜めるための伸長可能なバッファ。
+# np.appendのように追加ごとに全体をコピーせず、事前に確保した領域へ書き込む。
+# 先頭の切り捨ては開始位置をずらすだけで、領域が足りなくなった時に
+# 前詰め(使用量が容量の半分以下の場合)または倍の容量への拡張を行う。
+class AudioBuffer:
+    def __init__(self, capacity: int = 16000, dtype: str | type = "int16"):
+        self.__buffer: np.ndarray = np.zeros(max(capacity, 1), dtype=dtype)
+        self.__head: int = 0
+        self.__tail: int = 0
+
+    def __len__(self) -> int:
+        return self.__tail - self.__head
+
+    @property
+    def size(self) -> int:
+        return self.__tail - self.__head
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.__buffer.dtype
+
+    @property
+    def capacity(self) -> int:
+        return self.__buffer.size
+
+    def __reserve(self, length: int) -> None:
+        current: int = self.size
+        if length > self.capacity // 2:
+            new_buffer: np.ndarray = np.zeros(
+                max(self.capacity * 2, length), dtype=self.__buffer.dtype
+            )
+            new_buffer[:current] = self.__buffer[self.__head : self.__tail]
+            self.__buffer = new_buffer
+        else:
+            self.__buffer[:current] = self.__buffer[self.__head : self.__tail]
+        self.__head = 0
+        self.__tail = current
+
+    def append(self, data: np.ndarray) -> None:
+        length: int = data.size
+        if self.__tail + length > self.capacity:
+            self.__reserve(self.size + length)
+        self.__buffer[self.__tail : self.__tail + length] = data.reshape(-1)
+        self.__tail += length
+
+    # ndarrayのスライス(voice[target_sample:])と同じ位置で先頭を切り捨てる。
+    # 負の値を与えると末尾からtarget_sample分を残す。
+    def cut(self, target_sample: int) -> None:
+        start, _, _ = slice(target_sample, None).indices(self.size)
+        self.__head += start
+
+    def clear(self) -> None:
+        self.__head = 0
+        self.__tail = 0
+
+    # コピーせずに現在の内容を参照する。
+    # 次のappend/cut/clearまでの間のみ有効。
+    def view(self) -> np.ndarray:
+        return self.__buffer[self.__head : self.__tail]
+
+    def tobytes(self) -> bytes:
+        return self.view().tobytes()
@@ -0,0 +1,325 @@
+import logging
+import subprocess as sp
+from abc import ABC, abstractmethod
+from collections.abc import Generator
+from fractions import Fraction
+from subprocess import CompletedProcess, Popen
+from threading import Lock, Thread
+from typing import ClassVar
+
+import numpy as np
+
+# PyAVはsincro-rtcやvoice-synthesizerなど、必要なパッケージのみが依存している。
+# インストールされていない環境ではサブプロセスのエンコーダのみを使う。
+try:
+    import av
+    from av.audio.frame import AudioFrame
+    from av.codec import Codec
+except ImportError:
+    av = None
+
+
+# int16のPCMをaudio_formatの形式にエンコードする。
+# encode()は全体を一度に、encode_stream()はエンコードできた分から順に返す。
+# encode_stream()の結果を連結すると、encode()と同じ形式の音声データとなる。
+class AudioEncoder(ABC):
+    # エンコード後の音声データフォーマット
+    audio_format: str = "audio/wav"
+
+    def encode(
+        self, pcm: bytes | memoryview, sampling_rate: int, channels: int = 1
+    ) -> bytes:
+        return b"".join(self.encode_stream(pcm, sampling_rate, channels))
+
+    @abstractmethod
+    def encode_stream(
+        self,
+        pcm: bytes | memoryview,
+        sampling_rate: int,
+        channels: int = 1,
+        chunk_size: int = 4096,
+    ) -> Generator[bytes, None, None]: ...
+
+
+# PyAV(libavcodec)でプロセス内でエンコードする。
+# コーデックの検索や設定は生成時に一度だけ行い、以降のencode()で使い回す。
+# libopusやaacのエンコーダは最後まで吐き出すと再利用できないため、
+# コンテキスト自体は発話ごとに作る(プロセスの起動よりはるかに軽い)。
+class PyAVAudioEncoder(AudioEncoder):
+    # audio_format: (コンテナ, コーデック, 対応するサンプリングレート)
+    FORMATS: ClassVar[dict[str, tuple[str, str, tuple[int, ...]]]] = {
+        "audio/ogg;codecs=opus": (
+            "ogg",
+            "libopus",
+            (8000, 12000, 16000, 24000, 48000),
+        ),
+        "audio/aac": (
+            "adts",
+            "aac",
+            (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000),
+        ),
+    }
+
+    def __init__(self, audio_format: str, bit_rate: int | None = None):
+        if av is None:
+            raise RuntimeError("PyAV is not installed.")
+        if audio_format not in self.FORMATS:
+            raise ValueError(f"Unsupported audio_format: {audio_format}")
+        self.audio_format = audio_format
+        self.__container_format, self.__codec_name, self.__sampling_rates = (
+            self.FORMATS[audio_format]
+        )
+        # エンコーダが組み込まれていない場合はここで例外となる
+        Codec(self.__codec_name, "w")
+        self.__bit_rate: int | None = bit_rate
+        # Oggのページを細かく区切り、ストリーミング時に少しずつ書き出されるようにする。
+        self.__container_options: dict[str, str] = (
+            {"page_duration": "100000"} if self.__container_format == "ogg" else {}
+        )
+
+    def encode_stream(
+        self,
+        pcm: bytes | memoryview,
+        sampling_rate: int,
+        channels: int = 1,
+        chunk_size: int = 4096,
+    ) -> Generator[bytes, None, None]:
+        assert av is not None
+        samples: np.ndarray = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels)
+        layout: str = "mono" if channels == 1 else "stereo"
+        codec_rate: int = (
+            sampling_rate if sampling_rate in self.__sampling_rates else 48000
+        )
+        sink: _ChunkSink = _ChunkSink()
+        with av.open(
+            sink,
+            mode="w",
+            format=self.__container_format,
+            container_options=self.__container_options,
+            buffer_size=chunk_size,
+        ) as container:
+            stream = container.add_stream(self.__codec_name, rate=codec_rate)
+            stream.codec_context.layout = layout
+            if self.__bit_rate is not None:
+                stream.codec_context.bit_rate = self.__bit_rate
+            # 100msごとにエンコーダへ渡す。
+            # フォーマットやフレーム長の変換はPyAVが内部のリサンプラーで行う。
+            block: int = sampling_rate // 10
+            for position in range(0, len(samples), block):
+                frame: AudioFrame = AudioFrame.from_ndarray(
+                    samples[position : position + block].reshape(1, -1),
+                    format="s16",
+                    layout=layout,
+                )
+                frame.sample_rate = sampling_rate
+                frame.pts = position
+                frame.time_base = Fraction(1, sampling_rate)
+                container.mux(stream.encode(frame))
+                if sink.pending:
+                    yield sink.pop()
+            container.mux(stream.encode(None))
+        if sink.pending:
+            yield sink.pop()
+
+
+# PyAVが書き出したデータを溜めておく。
+# seek()を持たせないことで、コンテナは後から書き戻さない形式で書き出す。
+class _ChunkSink:
+    def __init__(self):
+        self.__chunks: list[bytes] = []
+
+    @property
+    def pending(self) -> bool:
+        return len(self.__chunks) > 0
+
+    def write(self, data: bytes) -> int:
+        self.__chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        chunk: bytes = b"".join(self.__chunks)
+        self.__chunks.clear()
+        return chunk
+
+
+# s16, 2chのPCMをrateのサンプリングレートで返す(audio/pcm;rate=N)。
+# エンコードはせず、受け取った側がそのままフレームに切り出せる形式に揃えるのみ。
+# PyAVがあればAudioResamplerで、無ければ線形補間でリサンプリングする。
+class PCMAudioEncoder(AudioEncoder):
+    def __init__(self, rate: int):
+        self.audio_format = f"audio/pcm;rate={rate}"
+        self.__rate: int = rate
+
+    def encode_stream(
+        self,
+        pcm: bytes | memoryview,
+        sampling_rate: int,
+        channels: int = 1,
+        chunk_size: int = 4096,
+    ) -> Generator[bytes, None, None]:
+        samples: np.ndarray = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels)
+        if sampling_rate == self.__rate and channels == 2:
+            # 変換が不要な場合はそのまま区切って返す
+            data: memoryview = memoryview(samples).cast("B")
+            for position in range(0, len(data), chunk_size):
+                yield bytes(data[position : position + chunk_size])
+            return
+        if av is None:
+            yield from self.__resample_numpy(samples, sampling_rate, chunk_size)
+            return
+        layout: str = "mono" if channels == 1 else "stereo"
+        resampler = av.AudioResampler(format="s16", layout="stereo", rate=self.__rate)
+        # 100msごとにリサンプリングして返す
+        block: int = sampling_rate // 10
+        for position in range(0, len(samples), block):
+            frame: AudioFrame = AudioFrame.from_ndarray(
+                samples[position : position + block].reshape(1, -1),
+                format="s16",
+                layout=layout,
+            )
+            frame.sample_rate = sampling_rate
+            for resampled_frame in resampler.resample(frame):
+                yield resampled_frame.to_ndarray().tobytes()
+        for resampled_frame in resampler.resample(None):
+            yield resampled_frame.to_ndarray().tobytes()
+
+    def __resample_numpy(
+        self, samples: np.ndarray, sampling_rate: int, chunk_size: int
+    ) -> Generator[bytes, None, None]:
+        length: int = len(samples) * self.__rate // sampling_rate
+        positions: np.ndarray = np.arange(length) * (sampling_rate / self.__rate)
+        stereo: np.ndarray = np.empty((length, 2), dtype=np.int16)
+        for channel in range(2):
+            source: np.ndarray = samples[:, min(channel, samples.shape[1] - 1)]
+            stereo[:, channel] = np.interp(
+                positions, np.arange(len(source)), source
+            ).astype(np.int16)
+        data: memoryview = memoryview(stereo).cast("B")
+        for position in range(0, len(data), chunk_size):
+            yield bytes(data[position : position + chunk_size])
+
+
+# opusenc、fdkaacコマンドでエンコードする。
+# PyAVが使えない環境向けのフォールバック。
+class SubprocessAudioEncoder(AudioEncoder):
+    def __init__(self, audio_format: str):
+        if audio_format not in ("audio/ogg;codecs=opus", "audio/aac"):
+            raise ValueError(f"Unsupported audio_format: {audio_format}")
+        self.audio_format = audio_format
+
+    def __command(self, sampling_rate: int, channels: int) -> list[str]:
+        if self.audio_format == "audio/aac":
+            return [
+                "fdkaac",
+                "-R",
+                "--raw-channels",
+                str(channels),
+                "--raw-rate",
+                str(sampling_rate),
+                "--raw-format",
+                "S16L",
+                "-S",
+                "-m3",
+                "-f2",
+                "-o-",
+                "-",
+            ]
+        return [
+            "opusenc",
+            "--raw",
+            "--raw-bits",
+            "16",
+            "--raw-rate",
+            str(sampling_rate),
+            "--raw-chan",
+            str(channels),
+            "-",
+            "-",
+        ]
+
+    def encode(
+        self, pcm: bytes | memoryview, sampling_rate: int, channels: int = 1
+    ) -> bytes:
+        encoder_p: CompletedProcess = sp.run(
+            self.__command(sampling_rate, channels),
+            input=pcm,
+            capture_output=True,
+            text=False,
+            check=True,
+        )
+        return encoder_p.stdout
+
+    def encode_stream(
+        self,
+        pcm: bytes | memoryview,
+        sampling_rate: int,
+        channels: int = 1,
+        chunk_size: int = 4096,
+    ) -> Generator[bytes, None, None]:
+        command: list[str] = self.__command(sampling_rate, channels)
+        with Popen(
+            command, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.DEVNULL
+        ) as encoder_p:
+            # stdoutを読みながら書き込まないと、パイプが詰まって止まるため
+            # stdinへの書き込みは別スレッドで行う。
+            writer_t: Thread = Thread(
+                target=self.__write_stdin, args=(encoder_p, pcm), daemon=True
+            )
+            writer_t.start()
+            assert encoder_p.stdout is not None
+            while chunk := encoder_p.stdout.read1(chunk_size):
+                yield chunk
+            writer_t.join()
+            if encoder_p.wait() != 0:
+                raise sp.CalledProcessError(encoder_p.returncode, command)
+
+    def __write_stdin(self, encoder_p: Popen, pcm: bytes | memoryview) -> None:
+        assert encoder_p.stdin is not None
+        try:
+            encoder_p.stdin.write(pcm)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                encoder_p.stdin.close()
+            except BrokenPipeError:
+                pass
+
+
+_encoders: dict[tuple[str, str], AudioEncoder] = {}
+_encoders_lock: Lock = Lock()
+
+
+# audio/pcm;rate=Nのサンプリングレートを返す。PCMの指定でなければNoneを返す。
+def pcm_sampling_rate(audio_format: str | None) -> int | None:
+    if audio_format is None or not audio_format.startswith("audio/pcm;rate="):
+        return None
+    rate: str = audio_format.removeprefix("audio/pcm;rate=")
+    if not rate.isdigit() or not 8000 <= int(rate) <= 192000:
+        return None
+    return int(rate)
+
+
+# audio_formatに対応するエンコーダを返す。生成したエンコーダはプロセス内で使い回す。
+# backend:
+#   pyav: PyAVを使う。使えない場合はsubprocessにフォールバックする。
+#   subprocess: opusenc、fdkaacコマンドを使う。
+def get_audio_encoder(audio_format: str, backend: str = "pyav") -> AudioEncoder:
+    key: tuple[str, str] = (audio_format, backend)
+    with _encoders_lock:
+        if encoder := _encoders.get(key):
+            return encoder
+        if (rate := pcm_sampling_rate(audio_format)) is not None:
+            encoder = PCMAudioEncoder(rate)
+        elif backend == "pyav":
+            try:
+                encoder = PyAVAudioEncoder(audio_format)
+            except Exception as e:
+                logging.getLogger("sincro.AudioEncoder").warning(
+                    f"PyAV encoder is not available, fallback to subprocess: {repr(e)}"
+                )
+                encoder = SubprocessAudioEncoder(audio_format)
+        else:
+            encoder = SubprocessAudioEncoder(audio_format)
+        _encoders[key] = encoder
+        return encoder
@@ -11,6 +11,24 @@ class SpeechExtractorInitializeRequest(BaseModel):
     voice_sampling_rate: int = 16000
     voice_sample_bytes: int = 2
     voice_channels: int = 1
+    # 送信する音声の形式
+    # pcm: voice_sample_bytesのPCMをそのまま送る
+    # opus: 1メッセージにつき1つのOpusパケットを送る
+    voice_codec: str = "pcm"
+    # SpeechExtractorResultの送信形式
+    # msgpack: SpeechExtractorResult.to_msgpack()
+    # packet: SpeechExtractorResult.to_packet()
+    result_format: str = "msgpack"
+    # 音量によるゲート(SpeechEnergyGate)の設定
+    # energy_gate_open_db / energy_gate_close_db: noise floorからの差(dB)
+    # energy_gate_calibration_ms: 開始直後、noise floorを測る間は全て通す時間(ms)
+    energy_gate: bool = True
+    energy_gate_open_db: float = 9.0
+    energy_gate_close_db: float = 5.0
+    energy_gate_max_zcr: float = 0.25
+    energy_gate_min_dbfs: float = -60.0
+    energy_gate_hangover_ms: int = 400
+    energy_gate_calibration_ms: int = 1000
 
     @classmethod
     def from_msgpack(cls, pack) -> "SpeechExtractorInitializeRequest":
@@ -24,6 +42,15 @@ class SpeechExtractorInitializeRequest(BaseModel):
                 "voice_sampling_rate": self.voice_sampling_rate,
                 "voice_sample_bytes": self.voice_sample_bytes,
                 "voice_channels": self.voice_channels,
+                "voice_codec": self.voice_codec,
+                "result_format": self.result_format,
+                "energy_gate": self.energy_gate,
+                "energy_gate_open_db": self.energy_gate_open_db,
+                "energy_gate_close_db": self.energy_gate_close_db,
+                "energy_gate_max_zcr": self.energy_gate_max_zcr,
+                "energy_gate_min_dbfs": self.energy_gate_min_dbfs,
+                "energy_gate_hangover_ms": self.energy_gate_hangover_ms,
+                "energy_gate_calibration_ms": self.energy_gate_calibration_ms,
             },
         )
         assert isinstance(pack, bytes), "msgpack.packb returned non-bytes"
@@ -1,15 +1,27 @@
-import subprocess as sp
+import struct
 import wave
-from typing import Any
+from typing import Any, ClassVar
 
 import msgpack
 import numpy as np
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from .AudioBuffer import AudioBuffer
+from .AudioEncoder import get_audio_encoder
 
 
 class SpeechExtractorResult(BaseModel):
     # counter: ClassVar[int] = 0
 
+    # to_packet/from_packetで使うバイナリ形式。
+    # ヘッダ(PACKET_HEADER)、session_id(UTF-8)、voiceの生データの順に並ぶ。
+    # ヘッダ: magic, version, flags(bit0: confirmed), session_idの長さ,
+    #         speech_id, sequence_id, voice_offset, voiceのサンプル数,
+    #         voice_sampling_rate, start_at, voice_sample_bytes, voice_channels
+    PACKET_MAGIC: ClassVar[bytes] = b"SXRP"
+    PACKET_VERSION: ClassVar[int] = 1
+    PACKET_HEADER: ClassVar[struct.Struct] = struct.Struct("<4sBBHqqqIIdBB")
+
     # np.ndarrayがメンバにいるとコケる問題対策
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
@@ -37,15 +49,45 @@ class SpeechExtractorResult(BaseModel):
     voice_sample_bytes: int = 2
     voice_channels: int = 1
 
-    def append_voice(self, new_voice: np.ndarray):
-        self.voice = np.append(self.voice, new_voice)
+    # 発話の先頭から数えた、voiceの先頭のサンプル位置。
+    # 受信側はこの位置に音声を書き込んで発話を組み立てる。
+    # -1の場合は位置が不明なため、受信側で発話の末尾に追記する。
+    voice_offset: int = -1
+
+    # append_voice/cut_voice/clear_voiceで使うバッファ。
+    # voiceはこのバッファのビュー(_voice_view)となる。
+    _voice_buffer: AudioBuffer | None = PrivateAttr(default=None)
+    _voice_view: np.ndarray | None = PrivateAttr(default=None)
+
+    # voiceが外部から差し替えられていた場合はバッファを作り直す。
+    def __get_voice_buffer(self, reserve: int = 0) -> AudioBuffer:
+        if self._voice_buffer is None or self.voice is not self._voice_view:
+            self._voice_buffer = AudioBuffer(
+                capacity=self.voice.size + max(reserve, self.voice_sampling_rate),
+                dtype=self.voice_dtype,
+            )
+            self._voice_buffer.append(self.voice)
+        return self._voice_buffer
+
+    def __update_voice(self, buffer: AudioBuffer) -> np.ndarray:
+        self._voice_view = buffer.view()
+        self.voice = self._voice_view
         return self.voice
 
+    def append_voice(self, new_voice: np.ndarray):
+        buffer: AudioBuffer = self.__get_voice_buffer(reserve=new_voice.size)
+        buffer.append(new_voice)
+        return self.__update_voice(buffer)
+
     def cut_voice(self, target_sample: int) -> None:
-        self.voice = self.voice[target_sample:]
+        buffer: AudioBuffer = self.__get_voice_buffer()
+        buffer.cut(target_sample)
+        self.__update_voice(buffer)
 
     def clear_voice(self):
-        self.voice = np.zeros(0, dtype=self.voice_dtype)
+        buffer: AudioBuffer = self.__get_voice_buffer()
+        buffer.clear()
+        self.__update_voice(buffer)
 
     @classmethod
     def from_msgpack(cls, pack: bytes) -> "SpeechExtractorResult":
@@ -69,34 +111,93 @@ class SpeechExtractorResult(BaseModel):
                 "voice_sampling_rate": self.voice_sampling_rate,
                 "voice_sample_bytes": self.voice_sample_bytes,
                 "voice_channels": self.voice_channels,
+                "voice_offset": self.voice_offset,
             },
         )
         assert isinstance(pack, bytes), "msgpack.packb returned non-bytes"
         return pack
 
-    def to_opus(self) -> bytes:
-        enc_p = sp.run(
-            [
-                "opusenc",
-                "--raw",
-                "--raw-bits",
-                str(self.voice_sample_bytes * 8),
-                "--raw-rate",
-                str(self.voice_sampling_rate),
-                "--raw-chan",
-                str(self.voice_channels),
-                "-",
-                "-",
-            ],
-            input=self.voice.tobytes(),
-            capture_output=True,
-            text=False,
-            check=True,
+    @classmethod
+    def is_packet(cls, pack: bytes) -> bool:
+        return pack[: len(cls.PACKET_MAGIC)] == cls.PACKET_MAGIC
+
+    # voiceは受け取ったpackを参照するビュー(読み取り専用)となる。
+    @classmethod
+    def from_packet(cls, pack: bytes) -> "SpeechExtractorResult":
+        (
+            magic,
+            version,
+            flags,
+            session_id_length,
+            speech_id,
+            sequence_id,
+            voice_offset,
+            voice_samples,
+            voice_sampling_rate,
+            start_at,
+            voice_sample_bytes,
+            voice_channels,
+        ) = cls.PACKET_HEADER.unpack_from(pack)
+        if magic != cls.PACKET_MAGIC:
+            raise ValueError(f"Invalid packet magic: {magic!r}")
+        if version != cls.PACKET_VERSION:
+            raise ValueError(f"Unsupported packet version: {version}")
+        position: int = cls.PACKET_HEADER.size
+        session_id: str = pack[position : position + session_id_length].decode()
+        position += session_id_length
+        voice_dtype: str = f"int{voice_sample_bytes * 8}"
+        return SpeechExtractorResult(
+            session_id=session_id,
+            speech_id=speech_id,
+            sequence_id=sequence_id,
+            start_at=start_at,
+            confirmed=bool(flags & 1),
+            voice=np.frombuffer(
+                pack, dtype=voice_dtype, count=voice_samples, offset=position
+            ),
+            voice_dtype=voice_dtype,
+            voice_sampling_rate=voice_sampling_rate,
+            voice_sample_bytes=voice_sample_bytes,
+            voice_channels=voice_channels,
+            voice_offset=voice_offset,
+        )
+
+    def to_packet(self) -> bytes:
+        session_id: bytes = self.session_id.encode()
+        header: bytes = self.PACKET_HEADER.pack(
+            self.PACKET_MAGIC,
+            self.PACKET_VERSION,
+            1 if self.confirmed else 0,
+            len(session_id),
+            self.speech_id,
+            self.sequence_id,
+            self.voice_offset,
+            self.voice.size,
+            self.voice_sampling_rate,
+            self.start_at,
+            self.voice_sample_bytes,
+            self.voice_channels,
+        )
+        # voiceはtobytes()を経由せず、送信用のbytesに直接書き込む
+        return b"".join((header, session_id, np.ascontiguousarray(self.voice).data))
+
+    # to_packetとto_msgpackのどちらの形式でも読み込む。
+    @classmethod
+    def from_bytes(cls, pack: bytes) -> "SpeechExtractorResult":
+        if cls.is_packet(pack):
+            return cls.from_packet(pack)
+        return cls.from_msgpack(pack)
+
+    # voiceをOgg Opus形式でエンコードする。
+    # PyAVが使えない環境ではopusencコマンドが必要。
+    def to_opus(self, backend: str = "pyav") -> bytes:
+        return get_audio_encoder("audio/ogg;codecs=opus", backend=backend).encode(
+            np.ascontiguousarray(self.voice, dtype=np.int16).data,
+            sampling_rate=self.voice_sampling_rate,
+            channels=self.voice_channels,
         )
-        return enc_p.stdout
 
     # voiceをopus形式でエンコードし、ファイルに書き出す。
-    # 実行にはopusencコマンドが必要。
     def to_opusfile(self, path: str) -> None:
         opus: bytes = self.to_opus()
         with open(path, "wb") as opusfile:
@@ -2,6 +2,8 @@ import hashlib
 
 from pydantic import BaseModel, field_validator
 
+from .AudioEncoder import pcm_sampling_rate
+
 
 class VoiceSynthesizerRequest(BaseModel):
     message: str
@@ -18,6 +20,9 @@ class VoiceSynthesizerRequest(BaseModel):
             return "audio/ogg"
         if audio_format == "audio/ogg;codecs=opus":
             return "audio/ogg;codecs=opus"
+        # s16, 2chのPCM。キャッシュのキーにもそのまま使われるため、表記を揃える。
+        if (rate := pcm_sampling_rate(audio_format)) is not None:
+            return f"audio/pcm;rate={rate}"
         return "audio/wav"
 
     def redis_key(self) -> str:
@@ -28,7 +28,7 @@ class VoiceSynthesizerResult(BaseModel):
     speaking_time: float
     # 音声データ(エンコード済み)
     voice: bytes
-    # 音声データフォーマット(audio/aac, audio/ogg;codecs=opus, audio/wavのいずれか)
+    # 音声データフォーマット(audio/aac, audio/ogg;codecs=opus, audio/wav, audio/pcm;rate=Nのいずれか)
     audio_format: str
 
     def to_msgpack(self) -> bytes:
@@ -72,7 +72,10 @@ class VoiceSynthesizerResult(BaseModel):
 
     @classmethod
     def from_msgpack(cls, vpackage: bytes) -> "VoiceSynthesizerResult":
-        content = msgpack.unpackb(vpackage)
+        return cls.from_dict(msgpack.unpackb(vpackage))
+
+    @classmethod
+    def from_dict(cls, content: dict) -> "VoiceSynthesizerResult":
         mora_queue = [
             VoiceSynthesizerMora.model_validate(m) for m in content["mora_queue"]
         ]
@@ -0,0 +1,74 @@
+from typing import Any
+
+import msgpack
+from pydantic import BaseModel
+
+from .VoiceSynthesizerResult import VoiceSynthesizerMora, VoiceSynthesizerResult
+
+
+# VoiceSynthesizerの音声をストリーミングで送る際、発話の先頭に送るヘッダ。
+# この後にVoiceSynthesizerStreamChunkが続き、last=Trueのチャンクで発話が終わる。
+class VoiceSynthesizerStreamHeader(BaseModel):
+    # 元となったメッセージテキスト
+    message: str
+    # クエリをモーラごとに時系列で並べたもの
+    mora_queue: list[VoiceSynthesizerMora]
+    # 音声データの再生時間(s)
+    speaking_time: float
+    # 音声データフォーマット(audio/aac, audio/ogg;codecs=opus, audio/wav, audio/pcm;rate=Nのいずれか)
+    audio_format: str
+
+    @classmethod
+    def from_result(
+        cls, vs_result: VoiceSynthesizerResult
+    ) -> "VoiceSynthesizerStreamHeader":
+        return VoiceSynthesizerStreamHeader(
+            message=vs_result.message,
+            mora_queue=vs_result.mora_queue,
+            speaking_time=vs_result.speaking_time,
+            audio_format=vs_result.audio_format,
+        )
+
+    def to_msgpack(self) -> bytes:
+        pack: Any | None = msgpack.packb(
+            {
+                "stream": "header",
+                "message": self.message,
+                "mora_queue": [mora.model_dump() for mora in self.mora_queue],
+                "speaking_time": self.speaking_time,
+                "audio_format": self.audio_format,
+            },
+        )
+        assert isinstance(pack, bytes), "msgpack.packb returned non-bytes"
+        return pack
+
+
+# エンコード済み音声の断片。
+# 前から順に連結すると、audio_formatの音声データとなる。
+class VoiceSynthesizerStreamChunk(BaseModel):
+    voice: bytes
+    # 発話の最後のチャンクであればTrue
+    last: bool = False
+
+    def to_msgpack(self) -> bytes:
+        pack: Any | None = msgpack.packb(
+            {"stream": "chunk", "voice": self.voice, "last": self.last},
+        )
+        assert isinstance(pack, bytes), "msgpack.packb returned non-bytes"
+        return pack
+
+
+# VoiceSynthesizerから届いたメッセージを、種類に応じたモデルとして読み込む。
+# ストリーミングでない場合はVoiceSynthesizerResultとなる。
+def unpack_voice_synthesizer_message(
+    pack: bytes,
+) -> (
+    VoiceSynthesizerResult | VoiceSynthesizerStreamHeader | VoiceSynthesizerStreamChunk
+):
+    content: dict = msgpack.unpackb(pack)
+    match content.pop("stream", None):
+        case "header":
+            return VoiceSynthesizerStreamHeader.model_validate(content)
+        case "chunk":
+            return VoiceSynthesizerStreamChunk.model_validate(content)
+    return VoiceSynthesizerResult.from_dict(content)
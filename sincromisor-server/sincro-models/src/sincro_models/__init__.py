@@ -1,3 +1,12 @@
+from .AudioBuffer import AudioBuffer
+from .AudioEncoder import (
+    AudioEncoder,
+    PCMAudioEncoder,
+    PyAVAudioEncoder,
+    SubprocessAudioEncoder,
+    get_audio_encoder,
+    pcm_sampling_rate,
+)
 from .ChatHistory import ChatHistory
 from .ChatMessage import ChatMessage
 from .SpeechExtractorInitializeRequest import SpeechExtractorInitializeRequest
@@ -8,9 +17,21 @@ from .TextProcessorResult import TextProcessorResult
 from .VoiceSynthesizerRequest import VoiceSynthesizerRequest
 from .VoiceSynthesizerResult import VoiceSynthesizerMora, VoiceSynthesizerResult
 from .VoiceSynthesizerResultFrame import VoiceSynthesizerResultFrame
+from .VoiceSynthesizerStream import (
+    VoiceSynthesizerStreamChunk,
+    VoiceSynthesizerStreamHeader,
+    unpack_voice_synthesizer_message,
+)
 from .VoiceVoxQuery import VoiceVoxAccentPhrase, VoiceVoxMora, VoiceVoxQuery
 
 __all__ = [
+    "AudioBuffer",
+    "AudioEncoder",
+    "PCMAudioEncoder",
+    "PyAVAudioEncoder",
+    "SubprocessAudioEncoder",
+    "get_audio_encoder",
+    "pcm_sampling_rate",
     "SpeechExtractorInitializeRequest",
     "SpeechExtractorResult",
     "SpeechRecognizerResult",
@@ -20,6 +41,9 @@ __all__ = [
     "VoiceSynthesizerMora",
     "VoiceSynthesizerResult",
     "VoiceSynthesizerResultFrame",
+    "VoiceSynthesizerStreamChunk",
+    "VoiceSynthesizerStreamHeader",
+    "unpack_voice_synthesizer_message",
     "VoiceVoxAccentPhrase",
     "VoiceVoxMora",
     "VoiceVoxQuery",
@@ -31,11 +31,11 @@ def text_channel_reader_t(ab: AudioBroker) -> None:
 def voice_frame_reader_t(ab: AudioBroker) -> None:
     print("start voice_frame_reader_t")
     while ab.is_running():
-        try:
-            buffer = ab.voice_frame_queue.popleft()
-            print(f"voice_frame: {buffer}")
-        except IndexError:
+        buffer = ab.voice_playout_buffer.pop()
+        if buffer is None:
             time.sleep(0.1)
+            continue
+        print(f"voice_frame: {buffer}")
     print("stop voice_frame_reader_t")
 
 
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import logging.config
 import os
@@ -13,7 +14,11 @@ from sincro_config import (
     SincromisorConfig,
     SincromisorLoggerConfig,
 )
-from sincro_rtc.models import RTCSessionOffer, RTCSignalingServerArgument
+from sincro_rtc.models import (
+    RTCSessionOffer,
+    RTCSignalingServerArgument,
+    VoicePlayoutOptions,
+)
 from sincro_rtc.RTCSession import RTCSessionManager
 
 if os.environ.get("SINCROMISOR_MODE") == "development":
@@ -47,6 +52,20 @@ class RTCSignalingServer:
             consul_agent_port=self.__args.consul_agent_port,
             fallback_host=self.__args.fallback_host,
             fallback_port=self.__args.fallback_port,
+            audio_broker_mode=self.__args.audio_broker_mode,
+            extractor_codec=self.__args.extractor_codec,
+            synthesizer_audio_format=self.__args.synthesizer_audio_format,
+            session_worker_mode=self.__args.session_worker_mode,
+            session_workers=self.__args.session_workers,
+            warm_processes=self.__args.warm_processes,
+            offer_timeout=self.__args.offer_timeout,
+            playout_options=VoicePlayoutOptions(
+                target_depth=self.__args.playout_target_depth,
+                max_depth=self.__args.playout_max_depth,
+                max_bytes=self.__args.playout_max_bytes,
+                overrun_policy=self.__args.playout_overrun_policy,
+                underrun_policy=self.__args.playout_underrun_policy,
+            ),
         )
         app: FastAPI = FastAPI(on_shutdown=[rtcSM.shutdown])
         """
@@ -78,19 +97,30 @@ class RTCSignalingServer:
                 res = JSONResponse({"error": "Too many requests."})
                 res.status_code = status.HTTP_429_TOO_MANY_REQUESTS
                 return res
-            return JSONResponse(
-                {"worker_type": "RTCSignalingServer", "sessions": rtcSM.session_count()}
-            )
+            statuses: dict = {
+                "worker_type": "RTCSignalingServer",
+                "sessions": rtcSM.session_count(),
+            }
+            if (process_pool := rtcSM.process_pool_statuses()) is not None:
+                statuses["process_pool"] = process_pool
+            statuses["session_statuses"] = rtcSM.session_statuses()
+            return JSONResponse(statuses)
 
         @app.post("/api/v1/RTCSignalingServer/offer")
         async def app_offer(request: Request, offer_params: RTCSessionOffer):
-            rtcSM.cleanup_sessions()
+            # 終了済みセッションのjoinでイベントループを止めないようスレッドで行う
+            await asyncio.to_thread(rtcSM.cleanup_sessions)
             if rtcSM.session_count() > self.__args.max_sessions:
                 res = JSONResponse({"error": "Too many requests."})
                 res.status_code = status.HTTP_429_TOO_MANY_REQUESTS
                 return res
 
-            session_info = rtcSM.create_session(offer=offer_params)
+            try:
+                session_info = await rtcSM.create_session(offer=offer_params)
+            except TimeoutError:
+                res = JSONResponse({"error": "Offer timeout."})
+                res.status_code = status.HTTP_504_GATEWAY_TIMEOUT
+                return res
             self.__logger.info(
                 (
                     f"Client: {request.client}\n"
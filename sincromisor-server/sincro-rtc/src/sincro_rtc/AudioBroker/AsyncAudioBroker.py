@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from logging import Logger
+from typing import Any
+
+from sincro_models import (
+    ChatHistory,
+    ChatMessage,
+    SpeechExtractorInitializeRequest,
+    SpeechExtractorResult,
+    SpeechRecognizerResult,
+    TextProcessorRequest,
+    TextProcessorResult,
+    VoiceSynthesizerResult,
+    VoiceSynthesizerResultFrame,
+    VoiceSynthesizerStreamChunk,
+    VoiceSynthesizerStreamHeader,
+    unpack_voice_synthesizer_message,
+)
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+
+from ..models import VoicePlayoutOptions
+from .AudioBrokerWorkerLocator import AudioBrokerWorkerLocator
+from .Exceptions import AudioBrokerError
+from .VoiceOpusEncoder import VoiceOpusEncoder
+from .VoicePlayoutBuffer import VoicePlayoutBuffer
+from .VoiceStreamDecoder import VoiceStreamDecoder
+
+
+# AudioBrokerのasyncio版。
+# RTCSessionProcessのイベントループ上で動作し、各サービスとの通信を
+# スレッドではなくタスクで行う。ステージ間はasyncio.Queueで繋ぎ、
+# ポーリングせずに到着次第次のステージへ渡す。
+# VoiceTransformTrackから見たインターフェースはAudioBrokerと同じ。
+class AsyncAudioBroker:
+    # talk_mode: chat, sincro
+    def __init__(
+        self,
+        session_id: str,
+        talk_mode: str,
+        consul_agent_host: str | None,
+        consul_agent_port: int | None,
+        fallback_host: str | None = None,
+        fallback_port: int | None = None,
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
+    ):
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
+        )
+        self.__session_id: str = session_id
+        # SpeechExtractorへ送る音声の形式(pcm, opus)
+        self.__extractor_codec: str = extractor_codec
+        self.__locator: AudioBrokerWorkerLocator = AudioBrokerWorkerLocator(
+            session_id=session_id,
+            talk_mode=talk_mode,
+            consul_agent_host=consul_agent_host,
+            consul_agent_port=consul_agent_port,
+            fallback_host=fallback_host,
+            fallback_port=fallback_port,
+            synthesizer_audio_format=synthesizer_audio_format,
+        )
+
+        # AsyncAudioBrokerもしくはいずれかのタスクで問題が発生したら、
+        # runningをFalseにして全てを停止する。
+        self.__running: bool = True
+
+        # VoiceTransformTrack
+        # -> extractor_sender: bytes | memoryview(int16, 16000Hz, 1chのPCM)
+        self.__frame_buffer: asyncio.Queue[bytes | memoryview] = asyncio.Queue(25)
+        # extractor_receiver
+        # -> recognizer_sender: bytes(SpeechExtractorResultのpacket)
+        self.__extractor_results: asyncio.Queue[bytes] = asyncio.Queue(10)
+        # recognizer_receiver
+        # -> text_processor_sender: SpeechRecognizerResult
+        self.__recognizer_results: asyncio.Queue[SpeechRecognizerResult] = (
+            asyncio.Queue(10)
+        )
+        # text_processor_receiver
+        # -> synthesizer_sender: TextProcessorResult
+        self.__text_processor_results: asyncio.Queue[TextProcessorResult] = (
+            asyncio.Queue(10)
+        )
+
+        # VoiceTransformTrackから利用
+        # (同じイベントループ上で取り出されるため、dequeのままとする)
+        # text_processor_sender, text_processor_receiver
+        # -> VoiceTransformTrack: ChatMessage
+        self.text_channel_queue: deque = deque([])
+        # synthesizer_receiver
+        # -> VoiceTransformTrack: VoiceSynthesizerResultFrame
+        # (書き込みはデコード用のスレッドから行う)
+        if playout_options is None:
+            playout_options = VoicePlayoutOptions()
+        self.voice_playout_buffer: VoicePlayoutBuffer = VoicePlayoutBuffer(
+            **playout_options.model_dump()
+        )
+
+        self.return_frame_format = {"sample_rate": 48000, "sample_size": 960}
+
+        self.__connections: list[ClientConnection] = []
+        self.__main_task: asyncio.Task = asyncio.ensure_future(self.__run())
+
+    def is_running(self) -> bool:
+        return self.__running
+
+    # セッションごとの状態。RTCSessionHandlerから定期的に集められる。
+    def statuses(self) -> dict:
+        return {"playout": self.voice_playout_buffer.statuses()}
+
+    def close(self) -> None:
+        self.__logger.info("Stopping AsyncAudioBroker...")
+        if not self.__running:
+            self.__logger.warning("AsyncAudioBroker is not running.")
+            return
+        self.__logger.info("STOP AsyncAudioBroker...")
+        self.__running = False
+        # 書き込みを待っているスレッドを解放する
+        self.voice_playout_buffer.close()
+        self.__main_task.cancel()
+        self.__logger.info(
+            f"VoicePlayoutBuffer: {self.voice_playout_buffer.statuses()}"
+        )
+
+    def add_frame(self, frame: bytes | memoryview) -> None:
+        if not self.__running:
+            raise AudioBrokerError("AsyncAudioBroker is not running.")
+        if self.__put_latest(self.__frame_buffer, frame):
+            self.__logger.warning("add_frame - overflow")
+
+    # キューが一杯の場合は最も古い要素を捨てて追加する(deque(maxlen)と同じ挙動)。
+    # 要素を捨てた場合はTrueを返す。
+    def __put_latest(self, queue: asyncio.Queue, item: Any) -> bool:
+        overflow: bool = False
+        while True:
+            try:
+                queue.put_nowait(item)
+                return overflow
+            except asyncio.QueueFull:
+                queue.get_nowait()
+                overflow = True
+
+    async def __connect(self, comm_type: str, ws_url: str) -> ClientConnection:
+        self.__logger.info(f"Connecting {comm_type} - {ws_url}")
+        ws: ClientConnection = await connect(ws_url)
+        self.__connections.append(ws)
+        return ws
+
+    async def __run(self) -> None:
+        tasks: list[asyncio.Task] = []
+        try:
+            # Consulへの問い合わせはブロッキングなので、スレッドに逃がす。
+            extractor_ws = await self.__connect(
+                "SpeechExtractor",
+                await asyncio.to_thread(self.__locator.extractor_url),
+            )
+            recognizer_ws = await self.__connect(
+                "SpeechRecognizer",
+                await asyncio.to_thread(self.__locator.recognizer_url),
+            )
+            text_processor_ws = await self.__connect(
+                "TextProcessor",
+                await asyncio.to_thread(self.__locator.text_processor_url),
+            )
+            synthesizer_ws = await self.__connect(
+                "VoiceSynthesizer",
+                await asyncio.to_thread(self.__locator.synthesizer_url),
+            )
+            tasks = [
+                asyncio.create_task(self.__extractor_sender(extractor_ws)),
+                asyncio.create_task(self.__extractor_receiver(extractor_ws)),
+                asyncio.create_task(self.__recognizer_sender(recognizer_ws)),
+                asyncio.create_task(self.__recognizer_receiver(recognizer_ws)),
+                asyncio.create_task(self.__text_processor_sender(text_processor_ws)),
+                asyncio.create_task(
+                    self.__text_processor_receiver(text_processor_ws),
+                ),
+                asyncio.create_task(self.__synthesizer_sender(synthesizer_ws)),
+                asyncio.create_task(self.__synthesizer_receiver(synthesizer_ws)),
+            ]
+            # いずれかのタスクが終了したら、全体を停止する。
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self.__logger.info("Cancelled.")
+        except AudioBrokerError:
+            self.__logger.error(f"AudioBrokerError: {traceback.format_exc()}")
+            self.__err_to_chat(message=f"AudioBrokerError: {traceback.format_exc()}")
+        except ConnectionRefusedError:
+            self.__logger.error(f"ConnectionRefusedError: {traceback.format_exc()}")
+            self.__err_to_chat(
+                message=f"ConnectionRefusedError: {traceback.format_exc()}"
+            )
+        except TimeoutError:
+            self.__logger.error(f"TimeoutError: {traceback.format_exc()}")
+            self.__err_to_chat(message=f"TimeoutError: {traceback.format_exc()}")
+        except Exception as e:
+            self.__logger.error(f"UnknownError: {repr(e)}\n{traceback.format_exc()}")
+            self.__err_to_chat(
+                message=f"UnknownError: {repr(e)}\n{traceback.format_exc()}"
+            )
+        finally:
+            self.__running = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for ws in self.__connections:
+                try:
+                    await ws.close()
+                except Exception as e:
+                    self.__logger.error(f"Unknown Error: {repr(e)}")
+            self.__logger.info("AsyncAudioBroker closed.")
+
+    # 各ステージのタスクの共通の終了処理。
+    # ConnectionClosedは正常終了扱いとする。
+    async def __stage(self, name: str, coro) -> None:
+        self.__logger.info(f"{name} - Task start.")
+        try:
+            await coro
+        except ConnectionClosed:
+            self.__logger.info(f"{name} - ConnectionClosed.")
+        except asyncio.CancelledError:
+            self.__logger.info(f"{name} - Cancelled.")
+            raise
+        except Exception as e:
+            self.__logger.error(
+                f"{name} - UnknownError: {repr(e)}\n{traceback.format_exc()}"
+            )
+        finally:
+            self.__logger.info(f"{name} - Task terminated.")
+
+    async def __extractor_sender(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            init_request = SpeechExtractorInitializeRequest(
+                session_id=self.__session_id,
+                result_format="packet",
+                voice_codec=self.__extractor_codec,
+            )
+            await ws.send(init_request.to_msgpack())
+            encoder: VoiceOpusEncoder | None = None
+            if self.__extractor_codec == "opus":
+                encoder = VoiceOpusEncoder(
+                    sampling_rate=init_request.voice_sampling_rate
+                )
+            while True:
+                buffer: bytes | memoryview = await self.__frame_buffer.get()
+                if encoder is None:
+                    await ws.send(buffer)
+                else:
+                    for packet in encoder.encode(buffer):
+                        await ws.send(packet)
+
+        await self.__stage("ExtractorSender", run())
+
+    async def __extractor_receiver(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            async for pack in ws:
+                assert isinstance(pack, bytes)
+                se_result: SpeechExtractorResult = SpeechExtractorResult.from_bytes(
+                    pack,
+                )
+                self.__logger.info(se_result)
+                # 音声の組み立てはRecognizer側で行うため、受信したまま転送する
+                self.__put_latest(self.__extractor_results, pack)
+
+        await self.__stage("ExtractorReceiver", run())
+
+    async def __recognizer_sender(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            # 各パケットは前回以降の音声のみを含み、Recognizer側で
+            # voice_offsetを元に発話単位へ組み立てられる。
+            # (認識中に届いたパケットのまとめもRecognizer側で行う)
+            while True:
+                await ws.send(await self.__extractor_results.get())
+
+        await self.__stage("RecognizerSender", run())
+
+    async def __recognizer_receiver(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            async for pack in ws:
+                assert isinstance(pack, bytes)
+                sr_result: SpeechRecognizerResult = SpeechRecognizerResult.from_msgpack(
+                    pack,
+                )
+                self.__put_latest(self.__recognizer_results, sr_result)
+
+        await self.__stage("RecognizerReceiver", run())
+
+    async def __text_processor_sender(self, ws: ClientConnection) -> None:
+        def new_message() -> ChatMessage:
+            return ChatMessage(
+                message_type="user",
+                speaker_id="user",
+                speaker_name="User",
+                message="",
+            )
+
+        async def run() -> None:
+            chat_history: ChatHistory = ChatHistory()
+            current_message: ChatMessage = new_message()
+            while True:
+                rec_result: SpeechRecognizerResult = (
+                    await self.__recognizer_results.get()
+                )
+                current_message.message = rec_result.result_text()
+                if rec_result.confirmed:
+                    chat_history.append(current_message)
+                    self.__logger.info(chat_history)
+                request: TextProcessorRequest = TextProcessorRequest(
+                    session_id=rec_result.session_id,
+                    speech_id=rec_result.speech_id,
+                    sequence_id=rec_result.sequence_id,
+                    confirmed=rec_result.confirmed,
+                    history=chat_history,
+                    request_message=current_message,
+                )
+                if rec_result.confirmed:
+                    current_message = new_message()
+                self.text_channel_queue.append(request.request_message)
+                await ws.send(request.to_msgpack())
+
+        await self.__stage("TextProcessorSender", run())
+
+    async def __text_processor_receiver(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            async for pack in ws:
+                assert isinstance(pack, bytes)
+                tp_result: TextProcessorResult = TextProcessorResult.from_msgpack(pack)
+                # to synthesizer_sender
+                self.__put_latest(self.__text_processor_results, tp_result)
+                # to TextChannel
+                self.text_channel_queue.append(tp_result.response_message)
+
+        await self.__stage("TextProcessorReceiver", run())
+
+    async def __synthesizer_sender(self, ws: ClientConnection) -> None:
+        async def run() -> None:
+            while True:
+                tp_result: TextProcessorResult = (
+                    await self.__text_processor_results.get()
+                )
+                self.__logger.info(f"Send: {repr(tp_result)}")
+                await ws.send(tp_result.to_msgpack())
+
+        await self.__stage("SynthesizerSender", run())
+
+    async def __synthesizer_receiver(self, ws: ClientConnection) -> None:
+        decoder: VoiceStreamDecoder = VoiceStreamDecoder()
+
+        async def run() -> None:
+            async for pack in ws:
+                assert isinstance(pack, bytes)
+                # デコードとリサンプリングはCPUを使うため、イベントループを止めないよう
+                # スレッドで行う。メッセージは届いた順に1つずつ処理する。
+                await asyncio.to_thread(self.__push_voice_frames, decoder, pack)
+
+        await self.__stage("SynthesizerReceiver", run())
+
+    # デコードしたフレームから順に書き込み、発話全体の受信やデコードを待たずに
+    # 再生を始められるようにする。
+    # バッファが一杯の場合、push()は空きが出るまで(このスレッドで)待つ。
+    def __push_voice_frames(self, decoder: VoiceStreamDecoder, pack: bytes) -> None:
+        message: (
+            VoiceSynthesizerResult
+            | VoiceSynthesizerStreamHeader
+            | VoiceSynthesizerStreamChunk
+        ) = unpack_voice_synthesizer_message(pack)
+        vs_frames: list[VoiceSynthesizerResultFrame]
+        match message:
+            case VoiceSynthesizerStreamHeader():
+                decoder.start(
+                    message,
+                    target_frame_rate=self.return_frame_format["sample_rate"],
+                    target_frame_size=self.return_frame_format["sample_size"],
+                )
+                return
+            case VoiceSynthesizerStreamChunk():
+                vs_frames = decoder.feed(message.voice)
+                if message.last:
+                    vs_frames += decoder.finish()
+            case VoiceSynthesizerResult():
+                vs_frames = decoder.decode(
+                    message,
+                    target_frame_rate=self.return_frame_format["sample_rate"],
+                    target_frame_size=self.return_frame_format["sample_size"],
+                )
+        for vs_frame in vs_frames:
+            self.voice_playout_buffer.push(vs_frame)
+        if isinstance(message, VoiceSynthesizerResult) or message.last:
+            self.voice_playout_buffer.end_utterance()
+
+    def __err_to_chat(self, message: str) -> None:
+        self.text_channel_queue.append(
+            ChatMessage(
+                message_type="error",
+                speaker_id="system",
+                speaker_name="Sincromisor",
+                message=message,
+            )
+        )
@@ -4,14 +4,11 @@ from collections import deque
 from logging import Logger
 from threading import Event, Thread
 
-from sincro_config import (
-    ServiceDescription,
-    ServiceDiscoveryReferrer,
-    ServiceDiscoveryReferrerError,
-)
 from sincro_models import ChatMessage
 from websockets.sync.client import ClientConnection, connect
 
+from ..models import VoicePlayoutOptions
+from .AudioBrokerWorkerLocator import AudioBrokerWorkerLocator
 from .Exceptions import AudioBrokerError
 from .ExtractorReceiverThread import ExtractorReceiverThread
 from .ExtractorSenderThread import ExtractorSenderThread
@@ -21,6 +18,7 @@ from .SynthesizerReceiverThread import SynthesizerReceiverThread
 from .SynthesizerSenderThread import SynthesizerSenderThread
 from .TextProcessorReceiverThread import TextProcessorReceiverThread
 from .TextProcessorSenderThread import TextProcessorSenderThread
+from .VoicePlayoutBuffer import VoicePlayoutBuffer
 
 
 class AudioBrokerCommunicator:
@@ -113,19 +111,25 @@ class AudioBroker:
         consul_agent_port: int | None,
         fallback_host: str | None = None,
         fallback_port: int | None = None,
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
     ):
         self.__logger: Logger = logging.getLogger(
             "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
         )
         self.__session_id: str = session_id
-        self.__talk_mode: str = talk_mode
-        self.__sd_refrrer: ServiceDiscoveryReferrer | None = None
-        if consul_agent_host and consul_agent_port:
-            self.__sd_refrrer = ServiceDiscoveryReferrer(
-                consul_agent_host=consul_agent_host, consul_agent_port=consul_agent_port
-            )
-        self.__fallback_host: str | None = fallback_host
-        self.__fallback_port: int | None = fallback_port
+        # SpeechExtractorへ送る音声の形式(pcm, opus)
+        self.__extractor_codec: str = extractor_codec
+        self.__locator: AudioBrokerWorkerLocator = AudioBrokerWorkerLocator(
+            session_id=session_id,
+            talk_mode=talk_mode,
+            consul_agent_host=consul_agent_host,
+            consul_agent_port=consul_agent_port,
+            fallback_host=fallback_host,
+            fallback_port=fallback_port,
+            synthesizer_audio_format=synthesizer_audio_format,
+        )
 
         # AudioBrokerもしくは子スレッドでなにかしらの問題が発生したら、
         # runningをclearして全てを停止する。
@@ -133,10 +137,10 @@ class AudioBroker:
         self.__running.set()
 
         # VoiceTransformTrack
-        # -> ExtractorSenderThread: bytes
+        # -> ExtractorSenderThread: bytes | memoryview(int16, 16000Hz, 1chのPCM)
         self.__frame_buffer: deque = deque([], 25)
         # ExtractorReceiverThread
-        # -> RecognizerSenderThread: SpeechExtractorResult
+        # -> RecognizerSenderThread: bytes(SpeechExtractorResultのpacket)
         self.__extractor_results: deque = deque([], 10)
         # RecognizerReceiverThread
         # -> TextProcessorSenderThread: SpeechRecognizerResult
@@ -152,7 +156,11 @@ class AudioBroker:
         self.text_channel_queue: deque = deque([])
         # SynthesizerReceiverThread
         # -> VoiceTransformTrack: VoiceSynthesizerResultFrame
-        self.voice_frame_queue: deque = deque([])
+        if playout_options is None:
+            playout_options = VoicePlayoutOptions()
+        self.voice_playout_buffer: VoicePlayoutBuffer = VoicePlayoutBuffer(
+            **playout_options.model_dump()
+        )
 
         self.return_frame_format = {"sample_rate": 48000, "sample_size": 960}
 
@@ -187,6 +195,10 @@ class AudioBroker:
     def is_running(self) -> bool:
         return self.__running.is_set()
 
+    # セッションごとの状態。RTCSessionHandlerから定期的に集められる。
+    def statuses(self) -> dict:
+        return {"playout": self.voice_playout_buffer.statuses()}
+
     def close(self) -> None:
         self.__logger.info("Stopping AudioBroker...")
         if not self.__running.is_set():
@@ -194,45 +206,19 @@ class AudioBroker:
             return
         self.__logger.info("STOP AudioBroker...")
         self.__running.clear()
+        # 書き込みを待っているSynthesizerReceiverThreadを解放する
+        self.voice_playout_buffer.close()
         try:
             self.__communicators.close()
         except AttributeError:
             self.__logger.error("__communicators is not defined.")
+        self.__logger.info(
+            f"VoicePlayoutBuffer: {self.voice_playout_buffer.statuses()}"
+        )
         self.__logger.info("AudioBroker closed.")
 
-    def __get_worker(self, worker_type: str) -> ServiceDescription:
-        worker: ServiceDescription | None
-        try:
-            if self.__sd_refrrer is None:
-                raise ServiceDiscoveryReferrerError("Consul agent is not set.")
-            worker = self.__sd_refrrer.get_random_worker(worker_type=worker_type)
-        except ServiceDiscoveryReferrerError as e:
-            self.__logger.error(
-                f"ServiceDiscoveryReferrerError: {repr(e)}\n{traceback.format_exc()}"
-            )
-            if self.__fallback_host is None or self.__fallback_port is None:
-                raise AudioBrokerError(f"{worker_type} fallback worker is not found.")
-            worker = ServiceDescription(
-                index=-1,
-                service_name=worker_type,
-                service_id=f"{worker_type}FallbackServer",
-                service_address=self.__fallback_host,
-                service_port=self.__fallback_port,
-            )
-        if worker is None:
-            raise AudioBrokerError(f"{worker_type} worker is not found.")
-        return worker
-
     def __extractor(self) -> AudioBrokerCommunicator:
-        worker: ServiceDescription = self.__get_worker(worker_type="SpeechExtractor")
-        match self.__talk_mode:
-            case "chat":
-                max_slince_ms: int = 1000
-            case "sincro":
-                max_slince_ms: int = 600
-            case _:
-                max_slince_ms: int = 1000
-        ws_url: str = f"ws://{worker.service_address}:{worker.service_port}/api/v1/SpeechExtractor/extract?max_silence_ms={max_slince_ms}"
+        ws_url: str = self.__locator.extractor_url()
         self.__logger.info(f"Connecting {ws_url}")
         ws: ClientConnection = connect(ws_url)
         sender_t: ExtractorSenderThread = ExtractorSenderThread(
@@ -240,6 +226,7 @@ class AudioBroker:
             running=self.__running,
             session_id=self.__session_id,
             frame_buffer=self.__frame_buffer,
+            codec=self.__extractor_codec,
         )
         sender_t.start()
         receiver_t: ExtractorReceiverThread = ExtractorReceiverThread(
@@ -259,8 +246,7 @@ class AudioBroker:
         )
 
     def __recognizer(self) -> AudioBrokerCommunicator:
-        worker: ServiceDescription = self.__get_worker(worker_type="SpeechRecognizer")
-        ws_url: str = f"ws://{worker.service_address}:{worker.service_port}/api/v1/SpeechRecognizer/recognize"
+        ws_url: str = self.__locator.recognizer_url()
         self.__logger.info(f"Connecting {ws_url}")
         ws: ClientConnection = connect(ws_url)
         sender_t: RecognizerSenderThread = RecognizerSenderThread(
@@ -287,8 +273,7 @@ class AudioBroker:
         )
 
     def __text_processor(self) -> AudioBrokerCommunicator:
-        worker: ServiceDescription = self.__get_worker(worker_type="TextProcessor")
-        ws_url: str = f"ws://{worker.service_address}:{worker.service_port}/api/v1/TextProcessor/{self.__talk_mode}"
+        ws_url: str = self.__locator.text_processor_url()
         self.__logger.info(f"Connecting {ws_url}")
         ws: ClientConnection = connect(ws_url)
         sender_t: TextProcessorSenderThread = TextProcessorSenderThread(
@@ -317,8 +302,7 @@ class AudioBroker:
         )
 
     def __synthesizer(self) -> AudioBrokerCommunicator:
-        worker: ServiceDescription = self.__get_worker(worker_type="VoiceSynthesizer")
-        ws_url: str = f"ws://{worker.service_address}:{worker.service_port}/api/v1/VoiceSynthesizer/synthesize"
+        ws_url: str = self.__locator.synthesizer_url()
         self.__logger.info(f"Connecting {ws_url}")
         ws: ClientConnection = connect(ws_url)
         sender_t: SynthesizerSenderThread = SynthesizerSenderThread(
@@ -330,7 +314,7 @@ class AudioBroker:
         sender_t.start()
         receiver_t: SynthesizerReceiverThread = SynthesizerReceiverThread(
             ws=ws,
-            voice_frame_queue=self.voice_frame_queue,
+            voice_playout_buffer=self.voice_playout_buffer,
             return_frame_format=self.return_frame_format,
             running=self.__running,
             session_id=self.__session_id,
@@ -345,7 +329,7 @@ class AudioBroker:
             receiver_thread=receiver_t,
         )
 
-    def add_frame(self, frame: bytes) -> None:
+    def add_frame(self, frame: bytes | memoryview) -> None:
         if not self.__running.is_set():
             raise AudioBrokerError("AudioBroker is not running.")
 
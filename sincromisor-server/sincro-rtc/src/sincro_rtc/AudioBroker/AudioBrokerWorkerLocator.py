@@ -0,0 +1,94 @@
+import logging
+import traceback
+from logging import Logger
+from urllib.parse import urlencode
+
+from sincro_config import (
+    ServiceDescription,
+    ServiceDiscoveryReferrer,
+    ServiceDiscoveryReferrerError,
+)
+
+from .Exceptions import AudioBrokerError
+
+
+# AudioBrokerが接続する各サービスのワーカーを探し、接続先URLを組み立てる。
+# スレッド版(AudioBroker)とasyncio版(AsyncAudioBroker)で共有する。
+class AudioBrokerWorkerLocator:
+    def __init__(
+        self,
+        session_id: str,
+        talk_mode: str,
+        consul_agent_host: str | None,
+        consul_agent_port: int | None,
+        fallback_host: str | None = None,
+        fallback_port: int | None = None,
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+    ):
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
+        )
+        self.__talk_mode: str = talk_mode
+        self.__sd_refrrer: ServiceDiscoveryReferrer | None = None
+        if consul_agent_host and consul_agent_port:
+            self.__sd_refrrer = ServiceDiscoveryReferrer(
+                consul_agent_host=consul_agent_host, consul_agent_port=consul_agent_port
+            )
+        self.__fallback_host: str | None = fallback_host
+        self.__fallback_port: int | None = fallback_port
+        # VoiceSynthesizerに要求する音声データフォーマット
+        # audio/pcm;rate=48000を指定すると、エンコードもデコードもせずにPCMを受け取る。
+        self.__synthesizer_audio_format: str = synthesizer_audio_format
+
+    def get_worker(self, worker_type: str) -> ServiceDescription:
+        worker: ServiceDescription | None
+        try:
+            if self.__sd_refrrer is None:
+                raise ServiceDiscoveryReferrerError("Consul agent is not set.")
+            worker = self.__sd_refrrer.get_random_worker(worker_type=worker_type)
+        except ServiceDiscoveryReferrerError as e:
+            self.__logger.error(
+                f"ServiceDiscoveryReferrerError: {repr(e)}\n{traceback.format_exc()}"
+            )
+            if self.__fallback_host is None or self.__fallback_port is None:
+                raise AudioBrokerError(f"{worker_type} fallback worker is not found.")
+            worker = ServiceDescription(
+                index=-1,
+                service_name=worker_type,
+                service_id=f"{worker_type}FallbackServer",
+                service_address=self.__fallback_host,
+                service_port=self.__fallback_port,
+            )
+        if worker is None:
+            raise AudioBrokerError(f"{worker_type} worker is not found.")
+        return worker
+
+    def extractor_url(self) -> str:
+        worker: ServiceDescription = self.get_worker(worker_type="SpeechExtractor")
+        match self.__talk_mode:
+            case "chat":
+                max_slince_ms: int = 1000
+            case "sincro":
+                max_slince_ms: int = 600
+            case _:
+                max_slince_ms: int = 1000
+        return f"ws://{worker.service_address}:{worker.service_port}/api/v1/SpeechExtractor/extract?max_silence_ms={max_slince_ms}"
+
+    def recognizer_url(self) -> str:
+        worker: ServiceDescription = self.get_worker(worker_type="SpeechRecognizer")
+        return f"ws://{worker.service_address}:{worker.service_port}/api/v1/SpeechRecognizer/recognize"
+
+    def text_processor_url(self) -> str:
+        worker: ServiceDescription = self.get_worker(worker_type="TextProcessor")
+        return f"ws://{worker.service_address}:{worker.service_port}/api/v1/TextProcessor/{self.__talk_mode}"
+
+    # stream=1を付けると、VoiceSynthesizerはヘッダと音声の断片を順に送る。
+    # audio_formatは接続ごとに使う音声データフォーマット。
+    # 対応していないVoiceSynthesizerはこれらを無視してVoiceSynthesizerResultを
+    # 送るが、どちらもVoiceStreamDecoderで扱える。
+    def synthesizer_url(self) -> str:
+        worker: ServiceDescription = self.get_worker(worker_type="VoiceSynthesizer")
+        query: str = urlencode(
+            {"stream": 1, "audio_format": self.__synthesizer_audio_format}
+        )
+        return f"ws://{worker.service_address}:{worker.service_port}/api/v1/VoiceSynthesizer/synthesize?{query}"
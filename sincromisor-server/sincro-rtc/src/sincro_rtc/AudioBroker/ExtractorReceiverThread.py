@@ -33,11 +33,12 @@ class ExtractorReceiverThread(Thread):
             try:
                 pack: Data = self.__ws.recv(timeout=5)
                 assert isinstance(pack, bytes)
-                se_result: SpeechExtractorResult = SpeechExtractorResult.from_msgpack(
+                se_result: SpeechExtractorResult = SpeechExtractorResult.from_bytes(
                     pack,
                 )
                 self.__logger.info(se_result)
-                self.__extractor_results.append(se_result)
+                # 音声の組み立てはRecognizer側で行うため、受信したまま転送する
+                self.__extractor_results.append(pack)
             except TimeoutError:
                 pass  # タイムアウトした時のみやり直す。
             except ConnectionClosed:
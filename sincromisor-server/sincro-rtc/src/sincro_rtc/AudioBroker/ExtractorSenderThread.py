@@ -9,6 +9,8 @@ from sincro_models import SpeechExtractorInitializeRequest
 from websockets.exceptions import ConnectionClosed
 from websockets.sync.client import ClientConnection
 
+from .VoiceOpusEncoder import VoiceOpusEncoder
+
 
 class ExtractorSenderThread(Thread):
     def __init__(
@@ -17,25 +19,42 @@ class ExtractorSenderThread(Thread):
         running: Event,
         session_id: str,
         frame_buffer: deque,
+        codec: str = "pcm",
     ):
         super().__init__()
-        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]")
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
+        )
         self.__ws: ClientConnection = ws
         self.__running: Event = running
         self.__session_id: str = session_id
         self.__frame_buffer: deque = frame_buffer
+        # pcm: int16のPCMをそのまま送る
+        # opus: VoiceOpusEncoderでエンコードしたパケットを送る
+        self.__codec: str = codec
 
     def run(self) -> None:
         self.__logger.info("Thread start.")
         try:
             init_request = SpeechExtractorInitializeRequest(
                 session_id=self.__session_id,
+                result_format="packet",
+                voice_codec=self.__codec,
             )
             self.__ws.send(init_request.to_msgpack())
+            encoder: VoiceOpusEncoder | None = None
+            if self.__codec == "opus":
+                encoder = VoiceOpusEncoder(
+                    sampling_rate=init_request.voice_sampling_rate
+                )
             while self.__running.is_set():
                 try:
-                    buffer: bytes = self.__frame_buffer.popleft()
-                    self.__ws.send(buffer)
+                    buffer: bytes | memoryview = self.__frame_buffer.popleft()
+                    if encoder is None:
+                        self.__ws.send(buffer)
+                    else:
+                        for packet in encoder.encode(buffer):
+                            self.__ws.send(packet)
                 except IndexError:
                     time.sleep(0.1)
             self.__logger.info("Cancelled by another thread.")
@@ -5,7 +5,6 @@ from collections import deque
 from logging import Logger
 from threading import Event, Thread
 
-from sincro_models import SpeechExtractorResult
 from websockets.exceptions import ConnectionClosed
 from websockets.sync.client import ClientConnection
 
@@ -27,28 +26,15 @@ class RecognizerSenderThread(Thread):
         self.__extractor_results: deque = extractor_results
         self.__running: Event = running
 
-    def __pop_extractor_result(self) -> bytes:
-        base_e_result: SpeechExtractorResult = self.__extractor_results.popleft()
-
-        # 音声認識に時間が掛かった場合、Extractorから複数の音声パケットが
-        # 届いている場合がある。この場合は、各パケットの音声データを結合する。
-        # パケットに音声の末端である(confirmed=Trueである)場合は、
-        # そこで結合を終了し返す。
-        while len(self.__extractor_results) > 0:
-            e_result: SpeechExtractorResult = self.__extractor_results.popleft()
-            base_e_result.append_voice(e_result.voice)
-            base_e_result.sequence_id = e_result.sequence_id
-            if e_result.confirmed:
-                return base_e_result.to_msgpack()
-        return base_e_result.to_msgpack()
-
     def run(self) -> None:
         self.__logger.info("Thread start.")
         try:
             last_ping: float = time.time()
             while self.__running.is_set():
                 if len(self.__extractor_results) > 0:
-                    self.__ws.send(self.__pop_extractor_result())
+                    # 各パケットは前回以降の音声のみを含み、Recognizer側で
+                    # voice_offsetを元に発話単位へ組み立てられる。
+                    self.__ws.send(self.__extractor_results.popleft())
                 else:
                     if last_ping < time.time() + 10:
                         self.__ws.ping()
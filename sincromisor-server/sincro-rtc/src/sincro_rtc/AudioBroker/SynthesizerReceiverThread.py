@@ -1,28 +1,27 @@
 import logging
 import traceback
-from collections import deque
-from collections.abc import Generator
-from io import BytesIO
 from threading import Event, Thread
 
-from av.audio.resampler import AudioResampler
-from av.container import InputContainer
-from av.container import open as av_open
 from sincro_models import (
-    VoiceSynthesizerMora,
     VoiceSynthesizerResult,
     VoiceSynthesizerResultFrame,
+    VoiceSynthesizerStreamChunk,
+    VoiceSynthesizerStreamHeader,
+    unpack_voice_synthesizer_message,
 )
 from websockets.exceptions import ConnectionClosed
 from websockets.sync.client import ClientConnection
 from websockets.typing import Data
 
+from .VoicePlayoutBuffer import VoicePlayoutBuffer
+from .VoiceStreamDecoder import VoiceStreamDecoder
+
 
 class SynthesizerReceiverThread(Thread):
     def __init__(
         self,
         ws: ClientConnection,
-        voice_frame_queue: deque,
+        voice_playout_buffer: VoicePlayoutBuffer,
         return_frame_format: dict,
         running: Event,
         session_id: str,
@@ -32,10 +31,11 @@ class SynthesizerReceiverThread(Thread):
             "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
         )
         self.__ws: ClientConnection = ws
-        self.__voice_frame_queue: deque = voice_frame_queue
+        self.__voice_playout_buffer: VoicePlayoutBuffer = voice_playout_buffer
         self.__return_frame_format: dict = return_frame_format
         self.__running: Event = running
         self.__session_id: str = session_id
+        self.__decoder: VoiceStreamDecoder = VoiceStreamDecoder()
 
     def run(self) -> None:
         self.__logger.info("Thread start.")
@@ -43,15 +43,7 @@ class SynthesizerReceiverThread(Thread):
             try:
                 pack: Data = self.__ws.recv(timeout=5)
                 assert isinstance(pack, bytes)
-                vs_result: VoiceSynthesizerResult = VoiceSynthesizerResult.from_msgpack(
-                    pack,
-                )
-                for vs_frame in self.__voice_splitter(
-                    vs_result=vs_result,
-                    target_frame_rate=self.__return_frame_format["sample_rate"],
-                    target_frame_size=self.__return_frame_format["sample_size"],
-                ):
-                    self.__voice_frame_queue.append(vs_frame)
+                self.__on_message(pack)
             except TimeoutError:
                 pass  # タイムアウトした時のみやり直す。
             except ConnectionClosed:
@@ -66,50 +58,35 @@ class SynthesizerReceiverThread(Thread):
         self.__logger.info("Thread terminated.")
         self.__running.clear()
 
-    # 音声を指定されたフレームレートとフレーム長にリサンプリングし、
-    # フレームごとに音声再生・口モーション用キューに書き出す。
-    def __voice_splitter(
-        self,
-        vs_result: VoiceSynthesizerResult,
-        target_frame_rate: int,
-        target_frame_size: int,
-    ) -> Generator[VoiceSynthesizerResultFrame, None, None]:
-        # 音声をs16 2ch 48000Hzに変換し、20ms(960 / 48000)ごとに分割し直す。
-        # ソースの音声はコーデックなどによりフォーマットが変化する。
-        # (wav: 1ch s16 24000Hz, opus: 1ch float32 48000Hz)
-        # 960はWebRTCでopus音声を得た際のデフォルトフレームサイズだが、
-        # 環境によって異なる可能性がある(要調査)。
-        resampler = AudioResampler(
-            layout=2,
-            format="s16",
-            rate=target_frame_rate,
-            frame_size=target_frame_size,
-        )
-        container: InputContainer = av_open(BytesIO(vs_result.voice), mode="r")
-        frame_ms: float = target_frame_size / target_frame_rate
-        timestamp_sec: float = 0.0
-        next_time_sec: float = 0.0
-        # mora = {'vowel': None, 'length': 0.0, 'text': None}
-        mora: VoiceSynthesizerMora | None = None
-        for decoded_frames in container.decode(audio=0):
-            for resampled_frame in resampler.resample(decoded_frames):
-                # 1文字につき複数のフレームがあるため、
-                # 初回のフレームであることが分かるフラグを用意する(口パク用)。
-                new_text: bool = False
-                if vs_result.mora_queue and timestamp_sec >= next_time_sec:
-                    mora = vs_result.mora_queue.pop(0)
-                    next_time_sec += mora.length
-                    new_text = True
-                assert isinstance(mora, VoiceSynthesizerMora), (
-                    f"mora must be VoiceSynthesizerMora, but got {type(mora)}"
+    # デコードしたフレームから順に書き込み、発話全体の受信やデコードを待たずに
+    # 再生を始められるようにする。
+    # バッファが一杯の場合、push()は空きが出るまで待つ。
+    def __on_message(self, pack: bytes) -> None:
+        message: (
+            VoiceSynthesizerResult
+            | VoiceSynthesizerStreamHeader
+            | VoiceSynthesizerStreamChunk
+        ) = unpack_voice_synthesizer_message(pack)
+        vs_frames: list[VoiceSynthesizerResultFrame]
+        match message:
+            case VoiceSynthesizerStreamHeader():
+                self.__decoder.start(
+                    message,
+                    target_frame_rate=self.__return_frame_format["sample_rate"],
+                    target_frame_size=self.__return_frame_format["sample_size"],
                 )
-                yield VoiceSynthesizerResultFrame(
-                    timestamp=timestamp_sec,
-                    message=vs_result.message,
-                    vowel=mora.vowel,
-                    length=mora.length,
-                    text=mora.text,
-                    new_text=new_text,
-                    vframe=resampled_frame.to_ndarray(),
+                return
+            case VoiceSynthesizerStreamChunk():
+                vs_frames = self.__decoder.feed(message.voice)
+                if message.last:
+                    vs_frames += self.__decoder.finish()
+            case VoiceSynthesizerResult():
+                vs_frames = self.__decoder.decode(
+                    message,
+                    target_frame_rate=self.__return_frame_format["sample_rate"],
+                    target_frame_size=self.__return_frame_format["sample_size"],
                 )
-                timestamp_sec += frame_ms
+        for vs_frame in vs_frames:
+            self.__voice_playout_buffer.push(vs_frame)
+        if isinstance(message, VoiceSynthesizerResult) or message.last:
+            self.__voice_playout_buffer.end_utterance()
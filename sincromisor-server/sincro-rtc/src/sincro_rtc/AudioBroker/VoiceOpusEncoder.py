@@ -0,0 +1,46 @@
+from fractions import Fraction
+
+import av
+import numpy as np
+from av.audio.codeccontext import AudioCodecContext
+from av.audio.fifo import AudioFifo
+from av.audio.frame import AudioFrame
+
+
+# SpeechExtractorへ送る音声(int16, 1ch)をOpusでエンコードする。
+# Opusは決まった長さ(20ms)のフレームしか扱えないため、AudioFifoで長さを揃える。
+# encode()が返す各要素が1つのOpusパケットとなり、1メッセージとして送信する。
+class VoiceOpusEncoder:
+    def __init__(self, sampling_rate: int = 16000, bitrate: int = 24000):
+        self.__sampling_rate: int = sampling_rate
+        codec = av.CodecContext.create("libopus", "w")
+        assert isinstance(codec, AudioCodecContext)
+        codec.sample_rate = sampling_rate
+        codec.layout = "mono"
+        codec.format = "s16"
+        codec.bit_rate = bitrate
+        codec.time_base = Fraction(1, sampling_rate)
+        codec.options = {"application": "voip"}
+        codec.open()
+        self.__codec: AudioCodecContext = codec
+        self.__frame_size: int = codec.frame_size
+        self.__fifo: AudioFifo = AudioFifo()
+        self.__pts: int = 0
+
+    def encode(self, pcm: bytes | memoryview) -> list[bytes]:
+        frame: AudioFrame = AudioFrame.from_ndarray(
+            np.frombuffer(pcm, dtype=np.int16).reshape(1, -1),
+            format="s16",
+            layout="mono",
+        )
+        frame.sample_rate = self.__sampling_rate
+        self.__fifo.write(frame)
+
+        packets: list[bytes] = []
+        for opus_frame in self.__fifo.read_many(self.__frame_size):
+            opus_frame.pts = self.__pts
+            opus_frame.time_base = self.__codec.time_base
+            self.__pts += opus_frame.samples
+            for packet in self.__codec.encode(opus_frame):
+                packets.append(bytes(packet))
+        return packets
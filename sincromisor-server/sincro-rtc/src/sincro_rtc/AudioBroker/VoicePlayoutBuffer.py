@@ -0,0 +1,159 @@
+from collections import deque
+from threading import Condition
+from typing import ClassVar
+
+from sincro_models import VoiceSynthesizerResultFrame
+
+
+# 合成音声のフレームを再生するまで保持するバッファ。
+# SynthesizerReceiver側がpush()/end_utterance()で書き込み、
+# VoiceTransformTrackが自前の時間軸で20msごとにpop()で1フレームずつ取り出す。
+# - target_depth: 再生開始前に溜めるフレーム数。
+#                 発話の終わり(end_utterance)が届いていればそれより少なくても再生する。
+# - max_depth / max_bytes: 保持するフレーム数とバイト数の上限。
+# overrun_policy: 上限に達した時の扱い
+#   wait: 空きが出るまでpush()を待たせる(デコードを再生の速さに合わせる)
+#   drop_oldest: 最も古いフレームを捨てる
+#   drop_newest: 追加しようとしたフレームを捨てる
+# underrun_policy: 発話の途中でフレームが尽きた時の扱い
+#   silence: 無音を返す(pop()がNoneを返す)
+#   stretch: 直前のフレームを繰り返して間を埋める
+class VoicePlayoutBuffer:
+    # statuses()のキー。processモードではこの順でプロセス間の共有配列に書き込む。
+    STATUS_KEYS: ClassVar[tuple[str, ...]] = (
+        "depth",
+        "bytes",
+        "peak_depth",
+        "pushed",
+        "played",
+        "underruns",
+        "overruns",
+    )
+
+    def __init__(
+        self,
+        target_depth: int = 5,
+        max_depth: int = 250,
+        max_bytes: int = 4 * 1024 * 1024,
+        overrun_policy: str = "wait",
+        underrun_policy: str = "silence",
+    ):
+        self.__target_depth: int = max(1, target_depth)
+        self.__max_depth: int = max(self.__target_depth, max_depth)
+        self.__max_bytes: int = max_bytes
+        self.__overrun_policy: str = overrun_policy
+        self.__underrun_policy: str = underrun_policy
+        # 発話の終わりはNoneとして積む
+        self.__frames: deque[VoiceSynthesizerResultFrame | None] = deque()
+        self.__depth: int = 0
+        self.__bytes: int = 0
+        # __framesに含まれる発話の終わりの数
+        self.__pending_ends: int = 0
+        self.__playing: bool = False
+        self.__last_frame: VoiceSynthesizerResultFrame | None = None
+        self.__closed: bool = False
+        self.__condition: Condition = Condition()
+        self.pushed: int = 0
+        self.played: int = 0
+        self.underruns: int = 0
+        self.overruns: int = 0
+        self.peak_depth: int = 0
+
+    def __len__(self) -> int:
+        return self.__depth
+
+    def __is_full(self, frame: VoiceSynthesizerResultFrame) -> bool:
+        return (
+            self.__depth >= self.__max_depth
+            or self.__bytes + frame.vframe.nbytes > self.__max_bytes
+        ) and self.__depth > 0
+
+    def __popleft(self) -> VoiceSynthesizerResultFrame | None:
+        frame: VoiceSynthesizerResultFrame | None = self.__frames.popleft()
+        if frame is None:
+            self.__pending_ends -= 1
+        else:
+            self.__depth -= 1
+            self.__bytes -= frame.vframe.nbytes
+        return frame
+
+    def push(self, frame: VoiceSynthesizerResultFrame) -> None:
+        with self.__condition:
+            while self.__is_full(frame) and not self.__closed:
+                if self.__overrun_policy == "wait":
+                    self.__condition.wait(timeout=1)
+                    continue
+                self.overruns += 1
+                if self.__overrun_policy == "drop_newest":
+                    return
+                # 最も古いフレームを捨てる(発話の終わりは残す)
+                for index, queued in enumerate(self.__frames):
+                    if queued is not None:
+                        del self.__frames[index]
+                        self.__depth -= 1
+                        self.__bytes -= queued.vframe.nbytes
+                        break
+            if self.__closed:
+                return
+            self.__frames.append(frame)
+            self.__depth += 1
+            self.__bytes += frame.vframe.nbytes
+            self.pushed += 1
+            self.peak_depth = max(self.peak_depth, self.__depth)
+
+    # 1つの発話(VoiceSynthesizerResult)のフレームを書き終えたことを伝える。
+    def end_utterance(self) -> None:
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__frames.append(None)
+            self.__pending_ends += 1
+
+    # 再生するフレームを返す。再生するものが無い場合はNoneを返す。
+    def pop(self) -> VoiceSynthesizerResultFrame | None:
+        with self.__condition:
+            if not self.__playing:
+                if self.__depth < self.__target_depth and self.__pending_ends == 0:
+                    return None
+                self.__playing = True
+
+            if len(self.__frames) == 0:
+                self.underruns += 1
+                if (
+                    self.__underrun_policy == "stretch"
+                    and self.__last_frame is not None
+                ):
+                    return self.__last_frame.model_copy(update={"new_text": False})
+                return None
+
+            frame: VoiceSynthesizerResultFrame | None = self.__popleft()
+            self.__condition.notify_all()
+            if frame is None:
+                # 発話を最後まで再生した。次の発話は再びtarget_depthまで溜めてから再生する。
+                self.__playing = False
+                self.__last_frame = None
+                return None
+            self.__last_frame = frame
+            self.played += 1
+            return frame
+
+    # 待っているpush()を解放し、以降の書き込みを捨てる。
+    def close(self) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__frames.clear()
+            self.__depth = 0
+            self.__bytes = 0
+            self.__pending_ends = 0
+            self.__condition.notify_all()
+
+    def statuses(self) -> dict:
+        return {
+            "depth": self.__depth,
+            "bytes": self.__bytes,
+            "peak_depth": self.peak_depth,
+            "pushed": self.pushed,
+            "played": self.played,
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+        }
@@ -0,0 +1,382 @@
+from bisect import bisect_right
+from collections.abc import Iterable
+from itertools import accumulate
+
+import av
+import numpy as np
+from av.audio.codeccontext import AudioCodecContext
+from av.audio.frame import AudioFrame
+from av.audio.resampler import AudioResampler
+from sincro_models import (
+    VoiceSynthesizerMora,
+    VoiceSynthesizerResult,
+    VoiceSynthesizerResultFrame,
+    VoiceSynthesizerStreamHeader,
+    pcm_sampling_rate,
+)
+
+
+# VoiceSynthesizerの音声を、届いた分から順にデコードしてフレームに分割する。
+# start()で発話を開始し、feed()にエンコード済み音声の断片を順に渡し、
+# finish()で発話を終える。各メソッドは再生用のフレームを返す。
+# 対応するaudio_format:
+#   audio/wav: 16bit PCM
+#   audio/ogg;codecs=opus: Oggのページを読みながらOpusパケットをデコードする
+#   audio/aac: ADTSのフレームを読みながらデコードする
+#   audio/pcm;rate=N: s16, 2chのPCM。Nが再生側のレートと同じであれば、
+#                     デコードもリサンプリングもせずにNumPyのビューとして切り出す
+# リサンプラーはセッションを通して使い回し、入出力のフォーマットが変わった時のみ作り直す。
+class VoiceStreamDecoder:
+    def __init__(self, target_frame_rate: int = 48000, target_frame_size: int = 960):
+        self.__target_frame_rate: int = target_frame_rate
+        self.__target_frame_size: int = target_frame_size
+        self.__resampler: AudioResampler | None = None
+        self.__resampler_format: tuple | None = None
+
+        # 発話ごとの状態
+        self.__header: VoiceSynthesizerStreamHeader | None = None
+        # 各モーラの開始時刻(s)
+        self.__mora_starts: list[float] = []
+        self.__mora_index: int = -1
+        self.__frame_count: int = 0
+        self.__pending: bytearray = bytearray()
+        self.__codec: AudioCodecContext | None = None
+        # wav: (channels, sampling_rate)
+        self.__wav_format: tuple[int, int] | None = None
+        # ogg: ページをまたいで続いているパケット
+        self.__ogg_packet: bytearray = bytearray()
+        # ogg: OpusHeadのpre-skipのうち、まだ捨てていないサンプル数(48000Hz)
+        self.__opus_pre_skip: int = 0
+        # pcm: サンプリングレートと、フレームに満たず次の断片に持ち越したサンプル
+        self.__pcm_rate: int | None = None
+        self.__pcm_rest: np.ndarray = np.zeros(0, dtype=np.int16)
+        # この発話でリサンプラーを通したか
+        self.__resampled: bool = False
+
+    def start(
+        self,
+        header: VoiceSynthesizerStreamHeader,
+        target_frame_rate: int | None = None,
+        target_frame_size: int | None = None,
+    ) -> None:
+        if target_frame_rate is not None:
+            self.__target_frame_rate = target_frame_rate
+        if target_frame_size is not None:
+            self.__target_frame_size = target_frame_size
+        self.__header = header
+        self.__mora_starts = list(
+            accumulate((mora.length for mora in header.mora_queue[:-1]), initial=0.0)
+        )
+        self.__mora_index = -1
+        self.__frame_count = 0
+        self.__pending.clear()
+        self.__ogg_packet.clear()
+        self.__opus_pre_skip = 0
+        self.__wav_format = None
+        self.__codec = None
+        self.__pcm_rate = pcm_sampling_rate(header.audio_format)
+        self.__pcm_rest = np.zeros(0, dtype=np.int16)
+        self.__resampled = False
+        if header.audio_format == "audio/aac":
+            codec = av.CodecContext.create("aac", "r")
+            assert isinstance(codec, AudioCodecContext)
+            self.__codec = codec
+
+    def feed(self, voice: bytes) -> list[VoiceSynthesizerResultFrame]:
+        if self.__header is None:
+            raise RuntimeError("VoiceStreamDecoder.start() is not called.")
+        if self.__pcm_rate is not None:
+            return self.__slice_pcm(voice)
+        self.__pending += voice
+        match self.__header.audio_format:
+            case "audio/wav":
+                frames: list[AudioFrame] = self.__decode_wav()
+            case "audio/ogg;codecs=opus" | "audio/ogg":
+                frames = self.__decode_ogg_opus()
+            case "audio/aac":
+                frames = self.__decode_adts()
+            case _:
+                raise ValueError(
+                    f"Unsupported audio_format: {self.__header.audio_format}"
+                )
+        return self.__to_result_frames(frames)
+
+    def finish(self) -> list[VoiceSynthesizerResultFrame]:
+        frames: list[AudioFrame] = []
+        if self.__codec is not None:
+            # デコーダ内に残っているフレームを取り出す
+            if self.__header is not None and self.__header.audio_format == "audio/aac":
+                for packet in self.__codec.parse(None):
+                    frames += self.__codec.decode(packet)
+            frames += self.__codec.decode(None)
+        frames += self.__padding_frames()
+        result_frames: list[VoiceSynthesizerResultFrame] = self.__to_result_frames(
+            frames
+        )
+        if self.__pcm_rest.size > 0 and self.__pcm_rate == self.__target_frame_rate:
+            # 持ち越したサンプルは無音で埋めて1フレームにする
+            vframe: np.ndarray = np.zeros(self.__target_frame_size * 2, dtype=np.int16)
+            vframe[: self.__pcm_rest.size] = self.__pcm_rest
+            result_frames += self.__tag_frames([vframe.reshape(1, -1)])
+        self.__pcm_rest = np.zeros(0, dtype=np.int16)
+        self.__header = None
+        self.__codec = None
+        self.__pending.clear()
+        return result_frames
+
+    # ストリーミングでないVoiceSynthesizerResultをまとめてデコードする。
+    def decode(
+        self,
+        vs_result: VoiceSynthesizerResult,
+        target_frame_rate: int | None = None,
+        target_frame_size: int | None = None,
+    ) -> list[VoiceSynthesizerResultFrame]:
+        self.start(
+            VoiceSynthesizerStreamHeader.from_result(vs_result),
+            target_frame_rate=target_frame_rate,
+            target_frame_size=target_frame_size,
+        )
+        return self.feed(vs_result.voice) + self.finish()
+
+    def __parse_wav_header(self) -> bool:
+        if len(self.__pending) < 12:
+            return False
+        if self.__pending[:4] != b"RIFF" or self.__pending[8:12] != b"WAVE":
+            raise ValueError("Invalid wav header.")
+        position: int = 12
+        channels: int = 0
+        sampling_rate: int = 0
+        while position + 8 <= len(self.__pending):
+            chunk_id: bytes = bytes(self.__pending[position : position + 4])
+            chunk_size: int = int.from_bytes(
+                self.__pending[position + 4 : position + 8], "little"
+            )
+            if chunk_id == b"data":
+                if channels == 0:
+                    raise ValueError("wav fmt chunk not found.")
+                del self.__pending[: position + 8]
+                self.__wav_format = (channels, sampling_rate)
+                return True
+            if position + 8 + chunk_size > len(self.__pending):
+                return False
+            if chunk_id == b"fmt ":
+                fmt: bytearray = self.__pending[
+                    position + 8 : position + 8 + chunk_size
+                ]
+                channels = int.from_bytes(fmt[2:4], "little")
+                sampling_rate = int.from_bytes(fmt[4:8], "little")
+                bits: int = int.from_bytes(fmt[14:16], "little")
+                if bits != 16:
+                    raise ValueError(f"Unsupported wav sample bits: {bits}")
+            position += 8 + chunk_size + (chunk_size & 1)
+        return False
+
+    def __decode_wav(self) -> list[AudioFrame]:
+        if self.__wav_format is None and not self.__parse_wav_header():
+            return []
+        assert self.__wav_format is not None
+        channels, sampling_rate = self.__wav_format
+        usable: int = len(self.__pending) // (channels * 2) * (channels * 2)
+        if usable == 0:
+            return []
+        samples: np.ndarray = np.frombuffer(
+            bytes(self.__pending[:usable]), dtype=np.int16
+        )
+        del self.__pending[:usable]
+        frame: AudioFrame = AudioFrame.from_ndarray(
+            samples.reshape(1, -1),
+            format="s16",
+            layout="mono" if channels == 1 else "stereo",
+        )
+        frame.sample_rate = sampling_rate
+        return [frame]
+
+    # 完全に届いたOggページから順にパケットを取り出してデコードする。
+    def __decode_ogg_opus(self) -> list[AudioFrame]:
+        frames: list[AudioFrame] = []
+        while len(self.__pending) >= 27:
+            if self.__pending[:4] != b"OggS":
+                raise ValueError("Invalid Ogg page.")
+            segments: int = self.__pending[26]
+            header_size: int = 27 + segments
+            if len(self.__pending) < header_size:
+                break
+            lacing: bytearray = self.__pending[27:header_size]
+            if len(self.__pending) < header_size + sum(lacing):
+                break
+            position: int = header_size
+            for lace in lacing:
+                self.__ogg_packet += self.__pending[position : position + lace]
+                position += lace
+                # 255未満のlacing値でパケットが終わる
+                if lace < 255:
+                    frames += self.__decode_opus_packet(bytes(self.__ogg_packet))
+                    self.__ogg_packet.clear()
+            del self.__pending[:position]
+        return frames
+
+    def __decode_opus_packet(self, packet: bytes) -> list[AudioFrame]:
+        if self.__codec is None:
+            # 最初のパケットはOpusHead
+            if packet[:8] != b"OpusHead":
+                raise ValueError("OpusHead not found.")
+            codec = av.CodecContext.create("opus", "r")
+            assert isinstance(codec, AudioCodecContext)
+            codec.extradata = packet
+            codec.sample_rate = 48000
+            codec.layout = "mono" if packet[9] == 1 else "stereo"
+            self.__codec = codec
+            # デコーダは生のパケットに対してpre-skipを適用しないため、自前で捨てる
+            self.__opus_pre_skip = int.from_bytes(packet[10:12], "little")
+            return []
+        if packet[:8] == b"OpusTags":
+            return []
+        frames: list[AudioFrame] = list(self.__codec.decode(av.Packet(packet)))
+        while self.__opus_pre_skip > 0 and len(frames) > 0:
+            trimmed: AudioFrame | None = self.__skip_pre_skip(frames.pop(0))
+            if trimmed is not None:
+                frames.insert(0, trimmed)
+        return frames
+
+    # 先頭からpre-skip分のサンプルを取り除く。
+    # フレーム全体がpre-skipに含まれる場合はNoneを返す。
+    def __skip_pre_skip(self, frame: AudioFrame) -> AudioFrame | None:
+        skip: int = self.__opus_pre_skip
+        if skip >= frame.samples:
+            self.__opus_pre_skip -= frame.samples
+            return None
+        self.__opus_pre_skip = 0
+        samples: np.ndarray = frame.to_ndarray()
+        if frame.format.is_planar:
+            samples = samples[:, skip:]
+        else:
+            samples = samples[:, skip * len(frame.layout.channels) :]
+        trimmed: AudioFrame = AudioFrame.from_ndarray(
+            np.ascontiguousarray(samples),
+            format=frame.format.name,
+            layout=frame.layout.name,
+        )
+        trimmed.sample_rate = frame.sample_rate
+        return trimmed
+
+    def __decode_adts(self) -> list[AudioFrame]:
+        assert self.__codec is not None
+        frames: list[AudioFrame] = []
+        for packet in self.__codec.parse(bytes(self.__pending)):
+            frames += self.__codec.decode(packet)
+        self.__pending.clear()
+        return frames
+
+    # リサンプラーはtarget_frame_sizeに満たない端数を次の入力まで保持している。
+    # セッションを通して使い回すため、発話の終わりに無音を足して端数を押し出し、
+    # 次の発話の先頭に前の発話の音声が混ざらないようにする。
+    def __padding_frames(self) -> list[AudioFrame]:
+        if (
+            self.__resampler_format is None
+            or self.__header is None
+            or not self.__resampled
+        ):
+            return []
+        format_name, layout_name, sample_rate = self.__resampler_format[:3]
+        samples: int = -(
+            -self.__target_frame_size * sample_rate // self.__target_frame_rate
+        )
+        frame: AudioFrame = AudioFrame(
+            format=format_name, layout=layout_name, samples=samples
+        )
+        for plane in frame.planes:
+            plane.update(bytes(plane.buffer_size))
+        frame.sample_rate = sample_rate
+        return [frame]
+
+    def __resample(self, frame: AudioFrame) -> list[AudioFrame]:
+        resampler_format: tuple = (
+            frame.format.name,
+            frame.layout.name,
+            frame.sample_rate,
+            self.__target_frame_rate,
+            self.__target_frame_size,
+        )
+        if self.__resampler is None or self.__resampler_format != resampler_format:
+            # 音声をs16 2chに変換し、target_frame_size(20ms, 960 / 48000)ごとに分割し直す。
+            self.__resampler = AudioResampler(
+                layout=2,
+                format="s16",
+                rate=self.__target_frame_rate,
+                frame_size=self.__target_frame_size,
+            )
+            self.__resampler_format = resampler_format
+        # 発話をまたいで使うため、ptsは引き継がない
+        frame.pts = None
+        self.__resampled = True
+        return self.__resampler.resample(frame)
+
+    # s16, 2chのPCMを再生用のフレームに切り出す。
+    # 再生側と同じレートであれば、届いたbytesの上のビューをそのままフレームとする。
+    def __slice_pcm(self, voice: bytes) -> list[VoiceSynthesizerResultFrame]:
+        assert self.__pcm_rate is not None
+        samples: np.ndarray = np.frombuffer(voice, dtype=np.int16)
+        if self.__pcm_rest.size > 0:
+            samples = np.concatenate((self.__pcm_rest, samples))
+        if self.__pcm_rate != self.__target_frame_rate:
+            # レートが異なる場合は他の形式と同じくリサンプリングする
+            usable: int = samples.size // 2 * 2
+            self.__pcm_rest = samples[usable:].copy()
+            if usable == 0:
+                return []
+            frame: AudioFrame = AudioFrame.from_ndarray(
+                samples[:usable].reshape(1, -1), format="s16", layout="stereo"
+            )
+            frame.sample_rate = self.__pcm_rate
+            return self.__to_result_frames([frame])
+        frame_length: int = self.__target_frame_size * 2
+        usable = samples.size // frame_length * frame_length
+        self.__pcm_rest = samples[usable:].copy()
+        return self.__tag_frames(
+            samples[position : position + frame_length].reshape(1, -1)
+            for position in range(0, usable, frame_length)
+        )
+
+    def __to_result_frames(
+        self, frames: list[AudioFrame]
+    ) -> list[VoiceSynthesizerResultFrame]:
+        return self.__tag_frames(
+            resampled_frame.to_ndarray()
+            for frame in frames
+            for resampled_frame in self.__resample(frame)
+        )
+
+    # 再生用のフレームに、そのフレームで発話しているモーラの情報を付ける。
+    def __tag_frames(
+        self, vframes: Iterable[np.ndarray]
+    ) -> list[VoiceSynthesizerResultFrame]:
+        assert self.__header is not None
+        frame_sec: float = self.__target_frame_size / self.__target_frame_rate
+        result_frames: list[VoiceSynthesizerResultFrame] = []
+        for vframe in vframes:
+            timestamp_sec: float = self.__frame_count * frame_sec
+            self.__frame_count += 1
+            # 1文字につき複数のフレームがあるため、
+            # 初回のフレームであることが分かるフラグを用意する(口パク用)。
+            mora_index: int = max(
+                0, bisect_right(self.__mora_starts, timestamp_sec) - 1
+            )
+            new_text: bool = mora_index != self.__mora_index
+            self.__mora_index = mora_index
+            mora: VoiceSynthesizerMora = (
+                self.__header.mora_queue[mora_index]
+                if mora_index < len(self.__header.mora_queue)
+                else VoiceSynthesizerMora()
+            )
+            result_frames.append(
+                VoiceSynthesizerResultFrame(
+                    timestamp=timestamp_sec,
+                    message=self.__header.message,
+                    vowel=mora.vowel,
+                    length=mora.length,
+                    text=mora.text,
+                    new_text=new_text,
+                    vframe=vframe,
+                )
+            )
+        return result_frames
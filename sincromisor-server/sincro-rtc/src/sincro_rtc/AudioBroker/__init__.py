@@ -1,3 +1,4 @@
+from .AsyncAudioBroker import AsyncAudioBroker
 from .AudioBroker import AudioBroker
 from .Exceptions import AudioBrokerError
 from .ExtractorReceiverThread import ExtractorReceiverThread
@@ -8,9 +9,13 @@ from .SynthesizerReceiverThread import SynthesizerReceiverThread
 from .SynthesizerSenderThread import SynthesizerSenderThread
 from .TextProcessorReceiverThread import TextProcessorReceiverThread
 from .TextProcessorSenderThread import TextProcessorSenderThread
+from .VoiceOpusEncoder import VoiceOpusEncoder
+from .VoicePlayoutBuffer import VoicePlayoutBuffer
+from .VoiceStreamDecoder import VoiceStreamDecoder
 
 __all__ = [
     "AudioBroker",
+    "AsyncAudioBroker",
     "AudioBrokerError",
     "ExtractorSenderThread",
     "ExtractorReceiverThread",
@@ -20,4 +25,7 @@ __all__ = [
     "TextProcessorReceiverThread",
     "SynthesizerSenderThread",
     "SynthesizerReceiverThread",
+    "VoiceOpusEncoder",
+    "VoicePlayoutBuffer",
+    "VoiceStreamDecoder",
 ]
@@ -0,0 +1,25 @@
+from threading import Event as ThreadEvent
+
+from pydantic import BaseModel, ConfigDict
+
+from .RTCSessionWorker import RTCSessionWorker
+
+
+# poolモードのセッション。
+# RTCSessionProcessDescriptionと同じく、is_active、statusesとcloseを持つ。
+class RTCPooledSessionDescription(BaseModel):
+    session_id: str
+    worker: RTCSessionWorker
+    finalized_event: ThreadEvent
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def is_active(self) -> bool:
+        return not self.finalized_event.is_set()
+
+    def statuses(self) -> dict:
+        return self.worker.session_statuses(session_id=self.session_id)
+
+    def close(self, timeout: int) -> None:
+        self.worker.close_session(session_id=self.session_id)
+        self.finalized_event.wait(timeout=timeout)
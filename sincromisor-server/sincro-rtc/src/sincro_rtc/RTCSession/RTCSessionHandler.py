@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import socket
+import traceback
+from collections.abc import Callable
+from logging import Logger
+from multiprocessing.synchronize import Event
+from threading import Event as ThreadEvent
+
+from aiortc import (
+    RTCConfiguration,
+    RTCDataChannel,
+    RTCIceServer,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
+from aiortc.contrib.media import MediaRelay
+from sincro_config import SincromisorConfig
+
+from ..models import RTCVoiceChatSession, VoicePlayoutOptions
+from .VoiceTransformTrack import VoiceTransformTrack
+
+
+class UnknownRTCTrack(Exception):
+    pass
+
+
+class UnknownRTCDataChannel(Exception):
+    pass
+
+
+# ひとつのWebRTCセッションのRTCPeerConnectionを生成し、終了まで面倒を見る。
+# RTCSessionProcess(1プロセス1セッション)と
+# RTCSessionWorkerProcess(1プロセス複数セッション)の両方から利用される。
+# rtc_finalize_eventがsetされたらセッションを終了する。
+class RTCSessionHandler:
+    def __init__(
+        self,
+        session_id: str,
+        request_sdp: str,
+        request_type: str,
+        request_talk_mode: str,
+        rtc_finalize_event: Event | ThreadEvent,
+        consul_agent_host: str | None,
+        consul_agent_port: int | None,
+        fallback_host: str | None = None,
+        fallback_port: int | None = None,
+        audio_broker_mode: str = "thread",
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
+    ):
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{session_id[21:26]}]"
+        )
+        self.__session_id: str = session_id
+        self.__request_sdp: str = request_sdp
+        self.__request_type: str = request_type
+        self.__request_talk_mode: str = request_talk_mode
+        self.__rtc_finalize_event: Event | ThreadEvent = rtc_finalize_event
+        self.__consul_agent_host: str | None = consul_agent_host
+        self.__consul_agent_port: int | None = consul_agent_port
+        self.__fallback_host: str | None = fallback_host
+        self.__fallback_port: int | None = fallback_port
+        self.__audio_broker_mode: str = audio_broker_mode
+        self.__extractor_codec: str = extractor_codec
+        self.__synthesizer_audio_format: str = synthesizer_audio_format
+        self.__playout_options: VoicePlayoutOptions | None = playout_options
+        self.__vcs: RTCVoiceChatSession | None = None
+
+    def __get_ice_servers(self):
+        config = SincromisorConfig.from_yaml()
+        ice_servers = []
+        for stun_conf in config.get_ice_servers_conf(server_type="stun"):
+            ice_servers.append(RTCIceServer(urls=stun_conf.Urls))
+        for turn_conf in config.get_ice_servers_conf(server_type="turn"):
+            ice_servers.append(
+                RTCIceServer(
+                    urls=turn_conf.Urls,
+                    username=turn_conf.UserName,
+                    credential=turn_conf.Credential,
+                ),
+            )
+        self.__logger.debug(f"IceServers: {ice_servers}")
+        return ice_servers
+
+    async def offer(self) -> dict:
+        vcs = RTCVoiceChatSession(
+            peer=RTCPeerConnection(
+                configuration=RTCConfiguration(iceServers=self.__get_ice_servers()),
+            ),
+            desc=RTCSessionDescription(
+                sdp=self.__request_sdp,
+                type=self.__request_type,
+            ),
+            session_id=self.__session_id,
+            talk_mode=self.__request_talk_mode,
+        )
+        self.__vcs = vcs
+        self.relay = MediaRelay()
+
+        @vcs.peer.on("datachannel")
+        def on_datachannel(channel: RTCDataChannel):
+            self.__logger.info(f"on_datachannel - {channel.label}")
+            match channel.label:
+                case "telop_ch":
+                    vcs.telop_ch = channel
+                case "text_ch":
+                    vcs.text_ch = channel
+                case _:
+                    # 想定していないDataChannelが存在した場合
+                    self.__rtc_finalize_event.set()
+                    raise UnknownRTCDataChannel(channel.label)
+
+            @channel.on("message")
+            def on_message(message):
+                self.__logger.info(f"on_message - {channel.label} {message}")
+                # channel.send(json.dumps({"response": f"pong - {message}"}))
+
+        @vcs.peer.on("connectionstatechange")
+        async def on_connectionstatechange():
+            self.__logger.info(
+                f"on_connectionstatechange - {vcs.peer.connectionState}",
+            )
+            if vcs.peer.connectionState == "failed":
+                self.__rtc_finalize_event.set()
+                await vcs.close()
+            elif vcs.peer.connectionState == "closed":
+                self.__rtc_finalize_event.set()
+
+        @vcs.peer.on("track")
+        def on_track(track):
+            self.__logger.info(f"Track {track.kind} received.")
+            if track.kind == "audio":
+                vcs.audio_transform_track = VoiceTransformTrack(
+                    track=self.relay.subscribe(track),
+                    vcs=vcs,
+                    rtc_finalize_event=self.__rtc_finalize_event,
+                    consul_agent_host=self.__consul_agent_host,
+                    consul_agent_port=self.__consul_agent_port,
+                    fallback_host=self.__fallback_host,
+                    fallback_port=self.__fallback_port,
+                    audio_broker_mode=self.__audio_broker_mode,
+                    extractor_codec=self.__extractor_codec,
+                    synthesizer_audio_format=self.__synthesizer_audio_format,
+                    playout_options=self.__playout_options,
+                )
+                vcs.peer.addTrack(vcs.audio_transform_track)
+            else:
+                # 想定していないトラックが来た時はMediaBlackholeに投げないと、
+                # メモリリークしまくる模様。
+                self.__logger.error(f"Unknown Track: {track.kind} {track}")
+                self.__rtc_finalize_event.set()
+                raise UnknownRTCTrack(f"Unknown Track: {track.kind} {track}")
+
+            @track.on("ended")
+            async def on_ended():
+                self.__logger.info(f"Track {track.kind} ended.")
+
+        # handle offer
+        await vcs.peer.setRemoteDescription(vcs.desc)
+
+        try:
+            # send answer
+            answer: RTCSessionDescription | None = await vcs.peer.createAnswer()
+            assert isinstance(answer, RTCSessionDescription), (
+                "Failed to create RTCSessionDescription."
+            )
+            # 設定されているstun/turnサーバが利用できない時にエラーとなる
+            # [Sincromisor]E: socket.gaierror: [Errno -2] Name or service not known
+            await vcs.peer.setLocalDescription(answer)
+        except socket.gaierror as e:
+            self.__logger.error(f"ConnectionError: {repr(e)}\n{traceback.format_exc()}")
+            traceback.print_exc()
+            self.__rtc_finalize_event.set()
+        except Exception as e:
+            self.__logger.error(f"UnknownError: {repr(e)}\n{traceback.format_exc()}")
+            traceback.print_exc()
+            self.__rtc_finalize_event.set()
+
+        return {
+            "sdp": vcs.peer.localDescription.sdp,
+            "type": vcs.peer.localDescription.type,
+            "session_id": self.__session_id,
+        }
+
+    # トラックを受け取る前は空のdictを返す。
+    def statuses(self) -> dict:
+        if self.__vcs is None:
+            return {}
+        track = self.__vcs.audio_transform_track
+        if not isinstance(track, VoiceTransformTrack):
+            return {}
+        return track.statuses()
+
+    # rtc_finalize_eventがsetされるまで待つ。
+    # on_statusesが指定された場合は、1秒ごとにセッションの状態を渡す。
+    async def wait_finalized(
+        self, on_statuses: Callable[[dict], None] | None = None
+    ) -> None:
+        while self.__rtc_finalize_event.is_set() is False:
+            if on_statuses is not None:
+                statuses: dict = self.statuses()
+                if statuses:
+                    on_statuses(statuses)
+            await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        self.__rtc_finalize_event.set()
+        if self.__vcs is None:
+            return
+        track = self.__vcs.audio_transform_track
+        if isinstance(track, VoiceTransformTrack):
+            if self.__audio_broker_mode == "asyncio":
+                # AsyncAudioBrokerはこのイベントループ上のタスクなので直接止める。
+                track.close_audio_broker()
+            else:
+                # スレッド版AudioBrokerの停止はスレッドのjoinを伴うため、
+                # 同じループ上の他のセッションを止めないようスレッドで行う。
+                await asyncio.to_thread(track.close_audio_broker)
+        await self.__vcs.close()
+        self.__logger.info("RTC connection closed.")
@@ -1,17 +1,25 @@
+import asyncio
 import logging
 import traceback
+from concurrent.futures import Future
 from logging import Logger
+from multiprocessing import Array, Pipe
 from multiprocessing import Event as MPEvent
-from multiprocessing import Pipe
 from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import SynchronizedArray
 from multiprocessing.synchronize import Event
+from threading import Lock
 
 from ulid import ULID
 
-from ..models import RTCSessionOffer
+from ..AudioBroker import VoicePlayoutBuffer
+from ..models import RTCSessionOffer, VoicePlayoutOptions
+from .RTCPooledSessionDescription import RTCPooledSessionDescription
 from .RTCSessionProcess import RTCSessionProcess
 from .RTCSessionProcessDescription import RTCSessionProcessDescription
 from .RTCSessionProcessManagementThread import RTCSessionProcessManagementThread
+from .RTCSessionProcessPool import RTCIdleSessionProcess, RTCSessionProcessPool
+from .RTCSessionWorker import RTCSessionWorker
 
 
 class RTCSessionManager:
@@ -21,38 +29,231 @@ class RTCSessionManager:
         consul_agent_port: int | None,
         fallback_host: str | None,
         fallback_port: int | None,
+        audio_broker_mode: str = "thread",
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        session_worker_mode: str = "process",
+        session_workers: int = 4,
+        warm_processes: int = 0,
+        offer_timeout: float = 30.0,
+        playout_options: VoicePlayoutOptions | None = None,
     ):
         self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
-        self.__processes: dict[str, RTCSessionProcessDescription] = {}
+        # __processesとワーカーの入れ替えは複数のスレッドから行われる
+        self.__lock: Lock = Lock()
+        self.__workers_lock: Lock = Lock()
+        self.__processes: dict[
+            str, RTCSessionProcessDescription | RTCPooledSessionDescription
+        ] = {}
         self.__join_timeout: int = 10
+        self.__offer_timeout: float = offer_timeout
         self.__consul_agent_host: str | None = consul_agent_host
         self.__consul_agent_port: int | None = consul_agent_port
         self.__fallback_host: str | None = fallback_host
         self.__fallback_port: int | None = fallback_port
+        self.__audio_broker_mode: str = audio_broker_mode
+        self.__extractor_codec: str = extractor_codec
+        self.__synthesizer_audio_format: str = synthesizer_audio_format
+        self.__playout_options: VoicePlayoutOptions | None = playout_options
+        # session_worker_mode: process, pool
+        # process: セッションごとにRTCSessionProcessを生成する(従来の動作)
+        # pool: 常駐するRTCSessionWorkerProcessに複数のセッションを持たせる
+        self.__session_worker_mode: str = session_worker_mode
+        self.__workers: list[RTCSessionWorker] = []
+        if self.__session_worker_mode == "pool":
+            # ワーカー内の全セッションがイベントループを共有するため、
+            # AudioBrokerの接続処理でループを止めるthreadモードは使えない。
+            if self.__audio_broker_mode != "asyncio":
+                self.__logger.warning(
+                    f"audio_broker_mode={self.__audio_broker_mode} is not supported"
+                    " in pool mode. Using asyncio."
+                )
+                self.__audio_broker_mode = "asyncio"
+            for worker_id in range(session_workers):
+                self.__workers.append(self.__create_worker(worker_id=worker_id))
+        # processモードでは、オファーを待つRTCSessionProcessを
+        # warm_processes個まで事前に起動しておく。
+        self.__process_pool: RTCSessionProcessPool | None = None
+        if self.__session_worker_mode == "process" and warm_processes > 0:
+            self.__process_pool = RTCSessionProcessPool(
+                size=warm_processes,
+                spawn=self.__spawn_idle_process,
+                timeout=self.__join_timeout,
+            )
+            self.__process_pool.start()
 
-    # WebRTCのセッションを持つプロセスを新たに生成し、
-    # そのプロセスが持つセッションのSDPをdictとして返す。
-    def create_session(self, offer: RTCSessionOffer) -> dict:
-        # session_idはここで生成し、
-        # RTCVoiceChatSessionを持つRTCSessionProcessと共有する。
-        session_id: str = str(ULID())
+    def __create_worker(self, worker_id: int) -> RTCSessionWorker:
+        return RTCSessionWorker(
+            worker_id=worker_id,
+            consul_agent_host=self.__consul_agent_host,
+            consul_agent_port=self.__consul_agent_port,
+            fallback_host=self.__fallback_host,
+            fallback_port=self.__fallback_port,
+            audio_broker_mode=self.__audio_broker_mode,
+            extractor_codec=self.__extractor_codec,
+            synthesizer_audio_format=self.__synthesizer_audio_format,
+            playout_options=self.__playout_options,
+        )
+
+    # RTCSessionProcessからVoicePlayoutBufferの状態を受け取る共有配列
+    def __create_playout_statuses(self) -> SynchronizedArray:
+        return Array("q", len(VoicePlayoutBuffer.STATUS_KEYS))
+
+    def __spawn_idle_process(self) -> RTCIdleSessionProcess:
         sv_pipe: Connection
         cl_pipe: Connection
         sv_pipe, cl_pipe = Pipe()
         rtc_finalize_event: Event = MPEvent()
+        playout_statuses: SynchronizedArray = self.__create_playout_statuses()
         ps: RTCSessionProcess = RTCSessionProcess(
-            session_id=session_id,
-            request_sdp=offer.sdp,
-            request_type=offer.type,
-            request_talk_mode=offer.talk_mode,
+            session_id=None,
+            request_sdp=None,
+            request_type=None,
+            request_talk_mode=None,
             rtc_finalize_event=rtc_finalize_event,
+            playout_statuses=playout_statuses,
             sdp_pipe=cl_pipe,
             consul_agent_host=self.__consul_agent_host,
             consul_agent_port=self.__consul_agent_port,
             fallback_host=self.__fallback_host,
             fallback_port=self.__fallback_port,
+            audio_broker_mode=self.__audio_broker_mode,
+            extractor_codec=self.__extractor_codec,
+            synthesizer_audio_format=self.__synthesizer_audio_format,
+            playout_options=self.__playout_options,
         )
         ps.start()
+        return RTCIdleSessionProcess(
+            process=ps,
+            rtc_finalize_event=rtc_finalize_event,
+            sv_pipe=sv_pipe,
+            playout_statuses=playout_statuses,
+        )
+
+    # 落ちているワーカーを作り直した上で、セッション数が最も少ないワーカーを返す。
+    def __select_worker(self) -> RTCSessionWorker:
+        with self.__workers_lock:
+            for idx, worker in enumerate(self.__workers):
+                if not worker.is_alive():
+                    self.__logger.warning(
+                        f"worker {worker.worker_id} is dead. respawning..."
+                    )
+                    worker.shutdown(timeout=self.__join_timeout)
+                    self.__workers[idx] = self.__create_worker(
+                        worker_id=worker.worker_id
+                    )
+            return min(self.__workers, key=lambda w: w.session_count())
+
+    # WebRTCのセッションを生成し、そのセッションのSDPをdictとして返す。
+    # offer_timeout秒以内に応答がなければセッションを閉じてTimeoutErrorを送出する。
+    async def create_session(self, offer: RTCSessionOffer) -> dict:
+        # session_idはここで生成し、
+        # RTCVoiceChatSessionを持つRTCSessionProcessと共有する。
+        session_id: str = str(ULID())
+        deadline: float = asyncio.get_running_loop().time() + self.__offer_timeout
+        # プロセスの生成(fork)やワーカーへの書き込みはイベントループを止めるため、スレッドで行う。
+        # スレッドはキャンセルできないため、タイムアウトしても登録が終わるまで待ってから閉じる。
+        starting: asyncio.Future[Future | Connection] = asyncio.ensure_future(
+            asyncio.to_thread(self.__start_session, session_id, offer)
+        )
+        try:
+            async with asyncio.timeout_at(deadline):
+                started: Future | Connection = await asyncio.shield(starting)
+                if isinstance(started, Future):
+                    return await asyncio.wrap_future(started)
+                return await self.__recv_pipe(started)
+        except TimeoutError:
+            self.__logger.error(f"[{session_id}] Offer timeout.")
+            await asyncio.gather(starting, return_exceptions=True)
+            await asyncio.to_thread(self.__close_session, session_id)
+            raise
+
+    # poolモードではanswerを受け取るFutureを、processモードではパイプを返す。
+    def __start_session(
+        self, session_id: str, offer: RTCSessionOffer
+    ) -> Future | Connection:
+        if self.__session_worker_mode == "pool":
+            return self.__start_pooled_session(session_id, offer)
+        return self.__start_process_session(session_id, offer)
+
+    # パイプが読み込み可能になるまでイベントループ上で待ってから受信する。
+    async def __recv_pipe(self, pipe: Connection) -> dict:
+        loop = asyncio.get_running_loop()
+        readable: asyncio.Future = loop.create_future()
+
+        def on_readable() -> None:
+            if not readable.done():
+                readable.set_result(None)
+
+        loop.add_reader(pipe.fileno(), on_readable)
+        try:
+            await readable
+        finally:
+            loop.remove_reader(pipe.fileno())
+        return pipe.recv()
+
+    # 空いているRTCSessionWorkerProcessにセッションを割り当てる。
+    def __start_pooled_session(self, session_id: str, offer: RTCSessionOffer) -> Future:
+        worker: RTCSessionWorker = self.__select_worker()
+        answer, finalized_event = worker.create_session(
+            session_id=session_id, offer=offer
+        )
+        with self.__lock:
+            self.__processes[session_id] = RTCPooledSessionDescription(
+                session_id=session_id,
+                worker=worker,
+                finalized_event=finalized_event,
+            )
+        return answer
+
+    # WebRTCのセッションを持つプロセスを新たに生成し、SDPを受け取るパイプを返す。
+    # 待機プロセスがあればそれを使う。
+    def __start_process_session(
+        self, session_id: str, offer: RTCSessionOffer
+    ) -> Connection:
+        sv_pipe: Connection
+        cl_pipe: Connection
+        rtc_finalize_event: Event
+        playout_statuses: SynchronizedArray
+        ps: RTCSessionProcess
+        idle_process: RTCIdleSessionProcess | None = None
+        if self.__process_pool is not None:
+            idle_process = self.__process_pool.acquire()
+        if idle_process is not None:
+            ps = idle_process.process
+            sv_pipe = idle_process.sv_pipe
+            rtc_finalize_event = idle_process.rtc_finalize_event
+            playout_statuses = idle_process.playout_statuses
+            sv_pipe.send(
+                {
+                    "session_id": session_id,
+                    "sdp": offer.sdp,
+                    "type": offer.type,
+                    "talk_mode": offer.talk_mode,
+                }
+            )
+        else:
+            sv_pipe, cl_pipe = Pipe()
+            rtc_finalize_event = MPEvent()
+            playout_statuses = self.__create_playout_statuses()
+            ps = RTCSessionProcess(
+                session_id=session_id,
+                request_sdp=offer.sdp,
+                request_type=offer.type,
+                request_talk_mode=offer.talk_mode,
+                rtc_finalize_event=rtc_finalize_event,
+                playout_statuses=playout_statuses,
+                sdp_pipe=cl_pipe,
+                consul_agent_host=self.__consul_agent_host,
+                consul_agent_port=self.__consul_agent_port,
+                fallback_host=self.__fallback_host,
+                fallback_port=self.__fallback_port,
+                audio_broker_mode=self.__audio_broker_mode,
+                extractor_codec=self.__extractor_codec,
+                synthesizer_audio_format=self.__synthesizer_audio_format,
+                playout_options=self.__playout_options,
+            )
+            ps.start()
 
         mgmt_t: RTCSessionProcessManagementThread = RTCSessionProcessManagementThread(
             session_id=session_id,
@@ -62,32 +263,68 @@ class RTCSessionManager:
         )
         mgmt_t.start()
 
-        self.__processes[session_id] = RTCSessionProcessDescription(
-            session_id=session_id,
-            mgmt_t=mgmt_t,
-            rtc_finalize_event=rtc_finalize_event,
-            sv_pipe=sv_pipe,
-        )
-        return sv_pipe.recv()
+        with self.__lock:
+            self.__processes[session_id] = RTCSessionProcessDescription(
+                session_id=session_id,
+                mgmt_t=mgmt_t,
+                rtc_finalize_event=rtc_finalize_event,
+                sv_pipe=sv_pipe,
+                playout_statuses=playout_statuses,
+            )
+        return sv_pipe
+
+    def __close_session(self, session_id: str) -> None:
+        with self.__lock:
+            session_desc = self.__processes.pop(session_id, None)
+        if session_desc is not None:
+            session_desc.close(timeout=self.__join_timeout)
 
     def session_count(self) -> int:
-        return len(self.__processes)
+        with self.__lock:
+            return len(self.__processes)
+
+    # 待機プロセスのプールの状態(ヒット数、ミス数など)を返す。
+    def process_pool_statuses(self) -> dict | None:
+        if self.__process_pool is None:
+            return None
+        return self.__process_pool.statuses()
+
+    # セッションごとの状態(VoicePlayoutBufferのカウンタなど)を返す。
+    def session_statuses(self) -> dict[str, dict]:
+        with self.__lock:
+            sessions = list(self.__processes.items())
+        return {
+            session_id: session_desc.statuses() for session_id, session_desc in sessions
+        }
 
     # 終了済みのセッションを閉じる。
     # 残ったセッションのセッションIDの一覧を返す。
+    # closeはjoinを伴うため、ロックの外で行う。
     def cleanup_sessions(self) -> list[str]:
         session_id: str
-        session_desc: RTCSessionProcessDescription
-        for session_id, session_desc in list(self.__processes.items()):
-            if not session_desc.is_active():
-                session_desc.close(timeout=self.__join_timeout)
+        session_desc: RTCSessionProcessDescription | RTCPooledSessionDescription
+        with self.__lock:
+            finished = [
+                (session_id, session_desc)
+                for session_id, session_desc in self.__processes.items()
+                if not session_desc.is_active()
+            ]
+            for session_id, _ in finished:
                 del self.__processes[session_id]
-        return list(self.__processes.keys())
+        for session_id, session_desc in finished:
+            session_desc.close(timeout=self.__join_timeout)
+        with self.__lock:
+            return list(self.__processes.keys())
 
     def shutdown(self) -> None:
+        if self.__process_pool is not None:
+            self.__process_pool.stop()
         session_id: str
-        session_desc: RTCSessionProcessDescription
-        for session_id, session_desc in self.__processes.items():
+        session_desc: RTCSessionProcessDescription | RTCPooledSessionDescription
+        with self.__lock:
+            sessions = list(self.__processes.items())
+            self.__processes.clear()
+        for session_id, session_desc in sessions:
             try:
                 session_desc.close(timeout=self.__join_timeout)
             except Exception:
@@ -95,5 +332,7 @@ class RTCSessionManager:
                     f"[{session_id}] Change session status: UnknownError - {traceback.format_exc()}",
                 )
                 traceback.print_exc()
-        self.__processes.clear()
+        for worker in self.__workers:
+            worker.shutdown(timeout=self.__join_timeout)
+        self.__workers.clear()
         self.__logger.info("RTCSessionManager is shutdown.")
@@ -1,8 +1,10 @@
 from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import SynchronizedArray
 from multiprocessing.synchronize import Event
 
 from pydantic import BaseModel, ConfigDict
 
+from ..AudioBroker import VoicePlayoutBuffer
 from .RTCSessionProcessManagementThread import RTCSessionProcessManagementThread
 
 
@@ -11,12 +13,19 @@ class RTCSessionProcessDescription(BaseModel):
     mgmt_t: RTCSessionProcessManagementThread
     rtc_finalize_event: Event
     sv_pipe: Connection
+    # RTCSessionProcessが書き込むVoicePlayoutBufferの状態
+    playout_statuses: SynchronizedArray
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     def is_active(self) -> bool:
         return not self.rtc_finalize_event.is_set()
 
+    def statuses(self) -> dict:
+        with self.playout_statuses.get_lock():
+            values: list[int] = list(self.playout_statuses)
+        return {"playout": dict(zip(VoicePlayoutBuffer.STATUS_KEYS, values))}
+
     def close(self, timeout: int) -> None:
         self.rtc_finalize_event.set()
         self.mgmt_t.join(timeout=timeout)
@@ -0,0 +1,114 @@
+import logging
+import traceback
+from collections import deque
+from collections.abc import Callable
+from logging import Logger
+from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import SynchronizedArray
+from multiprocessing.synchronize import Event
+from threading import Event as ThreadEvent
+from threading import Lock, Thread
+
+from pydantic import BaseModel, ConfigDict
+
+from .RTCSessionProcess import RTCSessionProcess
+
+
+# オファーを待っている起動済みのRTCSessionProcess
+class RTCIdleSessionProcess(BaseModel):
+    process: RTCSessionProcess
+    rtc_finalize_event: Event
+    sv_pipe: Connection
+    playout_statuses: SynchronizedArray
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # 待機中のプロセスはセッションを持たないため、そのまま止めてよい。
+    def close(self, timeout: int) -> None:
+        self.sv_pipe.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process.close()
+
+
+# 待機プロセスをsize個まで事前に起動しておき、
+# オファーの処理時間にプロセスの起動時間が含まれないようにする。
+# 取り出された分はバックグラウンドで補充する。
+class RTCSessionProcessPool(Thread):
+    def __init__(
+        self,
+        size: int,
+        spawn: Callable[[], RTCIdleSessionProcess],
+        timeout: int,
+    ):
+        super().__init__(daemon=True)
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__size: int = size
+        self.__spawn: Callable[[], RTCIdleSessionProcess] = spawn
+        self.__timeout: int = timeout
+        self.__lock: Lock = Lock()
+        self.__idle_processes: deque[RTCIdleSessionProcess] = deque()
+        self.__refill_event: ThreadEvent = ThreadEvent()
+        self.__stop_event: ThreadEvent = ThreadEvent()
+        self.__hits: int = 0
+        self.__misses: int = 0
+
+    # 待機プロセスをひとつ取り出す。空の場合はNoneを返す。
+    def acquire(self) -> RTCIdleSessionProcess | None:
+        idle_process: RTCIdleSessionProcess | None = None
+        with self.__lock:
+            while len(self.__idle_processes) > 0:
+                candidate = self.__idle_processes.popleft()
+                if candidate.process.is_alive():
+                    idle_process = candidate
+                    break
+                candidate.close(timeout=self.__timeout)
+            if idle_process is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+        self.__refill_event.set()
+        return idle_process
+
+    def statuses(self) -> dict:
+        with self.__lock:
+            return {
+                "size": self.__size,
+                "idle": len(self.__idle_processes),
+                "hits": self.__hits,
+                "misses": self.__misses,
+            }
+
+    def __refill(self) -> None:
+        while not self.__stop_event.is_set():
+            with self.__lock:
+                if len(self.__idle_processes) >= self.__size:
+                    return
+            idle_process: RTCIdleSessionProcess = self.__spawn()
+            with self.__lock:
+                self.__idle_processes.append(idle_process)
+
+    def run(self) -> None:
+        self.__logger.info(f"Start RTCSessionProcessPool(size={self.__size}).")
+        while not self.__stop_event.is_set():
+            try:
+                self.__refill()
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}"
+                )
+            self.__refill_event.wait(timeout=1)
+            self.__refill_event.clear()
+
+    def stop(self) -> None:
+        self.__stop_event.set()
+        self.__refill_event.set()
+        self.join(timeout=self.__timeout)
+        with self.__lock:
+            while len(self.__idle_processes) > 0:
+                self.__idle_processes.popleft().close(timeout=self.__timeout)
+        self.__logger.info("RTCSessionProcessPool is stopped.")
@@ -0,0 +1,162 @@
+import logging
+from concurrent.futures import Future
+from logging import Logger
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+from threading import Event as ThreadEvent
+from threading import Lock, Thread
+
+from ..models import RTCSessionOffer, VoicePlayoutOptions
+from .RTCSessionWorkerProcess import RTCSessionWorkerProcess
+
+
+class RTCSessionWorkerError(Exception):
+    pass
+
+
+# RTCSessionManager側からRTCSessionWorkerProcessを操作する。
+# control_pipeからの応答は読み込みスレッドで受け取り、
+# セッションごとのFuture(answer)とEvent(finalized)に振り分ける。
+# セッションの状態(statuses)は最新のものだけを保持する。
+class RTCSessionWorker:
+    def __init__(
+        self,
+        worker_id: int,
+        consul_agent_host: str | None,
+        consul_agent_port: int | None,
+        fallback_host: str | None,
+        fallback_port: int | None,
+        audio_broker_mode: str = "asyncio",
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
+    ):
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{worker_id}]"
+        )
+        self.worker_id: int = worker_id
+        self.__lock: Lock = Lock()
+        self.__answers: dict[str, Future] = {}
+        self.__finalized_events: dict[str, ThreadEvent] = {}
+        self.__statuses: dict[str, dict] = {}
+        cl_pipe: Connection
+        self.__sv_pipe, cl_pipe = Pipe()
+        self.__process: RTCSessionWorkerProcess = RTCSessionWorkerProcess(
+            worker_id=worker_id,
+            control_pipe=cl_pipe,
+            consul_agent_host=consul_agent_host,
+            consul_agent_port=consul_agent_port,
+            fallback_host=fallback_host,
+            fallback_port=fallback_port,
+            audio_broker_mode=audio_broker_mode,
+            extractor_codec=extractor_codec,
+            synthesizer_audio_format=synthesizer_audio_format,
+            playout_options=playout_options,
+        )
+        self.__process.start()
+        cl_pipe.close()
+        self.__reader_t: Thread = Thread(target=self.__read_control, daemon=True)
+        self.__reader_t.start()
+
+    def is_alive(self) -> bool:
+        return self.__process.is_alive() and self.__reader_t.is_alive()
+
+    def session_count(self) -> int:
+        with self.__lock:
+            return len(self.__finalized_events)
+
+    # オファーをワーカーへ送る。
+    # answerは返り値のFutureで、セッションの終了はEventで通知される。
+    def create_session(
+        self, session_id: str, offer: RTCSessionOffer
+    ) -> tuple[Future, ThreadEvent]:
+        answer: Future = Future()
+        finalized: ThreadEvent = ThreadEvent()
+        with self.__lock:
+            if not self.is_alive():
+                raise RTCSessionWorkerError(f"worker {self.worker_id} is not alive.")
+            self.__answers[session_id] = answer
+            self.__finalized_events[session_id] = finalized
+            self.__sv_pipe.send(
+                {
+                    "command": "offer",
+                    "session_id": session_id,
+                    "sdp": offer.sdp,
+                    "type": offer.type,
+                    "talk_mode": offer.talk_mode,
+                }
+            )
+        return answer, finalized
+
+    # セッションの最新の状態を返す。まだ届いていない場合は空のdictを返す。
+    def session_statuses(self, session_id: str) -> dict:
+        with self.__lock:
+            return self.__statuses.get(session_id, {})
+
+    def close_session(self, session_id: str) -> None:
+        with self.__lock:
+            if session_id not in self.__finalized_events:
+                return
+            try:
+                self.__sv_pipe.send({"command": "close", "session_id": session_id})
+            except (BrokenPipeError, OSError):
+                pass
+
+    def __read_control(self) -> None:
+        while True:
+            try:
+                message: dict = self.__sv_pipe.recv()
+            except (EOFError, OSError):
+                break
+            session_id: str = message["session_id"]
+            with self.__lock:
+                match message["command"]:
+                    case "answer":
+                        answer = self.__answers.pop(session_id, None)
+                        # タイムアウトでキャンセルされている場合は捨てる
+                        if answer is not None and answer.set_running_or_notify_cancel():
+                            if "error" in message:
+                                answer.set_exception(
+                                    RTCSessionWorkerError(message["error"])
+                                )
+                            else:
+                                answer.set_result(message["answer"])
+                    case "statuses":
+                        if session_id in self.__finalized_events:
+                            self.__statuses[session_id] = message["statuses"]
+                    case "finalized":
+                        self.__statuses.pop(session_id, None)
+                        if finalized := self.__finalized_events.pop(session_id, None):
+                            finalized.set()
+        self.__logger.warning(f"worker {self.worker_id} control pipe is closed.")
+        # ワーカーが落ちた場合は、残っているセッションをすべて終了扱いにする
+        with self.__lock:
+            for answer in self.__answers.values():
+                if not answer.set_running_or_notify_cancel():
+                    continue
+                answer.set_exception(
+                    RTCSessionWorkerError(f"worker {self.worker_id} is terminated.")
+                )
+            for finalized in self.__finalized_events.values():
+                finalized.set()
+            self.__answers.clear()
+            self.__finalized_events.clear()
+            self.__statuses.clear()
+
+    def shutdown(self, timeout: int) -> None:
+        try:
+            with self.__lock:
+                self.__sv_pipe.send({"command": "shutdown"})
+        except (BrokenPipeError, OSError):
+            pass
+        self.__process.join(timeout=timeout)
+        if self.__process.is_alive():
+            self.__logger.warning(
+                f"worker {self.worker_id} process is not terminated. killing..."
+            )
+            self.__process.kill()
+            self.__process.join()
+        self.__sv_pipe.close()
+        self.__reader_t.join(timeout=timeout)
+        self.__process.close()
+        self.__logger.info(f"worker {self.worker_id}: process terminated.")
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import traceback
+from logging import Logger
+from multiprocessing import Process
+from multiprocessing.connection import Connection
+from threading import Event as ThreadEvent
+
+from setproctitle import setproctitle
+
+from ..models import VoicePlayoutOptions
+from .RTCSessionHandler import RTCSessionHandler
+
+
+# 1プロセスで複数のWebRTCセッションを持つ(session_worker_mode: pool)
+# RTCSessionManagerとはcontrol_pipeでやりとりする。
+# 受信: {"command": "offer", "session_id", "sdp", "type", "talk_mode"}
+#       {"command": "close", "session_id"}
+#       {"command": "shutdown"}
+# 送信: {"command": "answer", "session_id", "answer" | "error"}
+#       {"command": "finalized", "session_id"}
+#       {"command": "statuses", "session_id", "statuses"}(セッション中、1秒ごと)
+class RTCSessionWorkerProcess(Process):
+    def __init__(
+        self,
+        worker_id: int,
+        control_pipe: Connection,
+        consul_agent_host: str | None,
+        consul_agent_port: int | None,
+        fallback_host: str | None = None,
+        fallback_port: int | None = None,
+        audio_broker_mode: str = "asyncio",
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
+    ):
+        Process.__init__(self)
+        self.__logger: Logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{worker_id}]"
+        )
+        self.__worker_id: int = worker_id
+        self.__control_pipe: Connection = control_pipe
+        self.__consul_agent_host: str | None = consul_agent_host
+        self.__consul_agent_port: int | None = consul_agent_port
+        self.__fallback_host: str | None = fallback_host
+        self.__fallback_port: int | None = fallback_port
+        # threadモードのAudioBrokerは生成時にブロックし、全セッションが止まるため使わない
+        if audio_broker_mode != "asyncio":
+            self.__logger.warning(
+                f"audio_broker_mode={audio_broker_mode} is not supported. Using asyncio."
+            )
+        self.__audio_broker_mode: str = "asyncio"
+        self.__extractor_codec: str = extractor_codec
+        self.__synthesizer_audio_format: str = synthesizer_audio_format
+        self.__playout_options: VoicePlayoutOptions | None = playout_options
+        self.__finalize_events: dict[str, ThreadEvent] = {}
+        self.__session_tasks: set[asyncio.Task] = set()
+
+    def __send(self, message: dict) -> None:
+        try:
+            self.__control_pipe.send(message)
+        except (BrokenPipeError, OSError) as e:
+            self.__logger.error(f"ControlPipeError: {repr(e)}")
+
+    # control_pipeが読み込み可能になった時にイベントループから呼ばれる。
+    def __on_control(self) -> None:
+        try:
+            message: dict = self.__control_pipe.recv()
+        except (EOFError, OSError):
+            self.__logger.warning("Control pipe is closed.")
+            self.__stop_event.set()
+            return
+        match message["command"]:
+            case "offer":
+                task = asyncio.create_task(self.__run_session(message))
+                self.__session_tasks.add(task)
+                task.add_done_callback(self.__session_tasks.discard)
+            case "close":
+                if event := self.__finalize_events.get(message["session_id"]):
+                    event.set()
+            case "shutdown":
+                self.__stop_event.set()
+            case _:
+                self.__logger.error(f"Unknown command: {message['command']}")
+
+    async def __run_session(self, message: dict) -> None:
+        session_id: str = message["session_id"]
+        rtc_finalize_event: ThreadEvent = ThreadEvent()
+        self.__finalize_events[session_id] = rtc_finalize_event
+        handler: RTCSessionHandler = RTCSessionHandler(
+            session_id=session_id,
+            request_sdp=message["sdp"],
+            request_type=message["type"],
+            request_talk_mode=message["talk_mode"],
+            rtc_finalize_event=rtc_finalize_event,
+            consul_agent_host=self.__consul_agent_host,
+            consul_agent_port=self.__consul_agent_port,
+            fallback_host=self.__fallback_host,
+            fallback_port=self.__fallback_port,
+            audio_broker_mode=self.__audio_broker_mode,
+            extractor_codec=self.__extractor_codec,
+            synthesizer_audio_format=self.__synthesizer_audio_format,
+            playout_options=self.__playout_options,
+        )
+        try:
+            self.__send(
+                {
+                    "command": "answer",
+                    "session_id": session_id,
+                    "answer": await handler.offer(),
+                }
+            )
+            await handler.wait_finalized(
+                on_statuses=lambda statuses: self.__send(
+                    {
+                        "command": "statuses",
+                        "session_id": session_id,
+                        "statuses": statuses,
+                    }
+                )
+            )
+            self.__logger.info(f"{session_id}: RTC session loop terminated.")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.__logger.error(f"UnknownError: {repr(e)}\n{traceback.format_exc()}")
+            # offer前に失敗した場合もRTCSessionManagerを待たせないようにする
+            self.__send(
+                {"command": "answer", "session_id": session_id, "error": repr(e)}
+            )
+        finally:
+            try:
+                await handler.close()
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}"
+                )
+            del self.__finalize_events[session_id]
+            self.__send({"command": "finalized", "session_id": session_id})
+
+    async def __serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.__stop_event: asyncio.Event = asyncio.Event()
+        loop.add_reader(self.__control_pipe.fileno(), self.__on_control)
+        await self.__stop_event.wait()
+        loop.remove_reader(self.__control_pipe.fileno())
+        self.__logger.info(f"Shutting down {len(self.__finalize_events)} RTC sessions.")
+        for event in self.__finalize_events.values():
+            event.set()
+        if self.__session_tasks:
+            await asyncio.gather(*self.__session_tasks, return_exceptions=True)
+        self.__control_pipe.close()
+
+    def run(self) -> None:
+        setproctitle(f"RTCWorker[{self.__worker_id}]")
+        asyncio.run(self.__serve())
+        self.__logger.info("RTC session worker process terminated.")
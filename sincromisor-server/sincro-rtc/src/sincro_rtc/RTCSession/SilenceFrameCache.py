@@ -0,0 +1,38 @@
+from fractions import Fraction
+
+import numpy as np
+from av.audio.frame import AudioFrame
+from av.audio.layout import AudioLayout
+
+
+# 無音(s16)のAudioFrameを(sample_rate, samples, layout)ごとに1つだけ作り、使い回す。
+# 返すたびにptsのみを書き換えるため、1つのトラック内でのみ共有すること。
+# (aiortcはrecv()で受け取ったフレームのエンコードを終えてから次のrecv()を呼ぶ)
+class SilenceFrameCache:
+    def __init__(self):
+        self.__frames: dict[tuple[int, int, str], AudioFrame] = {}
+
+    def get(
+        self,
+        sample_rate: int,
+        samples: int,
+        layout: str = "stereo",
+        pts: int | None = None,
+        time_base: Fraction | None = None,
+    ) -> AudioFrame:
+        key: tuple[int, int, str] = (sample_rate, samples, layout)
+        frame: AudioFrame | None = self.__frames.get(key)
+        if frame is None:
+            channels: int = len(AudioLayout(layout).channels)
+            frame = AudioFrame.from_ndarray(
+                np.zeros((1, samples * channels), dtype=np.int16),
+                format="s16",
+                layout=layout,
+            )
+            frame.sample_rate = sample_rate
+            frame.time_base = Fraction(1, sample_rate)
+            self.__frames[key] = frame
+        frame.pts = pts
+        if time_base is not None:
+            frame.time_base = time_base
+        return frame
@@ -0,0 +1,96 @@
+from collections.abc import Callable
+
+import numpy as np
+from av.audio.frame import AudioFrame
+from av.audio.resampler import AudioResampler
+
+
+# WebRTCから受け取ったフレームをblock_ms分溜めてからまとめてリサンプリングし、
+# SpeechExtractor用のフォーマット(1ch, 16bit, 16000Hz)でadd_frameに渡す。
+# フレームごとにリサンプリングやbytesの生成を行わないことで、recv()の負荷を下げる。
+# add_frameに渡すmemoryviewは事前に確保したslots個のバッファを順に使い回すため、
+# 受け取った側はslots回分のブロックが届くまでの間に使い終えること。
+class VoiceIngestBuffer:
+    def __init__(
+        self,
+        add_frame: Callable[[memoryview], None],
+        sampling_rate: int = 16000,
+        block_ms: int = 100,
+        slots: int = 32,
+    ):
+        self.__add_frame: Callable[[memoryview], None] = add_frame
+        self.__sampling_rate: int = sampling_rate
+        self.__block_ms: int = block_ms
+        self.__resampler: AudioResampler = AudioResampler(
+            format="s16", layout="mono", rate=sampling_rate
+        )
+        # 入力側のバッファ。フレームのフォーマットが変わった時に確保し直す。
+        self.__input_format: tuple[str, str, int] | None = None
+        self.__input: np.ndarray = np.zeros((1, 0), dtype=np.int16)
+        self.__input_size: int = 0
+        self.__block_columns: int = 0
+        # 出力側のバッファ
+        slot_samples: int = sampling_rate * block_ms // 1000 * 2
+        self.__slots: list[np.ndarray] = [
+            np.zeros(slot_samples, dtype=np.int16) for _ in range(max(slots, 2))
+        ]
+        self.__slot_index: int = 0
+
+    def write(self, frame: AudioFrame) -> None:
+        input_format: tuple[str, str, int] = (
+            frame.format.name,
+            frame.layout.name,
+            frame.sample_rate,
+        )
+        data: np.ndarray = frame.to_ndarray()
+        if input_format != self.__input_format:
+            self.flush()
+            self.__input_format = input_format
+            # packedの場合は(1, サンプル数 * ch数)、planarの場合は(ch数, サンプル数)
+            columns_per_sample: int = data.shape[1] // max(frame.samples, 1)
+            self.__block_columns = (
+                frame.sample_rate * self.__block_ms // 1000 * columns_per_sample
+            )
+            self.__input = np.zeros(
+                (data.shape[0], self.__block_columns + data.shape[1]),
+                dtype=data.dtype,
+            )
+        if self.__input_size + data.shape[1] > self.__input.shape[1]:
+            self.flush()
+            if data.shape[1] > self.__input.shape[1]:
+                self.__input = np.zeros(
+                    (data.shape[0], data.shape[1]), dtype=data.dtype
+                )
+        self.__input[:, self.__input_size : self.__input_size + data.shape[1]] = data
+        self.__input_size += data.shape[1]
+        if self.__input_size >= self.__block_columns:
+            self.flush()
+
+    # 溜まっているフレームをリサンプリングしてadd_frameに渡す。
+    def flush(self) -> None:
+        if self.__input_size == 0 or self.__input_format is None:
+            return
+        sample_format, layout, sample_rate = self.__input_format
+        block: AudioFrame = AudioFrame.from_ndarray(
+            np.ascontiguousarray(self.__input[:, : self.__input_size]),
+            format=sample_format,
+            layout=layout,
+        )
+        block.sample_rate = sample_rate
+        self.__input_size = 0
+
+        slot: np.ndarray = self.__slots[self.__slot_index]
+        size: int = 0
+        for resampled_frame in self.__resampler.resample(block):
+            samples: np.ndarray = resampled_frame.to_ndarray().reshape(-1)
+            if size + samples.size > slot.size:
+                grown: np.ndarray = np.zeros((size + samples.size) * 2, dtype=np.int16)
+                grown[:size] = slot[:size]
+                slot = grown
+                self.__slots[self.__slot_index] = slot
+            slot[size : size + samples.size] = samples
+            size += samples.size
+        if size == 0:
+            return
+        self.__slot_index = (self.__slot_index + 1) % len(self.__slots)
+        self.__add_frame(slot[:size].data.cast("B"))
@@ -1,72 +1,104 @@
+import asyncio
 import logging
 import traceback
 from asyncio.exceptions import CancelledError
 from fractions import Fraction
 from logging import Logger
 from multiprocessing.synchronize import Event
+from threading import Event as ThreadEvent
 
-import numpy as np
 from aiortc import MediaStreamTrack
 from aiortc.mediastreams import MediaStreamError
 from av.audio.frame import AudioFrame
-from av.audio.resampler import AudioResampler
 from av.frame import Frame
 from av.packet import Packet
 from sincro_models import TextProcessorResult, VoiceSynthesizerResultFrame
 
-from ..AudioBroker import AudioBroker, AudioBrokerError
-from ..models import RTCVoiceChatSession
+from ..AudioBroker import AsyncAudioBroker, AudioBroker, AudioBrokerError
+from ..models import RTCVoiceChatSession, VoicePlayoutOptions
+from .SilenceFrameCache import SilenceFrameCache
+from .VoiceIngestBuffer import VoiceIngestBuffer
 
 
+# マイクの音声をAudioBrokerへ渡し、合成音声を返すトラック。
+# マイクのフレームは別のタスクで受け取り、返すフレームはマイクの到着とは独立に、
+# 自前の時間軸(pts)で20msごとに1つずつ作る。
 class VoiceTransformTrack(MediaStreamTrack):
     kind = "audio"
+    # 返すフレームの形式(opus/48000Hz/2ch、20ms)
+    SAMPLE_RATE: int = 48000
+    FRAME_SAMPLES: int = 960
 
     def __init__(
         self,
         track: MediaStreamTrack,
         vcs: RTCVoiceChatSession,
-        rtc_finalize_event: Event,
+        rtc_finalize_event: Event | ThreadEvent,
         consul_agent_host: str | None,
         consul_agent_port: int | None,
         fallback_host: str | None = None,
         fallback_port: int | None = None,
+        audio_broker_mode: str = "thread",
+        extractor_codec: str = "pcm",
+        synthesizer_audio_format: str = "audio/ogg;codecs=opus",
+        playout_options: VoicePlayoutOptions | None = None,
     ):
         super().__init__()
         self.__logger: Logger = logging.getLogger(
             __name__ + f"[{vcs.session_id[21:26]}]",
         )
         # RTCSessionManager、RTCSessionProcessと共有される
-        self.__rtc_finalize_event: Event = rtc_finalize_event
+        # poolモードではRTCSessionWorkerProcess内のthreading.Eventとなる
+        self.__rtc_finalize_event: Event | ThreadEvent = rtc_finalize_event
         self.__session_id: str = vcs.session_id
         self.__logger.info("Initialize VoiceTransformTrack.")
         self.__track: MediaStreamTrack = track
         self.__vcs: RTCVoiceChatSession = vcs
-        # SpeechExtractor -> SpeechRecognizer用フォーマットは1ch, 16bit, 16000Hz
-        self.__resampler = AudioResampler(layout=1, rate=16000)
-        self.__audio_broker = AudioBroker(
+        # audio_broker_mode: thread, asyncio
+        # asyncioの場合はこのトラックと同じイベントループ上でAudioBrokerを動かす。
+        broker_class: type[AudioBroker | AsyncAudioBroker] = AudioBroker
+        if audio_broker_mode == "asyncio":
+            broker_class = AsyncAudioBroker
+        self.__audio_broker: AudioBroker | AsyncAudioBroker = broker_class(
             session_id=self.__session_id,
             talk_mode=self.__vcs.talk_mode,
             consul_agent_host=consul_agent_host,
             consul_agent_port=consul_agent_port,
             fallback_host=fallback_host,
             fallback_port=fallback_port,
+            extractor_codec=extractor_codec,
+            synthesizer_audio_format=synthesizer_audio_format,
+            playout_options=playout_options,
+        )
+        # SpeechExtractor -> SpeechRecognizer用フォーマットは1ch, 16bit, 16000Hz
+        self.__ingest_buffer: VoiceIngestBuffer = VoiceIngestBuffer(
+            add_frame=self.__audio_broker.add_frame, sampling_rate=16000
         )
+        # 合成音声は返すフレームと同じ形式、同じサンプル数に分割させる
+        self.__audio_broker.return_frame_format["sample_rate"] = self.SAMPLE_RATE
+        self.__audio_broker.return_frame_format["sample_size"] = self.FRAME_SAMPLES
+        # 合成音声が無い間に返す無音フレーム
+        self.__silence_frames: SilenceFrameCache = SilenceFrameCache()
+        # マイクのフレームを受け取るタスク。最初のrecv()で起動する。
+        self.__mic_task: asyncio.Task | None = None
+        # 最初のフレームを返した時刻(loop.time())と、次に返すフレームのpts
+        self.__start_t: float | None = None
+        self.__pts: int = 0
 
-    # デコード済みのオーディオフレームを受け取って、何らかの処理を行った上で
-    # フレームを返す。
-    # 返却するフレームは、同じフォーマット、かつ同じサンプル数でなければならない。
+    # 次のフレームの時刻まで待ち、合成音声(無ければ無音)のフレームを返す。
     # ここでフレームを返さないと、aiortc/rtcrtpsender.pyのnext_encoded_frameの
     # await self.__track.recv()がデッドロックしてしまう。
     async def recv(self) -> AudioFrame:
-        if not self.__audio_broker.is_running():
-            # AudioBrokerに異常が発生したら、RTC Sessionも止める
+        if self.__mic_task is None:
+            self.__mic_task = asyncio.ensure_future(self.__receive_mic())
+        if not self.__audio_broker.is_running() or self.__mic_task.done():
+            # AudioBrokerかマイクの受信に異常が発生したら、RTC Sessionも止める
             self.__rtc_finalize_event.set()
             return self.__generate_dummy_frame()
 
         try:
-            frame: Frame | Packet = await self.__track.recv()
-            assert isinstance(frame, AudioFrame)
-            return self.__transform(frame)
+            await self.__wait_next_frame()
+            return self.__transform(self.__pts)
         except CancelledError:
             self.__logger.info("recv - CancelledError.")
         except MediaStreamError:
@@ -80,13 +112,40 @@ class VoiceTransformTrack(MediaStreamTrack):
         self.__rtc_finalize_event.set()
         return self.__generate_dummy_frame()
 
-    def __transform(self, frame: AudioFrame) -> AudioFrame:
+    # 返すフレームのptsを進め、その時刻まで待つ。
+    # マイクのフレームが遅れたりまとめて届いたりしても、再生の速さは変わらない。
+    # 処理が遅れた場合は、追いつくまで待たずに返す。
+    async def __wait_next_frame(self) -> None:
+        now: float = asyncio.get_running_loop().time()
+        if self.__start_t is None:
+            self.__start_t = now
+        else:
+            self.__pts += self.FRAME_SAMPLES
+        wait: float = self.__start_t + self.__pts / self.SAMPLE_RATE - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # マイクのフレームを受け取り、SpeechExtractor向けのバッファへ書き込む。
+    async def __receive_mic(self) -> None:
+        try:
+            while True:
+                frame: Frame | Packet = await self.__track.recv()
+                assert isinstance(frame, AudioFrame)
+                self.__ingest_buffer.write(frame)
+        except CancelledError:
+            self.__logger.info("receive_mic - CancelledError.")
+            raise
+        except MediaStreamError:
+            self.__logger.info("receive_mic - MediaStreamError.")
+        except Exception as e:
+            self.__logger.error(
+                f"receive_mic - UnknownError: {repr(e)}\n{traceback.format_exc()}",
+            )
+        # マイクの受信が終わったらrtcをshutdownする
+        self.__rtc_finalize_event.set()
+
+    def __transform(self, pts: int) -> AudioFrame:
         try:
-            self.__audio_broker.return_frame_format["sample_rate"] = frame.sample_rate
-            self.__audio_broker.return_frame_format["sample_size"] = frame.samples
-            resampled_frames = self.__resampler.resample(frame)
-            for rf in resampled_frames:
-                self.__audio_broker.add_frame(rf.to_ndarray().tobytes())
             if (
                 self.__vcs.text_ch is not None
                 and (sr_result := self.__get_recognized_text()) is not None
@@ -98,15 +157,16 @@ class VoiceTransformTrack(MediaStreamTrack):
             ):
                 if synth_voice.new_text:
                     self.__vcs.telop_ch.send(synth_voice.params_to_json())
-                newframe = frame.from_ndarray(
+                newframe = AudioFrame.from_ndarray(
                     synth_voice.vframe,
                     format="s16",
                     layout="stereo",
                 )
-                newframe.pts = frame.pts
-                newframe.rate = frame.sample_rate
+                newframe.pts = pts
+                newframe.sample_rate = self.SAMPLE_RATE
+                newframe.time_base = Fraction(1, self.SAMPLE_RATE)
             else:
-                newframe = self.__convert_dummy_frame(frame)
+                newframe = self.__convert_dummy_frame(pts)
             return newframe
         except AttributeError as e:
             self.__logger.error(
@@ -124,7 +184,7 @@ class VoiceTransformTrack(MediaStreamTrack):
         # 何らかの例外が発生した時はrtcをshutdownする
         self.__rtc_finalize_event.set()
         # フレームを返さないとデッドロックするため、ダミーフレームを返す
-        return self.__convert_dummy_frame(frame)
+        return self.__convert_dummy_frame(pts)
 
     def __get_recognized_text(self) -> TextProcessorResult | None:
         if len(self.__audio_broker.text_channel_queue) > 0:
@@ -135,43 +195,24 @@ class VoiceTransformTrack(MediaStreamTrack):
         return None
 
     def __get_voice_frame(self) -> VoiceSynthesizerResultFrame | None:
-        if len(self.__audio_broker.voice_frame_queue) > 0:
-            vs_result: VoiceSynthesizerResultFrame = (
-                self.__audio_broker.voice_frame_queue.popleft()
-            )
-            return vs_result
-        return None
+        return self.__audio_broker.voice_playout_buffer.pop()
 
-    def __convert_dummy_frame(self, frame: AudioFrame) -> AudioFrame:
-        # opus/48000Hz/2chで1920フレームらしい
-        zero_frame: np.ndarray = np.zeros((frame.to_ndarray().shape), dtype=np.int16)
-        newframe: AudioFrame = frame.from_ndarray(
-            zero_frame,
-            format="s16",
+    def __convert_dummy_frame(self, pts: int) -> AudioFrame:
+        return self.__silence_frames.get(
+            sample_rate=self.SAMPLE_RATE,
+            samples=self.FRAME_SAMPLES,
             layout="stereo",
+            pts=pts,
         )
-        newframe.pts = frame.pts
-        newframe.rate = 48000
-        return newframe
 
     def __generate_dummy_frame(self) -> AudioFrame:
-        samplerate = 48000
-        blocksize = 960
-        byte_frame: bytes = b"\0" * blocksize * 2
-        np_frame: np.ndarray = np.frombuffer(byte_frame, dtype=np.int16)
-        frame = AudioFrame.from_ndarray(
-            np_frame.reshape(1, blocksize),
-            format="s16",
-            layout="mono",
+        return self.__silence_frames.get(
+            sample_rate=48000, samples=960, layout="mono", pts=0
         )
-        frame.pts = 0
-        frame.time_base = Fraction(1, samplerate)
-        frame.sample_rate = samplerate
-        return frame
-
-    def close(self) -> None:
-        self.__logger.info("Closing VoiceTransformTrack.")
 
+    # AudioBrokerのみを停止する。
+    # スレッド版はjoinでブロックするため、イベントループ外から呼べるよう分けている。
+    def close_audio_broker(self) -> None:
         try:
             self.__audio_broker.close()
         except Exception as e:
@@ -179,6 +220,19 @@ class VoiceTransformTrack(MediaStreamTrack):
                 f"close - UnknownError: {repr(e)}\n{traceback.format_exc()}",
             )
             traceback.print_exc()
+
+    def statuses(self) -> dict:
+        return self.__audio_broker.statuses()
+
+    def stop(self) -> None:
+        if self.__mic_task is not None:
+            self.__mic_task.cancel()
+        super().stop()
+
+    def close(self) -> None:
+        self.__logger.info("Closing VoiceTransformTrack.")
+
+        self.close_audio_broker()
         try:
             self.stop()
         except Exception as e:
@@ -1,13 +1,29 @@
+from .RTCPooledSessionDescription import RTCPooledSessionDescription
+from .RTCSessionHandler import RTCSessionHandler
 from .RTCSessionManager import RTCSessionManager
 from .RTCSessionProcess import RTCSessionProcess
 from .RTCSessionProcessDescription import RTCSessionProcessDescription
 from .RTCSessionProcessManagementThread import RTCSessionProcessManagementThread
+from .RTCSessionProcessPool import RTCIdleSessionProcess, RTCSessionProcessPool
+from .RTCSessionWorker import RTCSessionWorker, RTCSessionWorkerError
+from .RTCSessionWorkerProcess import RTCSessionWorkerProcess
+from .SilenceFrameCache import SilenceFrameCache
+from .VoiceIngestBuffer import VoiceIngestBuffer
 from .VoiceTransformTrack import VoiceTransformTrack
 
 __all__ = [
+    "RTCIdleSessionProcess",
+    "RTCPooledSessionDescription",
+    "RTCSessionHandler",
     "RTCSessionProcess",
     "RTCSessionProcessDescription",
     "RTCSessionProcessManagementThread",
+    "RTCSessionProcessPool",
     "RTCSessionManager",
+    "RTCSessionWorker",
+    "RTCSessionWorkerError",
+    "RTCSessionWorkerProcess",
+    "SilenceFrameCache",
+    "VoiceIngestBuffer",
     "VoiceTransformTrack",
 ]
@@ -12,6 +12,18 @@ class RTCSignalingServerArgument(SincromisorArgumentParser):
     max_sessions: int
     fallback_host: str | None
     fallback_port: int | None
+    audio_broker_mode: str
+    extractor_codec: str
+    synthesizer_audio_format: str
+    session_worker_mode: str
+    session_workers: int
+    warm_processes: int
+    offer_timeout: float
+    playout_target_depth: int
+    playout_max_depth: int
+    playout_max_bytes: int
+    playout_overrun_policy: str
+    playout_underrun_policy: str
 
     @classmethod
     def set_args(cls, parser: ArgumentParser) -> None:
@@ -87,4 +99,128 @@ class RTCSignalingServerArgument(SincromisorArgumentParser):
             help="Fallback server port(default: 80)",
         )
 
+        # AudioBrokerの動作モード
+        # thread: サービスごとに送受信スレッドを立てる(従来の動作)
+        # asyncio: RTCSessionProcess(RTCSessionWorkerProcess)のイベントループ上でタスクとして動かす
+        # --session-worker-mode poolの場合は常にasyncioとなる。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--audio-broker-mode",
+            env_name="SINCRO_RTC_AUDIO_BROKER_MODE",
+            default="thread",
+            help="AudioBroker mode, thread or asyncio(default: thread)",
+        )
+
+        # SpeechExtractorへ送る音声の形式
+        # pcm: int16, 16000Hz, 1chのPCM(約256kbps)
+        # opus: Opusでエンコードして送る(約24kbps)。SpeechExtractorが別ホストの場合向け。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--extractor-codec",
+            env_name="SINCRO_RTC_EXTRACTOR_CODEC",
+            default="pcm",
+            help="Audio codec sent to SpeechExtractor, pcm or opus(default: pcm)",
+        )
+
+        # VoiceSynthesizerから受け取る音声の形式
+        # audio/ogg;codecs=opus: Opusで受け取り、デコードしてから再生する(従来の動作)
+        # audio/pcm;rate=48000: s16, 2chのPCMで受け取り、そのままフレームに分割する。
+        #   コーデックの処理は無くなるが、約1.5Mbpsとなる。VoiceSynthesizerが同じホストの場合向け。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--synthesizer-audio-format",
+            env_name="SINCRO_RTC_SYNTHESIZER_AUDIO_FORMAT",
+            default="audio/ogg;codecs=opus",
+            help="Audio format requested from VoiceSynthesizer(default: audio/ogg;codecs=opus)",
+        )
+
+        # WebRTCセッションを持つプロセスの動作モード
+        # process: セッションごとにプロセスを生成する(従来の動作)
+        # pool: 常駐するワーカープロセスに複数のセッションを持たせる
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--session-worker-mode",
+            env_name="SINCRO_RTC_SESSION_WORKER_MODE",
+            default="process",
+            help="RTC session worker mode, process or pool(default: process)",
+        )
+
+        # poolモードで起動するワーカープロセスの数
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--session-workers",
+            env_name="SINCRO_RTC_SESSION_WORKERS",
+            default=4,
+            help="Number of RTC session worker processes in pool mode(default: 4)",
+        )
+
+        # processモードで事前に起動しておく待機プロセスの数
+        # 0の場合はオファーを受けてからプロセスを起動する(従来の動作)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--warm-processes",
+            env_name="SINCRO_RTC_WARM_PROCESSES",
+            default=0,
+            help="Number of pre-spawned idle RTC session processes(default: 0)",
+        )
+
+        # オファーを受けてからSDPを返すまでのタイムアウト(秒)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--offer-timeout",
+            env_name="SINCRO_RTC_OFFER_TIMEOUT",
+            default=30.0,
+            help="Timeout seconds for creating an answer to an offer(default: 30.0)",
+        )
+
+        # VoicePlayoutBufferの再生開始前に溜める20msフレームの数
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--playout-target-depth",
+            env_name="SINCRO_RTC_PLAYOUT_TARGET_DEPTH",
+            default=5,
+            help="Frames buffered before playout starts(default: 5)",
+        )
+
+        # VoicePlayoutBufferに保持するフレーム数の上限
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--playout-max-depth",
+            env_name="SINCRO_RTC_PLAYOUT_MAX_DEPTH",
+            default=250,
+            help="Max frames in the playout buffer(default: 250)",
+        )
+
+        # VoicePlayoutBufferに保持するバイト数の上限
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--playout-max-bytes",
+            env_name="SINCRO_RTC_PLAYOUT_MAX_BYTES",
+            default=4 * 1024 * 1024,
+            help="Max bytes in the playout buffer(default: 4194304)",
+        )
+
+        # VoicePlayoutBufferが上限に達した場合の動作
+        # wait: 空くまでVoiceSynthesizerからの受信を止める
+        # drop_oldest: 古いフレームを捨てる
+        # drop_newest: 追加しようとしたフレームを捨てる
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--playout-overrun-policy",
+            env_name="SINCRO_RTC_PLAYOUT_OVERRUN_POLICY",
+            default="wait",
+            help="Playout overrun policy, wait/drop_oldest/drop_newest(default: wait)",
+        )
+
+        # VoicePlayoutBufferが空になった場合の動作
+        # silence: 無音のフレームを返す
+        # stretch: 直前のフレームを繰り返して間を埋める
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--playout-underrun-policy",
+            env_name="SINCRO_RTC_PLAYOUT_UNDERRUN_POLICY",
+            default="silence",
+            help="Playout underrun policy, silence or stretch(default: silence)",
+        )
+
         return
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+
+
+# VoicePlayoutBufferの設定。
+# RTCSignalingServerArgumentから各セッションのAudioBrokerまで受け渡す。
+class VoicePlayoutOptions(BaseModel):
+    # 再生開始前に溜めるフレーム数
+    target_depth: int = 5
+    # 保持するフレーム数とバイト数の上限
+    max_depth: int = 250
+    max_bytes: int = 4 * 1024 * 1024
+    # wait, drop_oldest, drop_newest
+    overrun_policy: str = "wait"
+    # silence, stretch
+    underrun_policy: str = "silence"
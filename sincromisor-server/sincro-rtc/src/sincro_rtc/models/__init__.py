@@ -1,9 +1,11 @@
 from .RTCSessionOffer import RTCSessionOffer
 from .RTCSignalingServerArgument import RTCSignalingServerArgument
 from .RTCVoiceChatSession import RTCVoiceChatSession
+from .VoicePlayoutOptions import VoicePlayoutOptions
 
 __all__ = [
     "RTCSessionOffer",
     "RTCVoiceChatSession",
     "RTCSignalingServerArgument",
+    "VoicePlayoutOptions",
 ]
@@ -1,7 +1,11 @@
 import logging
 import logging.config
+import socket
+import time
 import traceback
 from logging import Logger
+from multiprocessing import Array, Process
+from multiprocessing.sharedctypes import SynchronizedArray
 from threading import Event
 
 import uvicorn
@@ -11,7 +15,7 @@ from setproctitle import setproctitle
 from sincro_config import ServiceDiscoveryReporter, SincromisorLoggerConfig
 from sincro_models import SpeechExtractorInitializeRequest
 from speech_extractor.models import SpeechExtractorProcessArgument
-from speech_extractor.SpeechExtractor import SpeechExtractorWorker
+from speech_extractor.SpeechExtractor import SpeechEnergyGate, SpeechExtractorWorker
 
 setproctitle("SPExtractor")
 
@@ -26,29 +30,36 @@ class SpeechExtractorProcess:
         self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
         self.__logger.info("===== Starting SpeechExtractorProcess =====")
         self.__args: SpeechExtractorProcessArgument = args
-        self.__sessions: int = 0
+        self.__workers: int = max(1, self.__args.workers)
+        self.__worker_id: int = 0
+        # ワーカーごとのセッション数。/statusesでは全ワーカーの合計を返す。
+        self.__sessions: SynchronizedArray = Array("i", self.__workers)
 
-    def start(self):
-        SpeechExtractorWorker.setup_model()
-        app: FastAPI = FastAPI()
-        event: Event = Event()
-        if not self.__args.consul_agent_host or not self.__args.consul_agent_port:
-            raise RuntimeError(
-                "Consul agent is not set. Service discovery will not be available.",
-            )
-        self.sd_reporter: ServiceDiscoveryReporter = ServiceDiscoveryReporter(
-            worker_type="SpeechExtractor",
-            consul_host=self.__args.consul_agent_host,
-            consul_port=self.__args.consul_agent_port,
-            public_bind_host=self.__args.public_bind_host,
-            public_bind_port=self.__args.public_bind_port,
+    def __add_sessions(self, count: int) -> None:
+        with self.__sessions.get_lock():
+            self.__sessions[self.__worker_id] += count
+
+    def __create_app(self) -> FastAPI:
+        app: FastAPI = FastAPI(
+            on_startup=[SpeechExtractorWorker.vad_batcher.start],
+            on_shutdown=[
+                SpeechExtractorWorker.vad_batcher.stop,
+                SpeechExtractorWorker.inference_executor.shutdown,
+            ],
         )
-        self.sd_reporter.start()
 
         @app.get("/api/v1/SpeechExtractor/statuses")
         async def get_status() -> JSONResponse:
             return JSONResponse(
-                {"worker_type": "SpeechExtractor", "sessions": self.__sessions}
+                {
+                    "worker_type": "SpeechExtractor",
+                    "sessions": sum(self.__sessions),
+                    "workers": self.__workers,
+                    "worker_id": self.__worker_id,
+                    "inference": SpeechExtractorWorker.inference_executor.statuses(),
+                    "vad_batch": SpeechExtractorWorker.vad_batcher.statuses(),
+                    "energy_gate": SpeechExtractorWorker.gate_statuses(),
+                }
             )
 
         @app.websocket("/api/v1/SpeechExtractor/extract")
@@ -56,15 +67,30 @@ class SpeechExtractorProcess:
             ws: WebSocket, max_silence_ms: int = 600
         ) -> None:
             self.__logger.info(f"Connected Websocket - max_silence_ms={max_silence_ms}")
-            self.__sessions += 1
+            self.__add_sessions(1)
+            SpeechExtractorWorker.vad_batcher.add_sessions(1)
             try:
                 await ws.accept()
                 pack = await ws.receive_bytes()
                 speRequest = SpeechExtractorInitializeRequest.from_msgpack(pack=pack)
+                energy_gate: SpeechEnergyGate | None = None
+                if speRequest.energy_gate:
+                    energy_gate = SpeechEnergyGate(
+                        sampling_rate=speRequest.voice_sampling_rate,
+                        open_db=speRequest.energy_gate_open_db,
+                        close_db=speRequest.energy_gate_close_db,
+                        max_zcr=speRequest.energy_gate_max_zcr,
+                        min_dbfs=speRequest.energy_gate_min_dbfs,
+                        hangover_ms=speRequest.energy_gate_hangover_ms,
+                        calibration_ms=speRequest.energy_gate_calibration_ms,
+                    )
                 speechExtractor = SpeechExtractorWorker(
                     session_id=speRequest.session_id,
                     voice_channels=speRequest.voice_channels,
                     voice_sampling_rate=speRequest.voice_sampling_rate,
+                    energy_gate=energy_gate,
+                    result_format=speRequest.result_format,
+                    voice_codec=speRequest.voice_codec,
                 )
                 await speechExtractor.extract(ws=ws, max_silence_ms=max_silence_ms)
             except WebSocketDisconnect:
@@ -74,7 +100,8 @@ class SpeechExtractorProcess:
                     f"UnknownError: {repr(e)}\n{traceback.format_exc()}",
                 )
             finally:
-                self.__sessions -= 1
+                self.__add_sessions(-1)
+                SpeechExtractorWorker.vad_batcher.add_sessions(-1)
                 try:
                     await ws.close()
                 except RuntimeError:
@@ -82,6 +109,98 @@ class SpeechExtractorProcess:
                         "WebSocket is already closed.",
                     )
 
+        return app
+
+    # 各ワーカーが同じポートをlistenできるよう、SO_REUSEPORTを付けたソケットを作る。
+    # 接続はカーネルによってワーカー間に振り分けられる。
+    def __bind_reuseport_socket(self) -> socket.socket:
+        sock: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.__args.host, self.__args.port))
+        return sock
+
+    def __setup_model(self) -> None:
+        SpeechExtractorWorker.setup_model(
+            max_pending=self.__args.max_pending,
+            vad_batch_size=self.__args.vad_batch_size,
+            vad_tick_ms=self.__args.vad_tick_ms,
+        )
+
+    # ワーカープロセスの本体。classifierはワーカーごとに読み込む。
+    def __serve_worker(self, worker_id: int) -> None:
+        setproctitle(f"SPExtractor[{worker_id}]")
+        self.__worker_id = worker_id
+        self.__logger = logging.getLogger(
+            "sincro." + self.__class__.__name__ + f"[{worker_id}]"
+        )
+        self.__setup_model()
+        sock: socket.socket = self.__bind_reuseport_socket()
+        server: uvicorn.Server = uvicorn.Server(
+            uvicorn.Config(
+                self.__create_app(), host=self.__args.host, port=self.__args.port
+            )
+        )
+        try:
+            server.run(sockets=[sock])
+        except KeyboardInterrupt:
+            pass
+
+    def __start_worker(self, worker_id: int) -> Process:
+        ps: Process = Process(target=self.__serve_worker, args=(worker_id,))
+        ps.start()
+        self.__logger.info(f"Worker {worker_id} started(pid: {ps.pid}).")
+        return ps
+
+    # ワーカープロセスを起動し、終了したものは起動し直す。
+    def __supervise_workers(self) -> None:
+        processes: list[Process] = [
+            self.__start_worker(worker_id) for worker_id in range(self.__workers)
+        ]
+        try:
+            while True:
+                for worker_id, ps in enumerate(processes):
+                    if not ps.is_alive():
+                        self.__logger.warning(
+                            f"Worker {worker_id} terminated(exitcode: {ps.exitcode})."
+                        )
+                        with self.__sessions.get_lock():
+                            self.__sessions[worker_id] = 0
+                        processes[worker_id] = self.__start_worker(worker_id)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for ps in processes:
+                ps.terminate()
+            for ps in processes:
+                ps.join(timeout=10)
+
+    def start(self):
+        event: Event = Event()
+        if not self.__args.consul_agent_host or not self.__args.consul_agent_port:
+            raise RuntimeError(
+                "Consul agent is not set. Service discovery will not be available.",
+            )
+        # 全ワーカーが同じポートを共有するため、サービスの登録は親プロセスで1度だけ行う。
+        self.sd_reporter: ServiceDiscoveryReporter = ServiceDiscoveryReporter(
+            worker_type="SpeechExtractor",
+            consul_host=self.__args.consul_agent_host,
+            consul_port=self.__args.consul_agent_port,
+            public_bind_host=self.__args.public_bind_host,
+            public_bind_port=self.__args.public_bind_port,
+        )
+        self.sd_reporter.start()
+
+        if self.__workers > 1:
+            try:
+                self.__supervise_workers()
+            finally:
+                event.set()
+            return
+
+        self.__setup_model()
+        app: FastAPI = self.__create_app()
         try:
             uvicorn.run(app, host=self.__args.host, port=self.__args.port)
         except KeyboardInterrupt:
@@ -0,0 +1,100 @@
+import numpy as np
+
+
+# classifierにかける前に、明らかな無音を音量で弾くためのゲート。
+# 背景雑音の音量(noise floor)を追従し、そこからの差(dB)で判定する。
+# - floor + open_db以上で開く
+# - floor + close_db以上で、かつゼロ交差率がmax_zcr以下(有声音らしい)なら開く
+# - 開いた後はfloor + close_db未満がhangover_ms続くまで開いたままにする
+# 最初のcalibration_msは開いたままにし、その間の最も静かなフレームをnoise floorとする。
+# セッション開始時に話し始めていても、発話の音量をnoise floorとみなさないため。
+# ゲートが閉じている間のフレームはclassifierにかけず、無音として扱う。
+class SpeechEnergyGate:
+    def __init__(
+        self,
+        sampling_rate: int = 16000,
+        open_db: float = 9.0,
+        close_db: float = 5.0,
+        max_zcr: float = 0.25,
+        min_dbfs: float = -60.0,
+        hangover_ms: int = 400,
+        calibration_ms: int = 1000,
+        dtype: type = np.int16,
+    ):
+        self.__sampling_rate: int = sampling_rate
+        self.__open_db: float = open_db
+        self.__close_db: float = close_db
+        self.__max_zcr: float = max_zcr
+        self.__min_dbfs: float = min_dbfs
+        self.__hangover_ms: int = hangover_ms
+        self.__calibration_ms: int = calibration_ms
+        self.__calibrated_ms: int = 0
+        self.__full_scale: float = float(np.iinfo(dtype).max)
+        self.__noise_floor_dbfs: float | None = None
+        self.__opened: bool = False
+        self.__below_ms: int = 0
+
+    @property
+    def noise_floor_dbfs(self) -> float | None:
+        return self.__noise_floor_dbfs
+
+    def __measure(self, audio: np.ndarray) -> tuple[float, float]:
+        samples: np.ndarray = audio.astype(np.float32)
+        rms: float = float(np.sqrt(np.dot(samples, samples) / max(samples.size, 1)))
+        dbfs: float = 20 * np.log10(max(rms, 1.0) / self.__full_scale)
+        zcr: float = float(
+            np.count_nonzero(np.diff(np.signbit(audio))) / max(audio.size - 1, 1)
+        )
+        return dbfs, zcr
+
+    # 閉じている間だけnoise floorを更新する。
+    # 下がる方向には速く、上がる方向にはゆっくり追従する。
+    def __update_noise_floor(self, dbfs: float) -> None:
+        dbfs = max(dbfs, self.__min_dbfs)
+        if self.__noise_floor_dbfs is None:
+            self.__noise_floor_dbfs = dbfs
+        elif dbfs < self.__noise_floor_dbfs:
+            self.__noise_floor_dbfs += (dbfs - self.__noise_floor_dbfs) * 0.5
+        else:
+            self.__noise_floor_dbfs += (dbfs - self.__noise_floor_dbfs) * 0.05
+
+    # calibration_msの間に見つかった、最も静かなフレームの音量をnoise floorとする。
+    def __calibrate(self, dbfs: float) -> None:
+        dbfs = max(dbfs, self.__min_dbfs)
+        if self.__noise_floor_dbfs is None or dbfs < self.__noise_floor_dbfs:
+            self.__noise_floor_dbfs = dbfs
+
+    # classifierにかけるべきフレームであればTrueを返す。
+    def check(self, audio: np.ndarray) -> bool:
+        dbfs, zcr = self.__measure(audio)
+        frame_ms: int = int(audio.size / self.__sampling_rate * 1000)
+        if self.__calibrated_ms < self.__calibration_ms:
+            self.__calibrated_ms += frame_ms
+            self.__calibrate(dbfs)
+            self.__opened = True
+            self.__below_ms = 0
+            return True
+        if self.__noise_floor_dbfs is None:
+            self.__update_noise_floor(dbfs)
+        assert self.__noise_floor_dbfs is not None
+        floor: float = self.__noise_floor_dbfs
+
+        if dbfs < self.__min_dbfs:
+            loud = False
+        elif dbfs >= floor + self.__open_db:
+            loud = True
+        elif dbfs >= floor + self.__close_db:
+            loud = self.__opened or zcr <= self.__max_zcr
+        else:
+            loud = False
+
+        if loud:
+            self.__opened = True
+            self.__below_ms = 0
+        elif self.__opened:
+            self.__below_ms += frame_ms
+            if self.__below_ms >= self.__hangover_ms:
+                self.__opened = False
+        if not self.__opened:
+            self.__update_noise_floor(dbfs)
+        return self.__opened
@@ -0,0 +1,45 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+
+# 音声検知などの推論をイベントループの外(専用スレッド)で実行する。
+# 実行待ちがmax_pendingに達している場合は推論を行わずにNoneを返し、
+# 呼び出し側で負荷を逃がせるようにする。
+class SpeechExtractorInferenceExecutor:
+    def __init__(self, max_workers: int = 1, max_pending: int = 32):
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="extractor"
+        )
+        self.__max_pending: int = max(1, max_pending)
+        self.__pending: int = 0
+        self.__peak_pending: int = 0
+        self.__completed: int = 0
+        self.__shed: int = 0
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any | None:
+        if self.__pending >= self.__max_pending:
+            self.__shed += 1
+            return None
+        self.__pending += 1
+        self.__peak_pending = max(self.__peak_pending, self.__pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__executor, func, *args
+            )
+        finally:
+            self.__pending -= 1
+            self.__completed += 1
+
+    def statuses(self) -> dict:
+        return {
+            "pending": self.__pending,
+            "peak_pending": self.__peak_pending,
+            "max_pending": self.__max_pending,
+            "completed": self.__completed,
+            "shed": self.__shed,
+        }
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,31 @@
+import av
+import numpy as np
+from av.audio.codeccontext import AudioCodecContext
+from av.audio.resampler import AudioResampler
+
+
+# AudioBroker(VoiceOpusEncoder)から届くOpusパケットを、
+# int16, 1chのPCMにデコードする。1メッセージが1つのOpusパケットとなる。
+class SpeechExtractorOpusDecoder:
+    def __init__(self, sampling_rate: int = 16000):
+        codec = av.CodecContext.create("opus", "r")
+        assert isinstance(codec, AudioCodecContext)
+        codec.sample_rate = sampling_rate
+        codec.layout = "mono"
+        self.__codec: AudioCodecContext = codec
+        # デコーダの出力はfloatのため、int16に変換する
+        self.__resampler: AudioResampler = AudioResampler(
+            format="s16", layout="mono", rate=sampling_rate
+        )
+
+    def decode(self, packet: bytes) -> np.ndarray:
+        samples: list[np.ndarray] = [
+            resampled_frame.to_ndarray().reshape(-1)
+            for frame in self.__codec.decode(av.Packet(packet))
+            for resampled_frame in self.__resampler.resample(frame)
+        ]
+        if len(samples) == 0:
+            return np.zeros(0, dtype=np.int16)
+        if len(samples) == 1:
+            return samples[0]
+        return np.concatenate(samples, dtype=np.int16)
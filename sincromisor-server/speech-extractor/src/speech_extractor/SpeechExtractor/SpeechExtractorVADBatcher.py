@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from collections.abc import Callable
+from logging import Logger
+
+import numpy as np
+
+from .SpeechExtractorInferenceExecutor import SpeechExtractorInferenceExecutor
+
+
+# 全セッションの音声検知の要求を集め、まとめて推論スレッドに渡す。
+# 前回の推論中に届いた要求は、次の1回の推論スレッド呼び出しでまとめて判定する。
+# classifierは1クリップずつ判定するため、まとめて減るのは推論スレッドとの往復のみ。
+# tick_msが0より大きく、他にも判定中のセッションがある場合は、
+# 全セッションの要求が揃うかtick_msが経過するまで待ってからまとめる。
+# 判定待ちがmax_pendingに達している場合は推論せずにNoneを返す。
+class SpeechExtractorVADBatcher:
+    def __init__(
+        self,
+        executor: SpeechExtractorInferenceExecutor,
+        classify_batch: Callable[[list[tuple[np.ndarray, int]]], list[bool]],
+        max_batch_size: int = 16,
+        tick_ms: int = 0,
+        max_pending: int = 32,
+    ):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__executor: SpeechExtractorInferenceExecutor = executor
+        self.__classify_batch: Callable[[list[tuple[np.ndarray, int]]], list[bool]] = (
+            classify_batch
+        )
+        self.__max_batch_size: int = max(1, max_batch_size)
+        self.__tick: float = tick_ms / 1000
+        self.__max_pending: int = max(1, max_pending)
+        self.__pending: deque[tuple[np.ndarray, int, asyncio.Future]] = deque()
+        self.__queued: asyncio.Event = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+        # 音声検知を行っているセッションの数
+        self.__sessions: int = 0
+        self.__peak_pending: int = 0
+        self.__shed: int = 0
+        # バッチサイズごとの実行回数
+        self.__batch_sizes: dict[int, int] = {}
+
+    async def start(self) -> None:
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+
+    def statuses(self) -> dict:
+        return {
+            "max_batch_size": self.__max_batch_size,
+            "tick_ms": int(self.__tick * 1000),
+            "sessions": self.__sessions,
+            "pending": len(self.__pending),
+            "peak_pending": self.__peak_pending,
+            "max_pending": self.__max_pending,
+            "shed": self.__shed,
+            "batch_sizes": dict(sorted(self.__batch_sizes.items())),
+        }
+
+    def add_sessions(self, count: int) -> None:
+        self.__sessions += count
+
+    # 音声が含まれていればTrue、過負荷で判定できなかった場合はNoneを返す。
+    # audioは判定結果が返るまで書き換えないこと。
+    async def check(self, audio: np.ndarray, sampling_rate: int) -> bool | None:
+        if len(self.__pending) >= self.__max_pending:
+            self.__shed += 1
+            return None
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.__pending.append((audio, sampling_rate, future))
+        self.__peak_pending = max(self.__peak_pending, len(self.__pending))
+        self.__queued.set()
+        return await future
+
+    async def __collect(self) -> list[tuple[np.ndarray, int, asyncio.Future]]:
+        while len(self.__pending) == 0:
+            self.__queued.clear()
+            await self.__queued.wait()
+        # 他のセッションの要求が揃うまで、最大で1tick待つ
+        if self.__tick > 0 and self.__sessions > 1:
+            deadline: float = asyncio.get_running_loop().time() + self.__tick
+            while len(self.__pending) < min(self.__sessions, self.__max_batch_size):
+                self.__queued.clear()
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        await self.__queued.wait()
+                except TimeoutError:
+                    break
+        batch = []
+        while len(self.__pending) > 0 and len(batch) < self.__max_batch_size:
+            request = self.__pending.popleft()
+            # セッションが切断されて待つ者がいない要求は捨てる
+            if not request[2].cancelled():
+                batch.append(request)
+        return batch
+
+    async def __run(self) -> None:
+        while True:
+            batch = await self.__collect()
+            if len(batch) == 0:
+                continue
+            self.__batch_sizes[len(batch)] = self.__batch_sizes.get(len(batch), 0) + 1
+            try:
+                results: list[bool] | None = await self.__executor.run(
+                    self.__classify_batch,
+                    [(audio, sampling_rate) for audio, sampling_rate, _ in batch],
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}"
+                )
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            if results is None:
+                # 推論スレッドが溢れている場合は、全セッションに判定不能を返す
+                self.__shed += len(batch)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+                continue
+            for (_, _, future), result in zip(batch, results, strict=True):
+                if not future.done():
+                    future.set_result(result)
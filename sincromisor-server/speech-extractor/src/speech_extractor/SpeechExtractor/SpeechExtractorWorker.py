@@ -8,17 +8,34 @@ from mediapipe.tasks import python
 from mediapipe.tasks.python import audio
 from mediapipe.tasks.python.audio.audio_classifier import AudioClassifier
 from mediapipe.tasks.python.components import containers
-from sincro_models import SpeechExtractorResult
+from sincro_models import AudioBuffer, SpeechExtractorResult
+
+from .SpeechEnergyGate import SpeechEnergyGate
+from .SpeechExtractorInferenceExecutor import SpeechExtractorInferenceExecutor
+from .SpeechExtractorOpusDecoder import SpeechExtractorOpusDecoder
+from .SpeechExtractorVADBatcher import SpeechExtractorVADBatcher
 
 
 class SpeechExtractorWorker:
     classifier: AudioClassifier
+    # 全セッションで共有する、classifier用の推論スレッド
+    inference_executor: SpeechExtractorInferenceExecutor
+    # 全セッションの音声検知をまとめて推論スレッドに渡す
+    vad_batcher: SpeechExtractorVADBatcher
+    # classifierに渡す際の、int16からfloat32([-1.0, 1.0])への係数
+    voice_scale: np.float32 = np.float32(1.0 / np.iinfo(np.int16).max)
+    # SpeechEnergyGateで弾いたフレーム数と、classifierにかけたフレーム数(全セッション合計)
+    gate_skipped_frames: int = 0
+    gate_classified_frames: int = 0
 
     def __init__(
         self,
         session_id: str,
         voice_channels: int = 1,
         voice_sampling_rate: int = 16000,
+        energy_gate: SpeechEnergyGate | None = None,
+        result_format: str = "msgpack",
+        voice_codec: str = "pcm",
     ):
         self.logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
         self.session_id: str = session_id
@@ -26,10 +43,23 @@ class SpeechExtractorWorker:
         self.voice_sampling_rate: int = voice_sampling_rate
         self.voice_dtype: type = np.int16
         self.voice_sample_bytes: int = np.dtype(self.voice_dtype).itemsize
+        self.energy_gate: SpeechEnergyGate | None = energy_gate
+        self.result_format: str = result_format
+        # voice_codecがopusの場合、受信したパケットをデコードしてから扱う
+        self.opus_decoder: SpeechExtractorOpusDecoder | None = None
+        if voice_codec == "opus":
+            self.opus_decoder = SpeechExtractorOpusDecoder(
+                sampling_rate=voice_sampling_rate
+            )
         self.logger.info("SpeechExtractorWorker is initialized.")
 
     @classmethod
-    def setup_model(cls):
+    def setup_model(
+        cls,
+        max_pending: int = 32,
+        vad_batch_size: int = 16,
+        vad_tick_ms: int = 0,
+    ):
         base_options = python.BaseOptions(
             model_asset_path="assets/3rd_party/yamnet.tflite",
         )
@@ -38,28 +68,53 @@ class SpeechExtractorWorker:
         SpeechExtractorWorker.classifier: AudioClassifier = (
             audio.AudioClassifier.create_from_options(options)
         )
+        # AudioClassifierはスレッドセーフではないため、1スレッドで順に実行する。
+        SpeechExtractorWorker.inference_executor = SpeechExtractorInferenceExecutor(
+            max_workers=1, max_pending=max_pending
+        )
+        SpeechExtractorWorker.vad_batcher = SpeechExtractorVADBatcher(
+            executor=SpeechExtractorWorker.inference_executor,
+            classify_batch=SpeechExtractorWorker.__check_speech_exists_batch,
+            max_batch_size=vad_batch_size,
+            tick_ms=vad_tick_ms,
+            max_pending=max_pending,
+        )
 
     # てきとうな長さで音声を得る。
     # 一度に得られるフレーム数はRTC側の実装依存のため、ここでバッファリングを行う。
     # 短すぎると音声検知や認識の負荷が高くなる上音声認識がエラーとなる場合もあるため、
     # ある程度(200ms、3200フレーム程度)は確保しておく。
+    # 返すndarrayはバッファのビューのため、次の音声を受け取るまでの間のみ有効。
     async def __get_audio_buffer(self, ws: WebSocket, min_buffer_length: int = 3200):
-        buffer: np.ndarray = np.zeros(0, dtype=self.voice_dtype)
+        buffer: AudioBuffer = AudioBuffer(
+            capacity=min_buffer_length * 2, dtype=self.voice_dtype
+        )
 
         while True:
-            np_frame: np.ndarray = np.frombuffer(
-                await ws.receive_bytes(),
-                dtype=self.voice_dtype,
-            )
-            buffer = np.append(buffer, np_frame)
+            np_frame: np.ndarray
+            if self.opus_decoder is None:
+                np_frame = np.frombuffer(
+                    await ws.receive_bytes(),
+                    dtype=self.voice_dtype,
+                )
+            else:
+                np_frame = self.opus_decoder.decode(await ws.receive_bytes())
+            buffer.append(np_frame)
             if buffer.size > min_buffer_length:
                 # buffer = nr.reduce_noise(y=buffer, sr=self.voice_sampling_rate)
-                yield buffer
-                buffer = np.zeros(0, dtype=self.voice_dtype)
+                yield buffer.view()
+                buffer.clear()
 
     # 得た音声から音声が入っていそうな部分を抽出し、WebSocket経由で送信する。
     # 音声データはある程度の長さに分割されて送信される。
     # (最大で500ms + get_audio_bufferのサイズ分)
+    @classmethod
+    def gate_statuses(cls) -> dict:
+        return {
+            "skipped_frames": cls.gate_skipped_frames,
+            "classified_frames": cls.gate_classified_frames,
+        }
+
     async def extract(
         self,
         ws: WebSocket,
@@ -75,11 +130,27 @@ class SpeechExtractorWorker:
             voice_sample_bytes=self.voice_sample_bytes,
             voice_channels=self.voice_channels,
             start_at=-1,
+            voice_offset=0,
         )
 
+        last_speech_detected: bool = False
         async for mic_voice in self.__get_audio_buffer(ws):
             is_speech = False
-            if self.__check_speech_exists(mic_voice):
+            speech_detected: bool | None
+            if self.energy_gate is not None and not self.energy_gate.check(mic_voice):
+                # 明らかな無音はclassifierにかけない
+                SpeechExtractorWorker.gate_skipped_frames += 1
+                speech_detected = False
+            else:
+                SpeechExtractorWorker.gate_classified_frames += 1
+                speech_detected = await SpeechExtractorWorker.vad_batcher.check(
+                    mic_voice, self.voice_sampling_rate
+                )
+            if speech_detected is None:
+                # 推論待ちが溢れている場合は、直前の判定結果を使う
+                speech_detected = last_speech_detected
+            last_speech_detected = speech_detected
+            if speech_detected:
                 result.start_at = time.time()
                 silence_ms = 0
                 in_speech = True
@@ -88,7 +159,8 @@ class SpeechExtractorWorker:
             if in_speech:
                 if is_speech:
                     result.sequence_id += 1
-                    await ws.send_bytes(result.to_msgpack())
+                    await self.__send_result(ws, result)
+                    result.voice_offset += result.voice.size
                     result.clear_voice()
                 elif not is_speech and len(result.voice) > 0:
                     silence_ms += int(
@@ -97,8 +169,9 @@ class SpeechExtractorWorker:
                     if silence_ms >= max_silence_ms:
                         result.sequence_id += 1
                         result.confirmed = True
-                        await ws.send_bytes(result.to_msgpack())
+                        await self.__send_result(ws, result)
                         result.clear_voice()
+                        result.voice_offset = 0
                         result.speech_id += 1
                         result.start_at = -1
                         result.confirmed = False
@@ -109,20 +182,35 @@ class SpeechExtractorWorker:
                 result.cut_voice(-int(self.voice_sampling_rate / 2))
         self.logger.info("End Extractor.extract.")
 
-    def __check_speech_exists(self, audio: np.ndarray) -> bool:
+    # 前回送信した以降の音声のみを、voice_offset(発話内の位置)付きで送信する。
+    async def __send_result(self, ws: WebSocket, result: SpeechExtractorResult):
+        if self.result_format == "packet":
+            await ws.send_bytes(result.to_packet())
+        else:
+            await ws.send_bytes(result.to_msgpack())
+
+    # 推論スレッド上で、複数セッションの音声を順に判定する。
+    # mediapipeのAudioClassifierは1回の呼び出しで1クリップしか扱えず、
+    # yamnet.tfliteも1クリップ分の波形を入力とするため、クリップごとにclassify()を呼ぶ。
+    @classmethod
+    def __check_speech_exists_batch(
+        cls, requests: list[tuple[np.ndarray, int]]
+    ) -> list[bool]:
+        return [
+            cls.__check_speech_exists(audio, sampling_rate)
+            for audio, sampling_rate in requests
+        ]
+
+    @classmethod
+    def __check_speech_exists(cls, audio: np.ndarray, sampling_rate: int) -> bool:
         audio_clip = containers.AudioData.create_from_array(
-            audio.astype(float) / np.iinfo(self.voice_dtype).max,
-            self.voice_sampling_rate,
+            audio.astype(np.float32) * cls.voice_scale,
+            sampling_rate,
+        )
+        classification_result_list = SpeechExtractorWorker.classifier.classify(
+            audio_clip,
         )
-        try:
-            classification_result_list = SpeechExtractorWorker.classifier.classify(
-                audio_clip,
-            )
-        except Exception as e:
-            self.logger.error(f"UnknownError: {repr(e)}")
-            raise e
         for category in classification_result_list[0].classifications[0].categories:
-            # self.logger.info(f"{self.session_id}: {category.category_name}({category.score})")
             if category.category_name == "Speech" and category.score > 0.6:
                 return True
         return False
@@ -1,3 +1,13 @@
+from .SpeechEnergyGate import SpeechEnergyGate
+from .SpeechExtractorInferenceExecutor import SpeechExtractorInferenceExecutor
+from .SpeechExtractorOpusDecoder import SpeechExtractorOpusDecoder
+from .SpeechExtractorVADBatcher import SpeechExtractorVADBatcher
 from .SpeechExtractorWorker import SpeechExtractorWorker
 
-__all__ = ["SpeechExtractorWorker"]
+__all__ = [
+    "SpeechEnergyGate",
+    "SpeechExtractorInferenceExecutor",
+    "SpeechExtractorOpusDecoder",
+    "SpeechExtractorVADBatcher",
+    "SpeechExtractorWorker",
+]
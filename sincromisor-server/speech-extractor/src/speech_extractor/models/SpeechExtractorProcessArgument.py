@@ -8,6 +8,10 @@ class SpeechExtractorProcessArgument(SincromisorArgumentParser):
     port: int
     public_bind_host: str
     public_bind_port: int
+    max_pending: int
+    vad_batch_size: int
+    vad_tick_ms: int
+    workers: int
 
     @classmethod
     def set_args(cls, parser: ArgumentParser) -> None:
@@ -47,4 +51,43 @@ class SpeechExtractorProcessArgument(SincromisorArgumentParser):
             help=f"Public bind port(default: {default_bind_port})",
         )
 
+        # 音声検知の推論待ちの上限
+        # 上限を超えた分は推論せず、直前の判定結果を使う。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--max-pending",
+            env_name="SINCRO_EXTRACTOR_MAX_PENDING",
+            default=32,
+            help="Max pending speech classifications(default: 32)",
+        )
+
+        # 1回の推論スレッド呼び出しでまとめて判定する音声検知の最大数
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--vad-batch-size",
+            env_name="SINCRO_EXTRACTOR_VAD_BATCH_SIZE",
+            default=16,
+            help="Max speech classifications per batch(default: 16)",
+        )
+
+        # 他のセッションの音声検知の要求を待つ最大の時間(ms)
+        # 0の場合は待たず、前回の推論中に届いた要求のみをまとめる。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--vad-tick-ms",
+            env_name="SINCRO_EXTRACTOR_VAD_TICK_MS",
+            default=0,
+            help="Max wait to collect speech classifications in ms(default: 0)",
+        )
+
+        # ワーカープロセス数
+        # 2以上の場合、各ワーカーがclassifierを持ち、SO_REUSEPORTで同じポートを共有する。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--workers",
+            env_name="SINCRO_EXTRACTOR_WORKERS",
+            default=1,
+            help="Number of worker processes(default: 1)",
+        )
+
         return
@@ -1,10 +1,10 @@
+import asyncio
 import logging
 import logging.config
 import traceback
 from logging import Logger
 from threading import Event
 
-import numpy as np
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
@@ -17,7 +17,12 @@ from sincro_config import (
 )
 from sincro_models import SpeechExtractorResult, SpeechRecognizerResult
 from speech_recognizer_nemo.models import SpeechRecognizerNemoProcessArgument
-from speech_recognizer_nemo.SpeechRecognizerNemo import SpeechRecognizerNemoWorker
+from speech_recognizer_nemo.SpeechRecognizerNemo import (
+    RecognizerOverloadError,
+    SpeechRecognizerBatchScheduler,
+    SpeechRecognizerNemoWorker,
+    SpeechRecognizerSession,
+)
 from speech_recognizer_nemo.SpeechRecognizerNemo.SpeechRecognizerMinioClient import (
     SpeechRecognizerMinioClient,
 )
@@ -37,6 +42,7 @@ class SpeechRecognizerNemoProcess:
         self.__logger.info("===== Starting SpeechRecognizerNemoProcess =====")
         self.__args: SpeechRecognizerNemoProcessArgument = args
         self.__sessions: int = 0
+        self.__skipped_partials: int = 0
 
     def start(self):
         if not self.__args.consul_agent_host or not self.__args.consul_agent_port:
@@ -49,7 +55,17 @@ class SpeechRecognizerNemoProcess:
             consul_agent_port=self.__args.consul_agent_port,
         )
         speech_recognizer = SpeechRecognizerNemoWorker(voice_log_dir=args.voice_log_dir)
-        app: FastAPI = FastAPI()
+        # 認識はモデルを共有するため、全セッションの要求をまとめて1スレッドで行い、
+        # イベントループは受信を続けられるようにする。
+        scheduler: SpeechRecognizerBatchScheduler = SpeechRecognizerBatchScheduler(
+            worker=speech_recognizer,
+            max_batch_size=self.__args.max_batch_size,
+            max_wait_ms=self.__args.max_batch_wait_ms,
+            max_pending=self.__args.max_pending,
+        )
+        app: FastAPI = FastAPI(
+            on_startup=[scheduler.start], on_shutdown=[scheduler.stop]
+        )
         event: Event = Event()
         self.sd_reporter: ServiceDiscoveryReporter = ServiceDiscoveryReporter(
             worker_type="SpeechRecognizer",
@@ -63,9 +79,37 @@ class SpeechRecognizerNemoProcess:
         @app.get("/api/v1/SpeechRecognizer/statuses")
         async def get_status() -> JSONResponse:
             return JSONResponse(
-                {"worker_type": "SpeechRecognizer", "sessions": self.__sessions}
+                {
+                    "worker_type": "SpeechRecognizer",
+                    "sessions": self.__sessions,
+                    "skipped_partials": self.__skipped_partials,
+                    "scheduler": scheduler.statuses(),
+                }
             )
 
+        # SpeechRecognizerSessionが選んだパケットを順に認識し、結果を返す。
+        async def recognize_loop(
+            ws: WebSocket,
+            session: SpeechRecognizerSession,
+            minio_client: SpeechRecognizerMinioClient | None,
+        ) -> None:
+            while True:
+                extractor_result: SpeechExtractorResult = await session.next()
+                try:
+                    result: SpeechRecognizerResult = await scheduler.recognize(
+                        spe_result=extractor_result, minio_client=minio_client
+                    )
+                except RecognizerOverloadError as e:
+                    # 途中結果は後続のパケットで認識し直されるため、捨ててよい
+                    self.__logger.warning(f"RecognizerOverloadError: {repr(e)}")
+                    continue
+                finally:
+                    session.done()
+                self.__logger.info(
+                    f"SpeechRecognizerResult: {repr(result)}",
+                )
+                await ws.send_bytes(result.to_msgpack())
+
         @app.websocket("/api/v1/SpeechRecognizer/recognize")
         async def websocket_chat_endpoint(ws: WebSocket) -> None:
             self.__logger.info("Connected Websocket.")
@@ -87,34 +131,23 @@ class SpeechRecognizerNemoProcess:
                         secret_key=self.__args.minio_secret_key,
                     )
                 await ws.accept()
-                current_speech_id = -1
-                current_speech_buffer = np.zeros(0, dtype=np.int16)
-                while pack := await ws.receive_bytes():
-                    extractor_result = SpeechExtractorResult.from_msgpack(pack)
-                    if current_speech_id != extractor_result.speech_id:
-                        current_speech_id = extractor_result.speech_id
-                        # voiceのndarrayのフラグwriteableをtrueにしないと、
-                        # torch.from_numpy()で下記の警告が出る。
-                        # 一旦copy()しないとwriteableにできない点にも注意。
-                        # (copy()すると自動的にwritableになる)
-                        # UserWarning: The given NumPy array is not writable,
-                        # and PyTorch does not support non-writable tensors.
-                        # ~~~
-                        # (Triggered internally at ../torch/csrc/utils/tensor_numpy.cpp:206.)
-                        current_speech_buffer = extractor_result.voice.copy()
-                    else:
-                        current_speech_buffer = np.append(
-                            current_speech_buffer,
-                            extractor_result.voice,
-                        )
-                        extractor_result.voice = current_speech_buffer
-                    result: SpeechRecognizerResult = speech_recognizer.recognize(
-                        spe_result=extractor_result, minio_client=minio_client
-                    )
-                    self.__logger.info(
-                        f"SpeechRecognizerResult: {repr(result)}",
-                    )
-                    await ws.send_bytes(result.to_msgpack())
+                session: SpeechRecognizerSession = SpeechRecognizerSession(
+                    partial_policy=self.__args.partial_policy,
+                    partial_interval_ms=self.__args.partial_interval_ms,
+                )
+                # 受信と認識を分け、認識中に届いたパケットはsessionに溜める。
+                recognize_t: asyncio.Task = asyncio.create_task(
+                    recognize_loop(ws, session, minio_client)
+                )
+                try:
+                    while pack := await ws.receive_bytes():
+                        if recognize_t.done():
+                            # 認識側で例外が発生していればここで送出される
+                            recognize_t.result()
+                        session.add(SpeechExtractorResult.from_bytes(pack))
+                finally:
+                    recognize_t.cancel()
+                    self.__skipped_partials += session.skipped
                 traceback.print_exc()
             except WebSocketDisconnect:
                 self.__logger.info("Disconnected WebSocket.")
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+
+from sincro_models import SpeechExtractorResult, SpeechRecognizerResult
+
+from .SpeechRecognizerMinioClient import SpeechRecognizerMinioClient
+from .SpeechRecognizerNemoWorker import SpeechRecognizerNemoWorker
+
+
+class RecognizerOverloadError(Exception):
+    pass
+
+
+# 全セッションからの認識要求を集め、まとめてモデルに渡す。
+# 最初の要求が届いてからmax_wait_msが経過するか、
+# max_batch_size件集まった時点でバッチを作り、認識用のスレッドで実行する。
+# 認識待ちがmax_pendingに達している場合、途中(confirmed=False)の要求は
+# RecognizerOverloadErrorで拒否し、confirmedな要求は空きが出るまで待たせる。
+class SpeechRecognizerBatchScheduler:
+    def __init__(
+        self,
+        worker: SpeechRecognizerNemoWorker,
+        max_batch_size: int = 8,
+        max_wait_ms: int = 10,
+        max_pending: int = 64,
+    ):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__worker: SpeechRecognizerNemoWorker = worker
+        self.__max_batch_size: int = max(1, max_batch_size)
+        self.__max_wait: float = max_wait_ms / 1000
+        self.__pending: deque[
+            tuple[
+                SpeechExtractorResult,
+                SpeechRecognizerMinioClient | None,
+                asyncio.Future,
+            ]
+        ] = deque()
+        self.__queued: asyncio.Event = asyncio.Event()
+        self.__max_pending: int = max(1, max_pending)
+        self.__dequeued: asyncio.Event = asyncio.Event()
+        self.__peak_pending: int = 0
+        self.__shed: int = 0
+        # モデルは1スレッドからのみ使う
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="recognizer"
+        )
+        self.__task: asyncio.Task | None = None
+        # バッチサイズごとの実行回数
+        self.__batch_sizes: dict[int, int] = {}
+
+    async def start(self) -> None:
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def statuses(self) -> dict:
+        return {
+            "max_batch_size": self.__max_batch_size,
+            "max_wait_ms": int(self.__max_wait * 1000),
+            "pending": len(self.__pending),
+            "peak_pending": self.__peak_pending,
+            "max_pending": self.__max_pending,
+            "shed": self.__shed,
+            "batch_sizes": dict(sorted(self.__batch_sizes.items())),
+        }
+
+    async def recognize(
+        self,
+        spe_result: SpeechExtractorResult,
+        minio_client: SpeechRecognizerMinioClient | None,
+    ) -> SpeechRecognizerResult:
+        while len(self.__pending) >= self.__max_pending:
+            if not spe_result.confirmed:
+                self.__shed += 1
+                raise RecognizerOverloadError(
+                    f"pending requests reached {self.__max_pending}."
+                )
+            self.__dequeued.clear()
+            await self.__dequeued.wait()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.__pending.append((spe_result, minio_client, future))
+        self.__peak_pending = max(self.__peak_pending, len(self.__pending))
+        self.__queued.set()
+        return await future
+
+    async def __collect(
+        self,
+    ) -> list[
+        tuple[SpeechExtractorResult, SpeechRecognizerMinioClient | None, asyncio.Future]
+    ]:
+        loop = asyncio.get_running_loop()
+        while len(self.__pending) == 0:
+            self.__queued.clear()
+            await self.__queued.wait()
+        deadline: float = loop.time() + self.__max_wait
+        while len(self.__pending) < self.__max_batch_size:
+            remaining: float = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self.__queued.clear()
+            try:
+                await asyncio.wait_for(self.__queued.wait(), timeout=remaining)
+            except TimeoutError:
+                break
+        batch = []
+        while len(self.__pending) > 0 and len(batch) < self.__max_batch_size:
+            request = self.__pending.popleft()
+            # セッションが切断されて待つ者がいない要求は捨てる
+            if not request[2].cancelled():
+                batch.append(request)
+        self.__dequeued.set()
+        return batch
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.__collect()
+            if len(batch) == 0:
+                continue
+            self.__batch_sizes[len(batch)] = self.__batch_sizes.get(len(batch), 0) + 1
+            try:
+                results: list[SpeechRecognizerResult] = await loop.run_in_executor(
+                    self.__executor,
+                    self.__worker.recognize_batch,
+                    [
+                        (spe_result, minio_client)
+                        for spe_result, minio_client, _ in batch
+                    ],
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}"
+                )
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results, strict=True):
+                if not future.done():
+                    future.set_result(result)
@@ -28,27 +28,43 @@ class SpeechRecognizerNemo:
         Returns:
             TranscribeResult
         """
-        org_audio: AudioData = AudioData(audio, 16000)
-        padded_audio: AudioData = pad_audio(norm_audio(org_audio), self.PAD_SECONDS)
+        return self.transcribe_batch([audio])[0]
+
+    def transcribe_batch(self, audios: list[np.ndarray]) -> list[TranscribeResult]:
+        """Inference multiple audio data in one batch using NeMo model
+
+        Args:
+            audios (list[np.ndarray]): Audio data to transcribe
+
+        Returns:
+            list[TranscribeResult]: Results in the same order as audios
+        """
+        waveforms: list[np.ndarray] = []
+        for audio in audios:
+            org_audio: AudioData = AudioData(audio, 16000)
+            padded_audio: AudioData = pad_audio(norm_audio(org_audio), self.PAD_SECONDS)
+            waveforms.append(padded_audio.waveform)
 
         # partial_hypothesis は未実装となっているため、Noneを指定する。
         # NotImplementedError("`partial_hypotheses` support is not supported")
         # https://github.com/NVIDIA/NeMo/blob/45a3b5cad3434692b1fb805934913d95be8668ea/nemo/collections/asr/parts/submodules/rnnt_beam_decoding.py#L871
 
-        hyp, _ = self.model.transcribe(
-            padded_audio.waveform,
-            batch_size=1,
+        # 長さの異なる音声のパディングはNeMo側で行われる。
+        hyps, _ = self.model.transcribe(
+            waveforms,
+            batch_size=len(waveforms),
             return_hypotheses=True,
             partial_hypothesis=None,
             verbose=self.transcribe_config.verbose,
         )
-        hyp = hyp[0]
-        ts_result: TranscribeResult = decode_hypothesis(self.model, hyp)
-
-        if self.transcribe_config.raw_hypothesis:
-            ts_result.hypothesis = hyp
+        ts_results: list[TranscribeResult] = []
+        for hyp in hyps:
+            ts_result: TranscribeResult = decode_hypothesis(self.model, hyp)
+            if self.transcribe_config.raw_hypothesis:
+                ts_result.hypothesis = hyp
+            ts_results.append(ts_result)
 
-        return ts_result
+        return ts_results
 
     # 音声認識結果を、次の形式で返す。
     # [('認識したテキスト1', 0.0～1.0のスコア), ('認識したテキスト2', 0.0～1.0のスコア)]
@@ -58,3 +74,12 @@ class SpeechRecognizerNemo:
     ) -> list[tuple[str, float]]:
         ts_result: TranscribeResult = self.transcribe(audio)
         return [(ts_result.text, ts_result.hypothesis.score)]
+
+    def transcribe_with_score_batch(
+        self,
+        audios: list[np.ndarray],
+    ) -> list[list[tuple[str, float]]]:
+        return [
+            [(ts_result.text, ts_result.hypothesis.score)]
+            for ts_result in self.transcribe_batch(audios)
+        ]
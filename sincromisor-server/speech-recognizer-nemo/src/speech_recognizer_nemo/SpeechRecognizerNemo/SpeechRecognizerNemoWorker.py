@@ -24,33 +24,52 @@ class SpeechRecognizerNemoWorker:
         spe_result: SpeechExtractorResult,
         minio_client: SpeechRecognizerMinioClient | None,
     ) -> SpeechRecognizerResult:
+        return self.recognize_batch([(spe_result, minio_client)])[0]
+
+    # 複数セッションの音声をまとめて認識する。
+    # 結果はrequestsと同じ順番で返す。
+    def recognize_batch(
+        self,
+        requests: list[
+            tuple[SpeechExtractorResult, SpeechRecognizerMinioClient | None]
+        ],
+    ) -> list[SpeechRecognizerResult]:
         start_t = perf_counter()
-        result = self.__transcribe_with_score(spe_result.voice)
-        sr_result = SpeechRecognizerResult(
-            session_id=spe_result.session_id,
-            speech_id=spe_result.speech_id,
-            sequence_id=spe_result.sequence_id,
-            start_at=spe_result.start_at,
-            confirmed=spe_result.confirmed,
-            result=result,
-        )
-        self.logger.info(
-            {
-                "query_time": perf_counter() - start_t,
-                "voice_size": spe_result.voice.size,
-                "result": sr_result,
-            }
+        results = self.__transcribe_with_score_batch(
+            [spe_result.voice for spe_result, _ in requests]
         )
-        if spe_result.confirmed and self.voice_log_dir:
-            self.__export_result(sr_result)
-            self.__export_voice(spe_result)
-        if spe_result.confirmed and minio_client is not None:
-            minio_client.export_result_to_minio(sr_result)
-            minio_client.export_voice_to_minio(spe_result)
-        return sr_result
+        query_time: float = perf_counter() - start_t
+        sr_results: list[SpeechRecognizerResult] = []
+        for (spe_result, minio_client), result in zip(requests, results, strict=True):
+            sr_result = SpeechRecognizerResult(
+                session_id=spe_result.session_id,
+                speech_id=spe_result.speech_id,
+                sequence_id=spe_result.sequence_id,
+                start_at=spe_result.start_at,
+                confirmed=spe_result.confirmed,
+                result=result,
+            )
+            self.logger.info(
+                {
+                    "query_time": query_time,
+                    "batch_size": len(requests),
+                    "voice_size": spe_result.voice.size,
+                    "result": sr_result,
+                }
+            )
+            if spe_result.confirmed and self.voice_log_dir:
+                self.__export_result(sr_result)
+                self.__export_voice(spe_result)
+            if spe_result.confirmed and minio_client is not None:
+                minio_client.export_result_to_minio(sr_result)
+                minio_client.export_voice_to_minio(spe_result)
+            sr_results.append(sr_result)
+        return sr_results
 
-    def __transcribe_with_score(self, voice: np.ndarray) -> list[tuple[str, float]]:
-        return self.s2t.transcribe_with_score(voice)
+    def __transcribe_with_score_batch(
+        self, voices: list[np.ndarray]
+    ) -> list[list[tuple[str, float]]]:
+        return self.s2t.transcribe_with_score_batch(voices)
 
     def __export_result(self, result: SpeechRecognizerResult) -> Path | None:
         if self.voice_log_dir is None:
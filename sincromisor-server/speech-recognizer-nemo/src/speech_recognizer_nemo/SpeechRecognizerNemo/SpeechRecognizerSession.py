@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+from sincro_models import AudioBuffer, SpeechExtractorResult
+
+
+# WebSocket接続ごとに、受信したSpeechExtractorResultを発話単位で蓄積し、
+# 音声認識にかけるパケットを選ぶ。
+# partial_policy: 途中(confirmed=False)のパケットの扱い
+#   all: すべてのパケットを認識する(従来の動作)
+#   coalesce: 同じ発話の未処理の途中パケットは、新しいパケットにまとめる
+#             (新しいパケットの音声は古いパケットの音声を含むため)
+#   skip: 認識中に届いた同じ発話の途中パケットは認識しない
+# partial_interval_ms: 同じ発話の途中パケットを認識する最小間隔
+# confirmedなパケットは、いずれのポリシーでも必ず認識する。
+class SpeechRecognizerSession:
+    def __init__(self, partial_policy: str = "coalesce", partial_interval_ms: int = 0):
+        self.__partial_policy: str = partial_policy
+        self.__partial_interval: float = partial_interval_ms / 1000
+        self.__queue: deque[SpeechExtractorResult] = deque()
+        self.__queued: asyncio.Event = asyncio.Event()
+        self.__speech_id: int = -1
+        self.__speech_buffer: AudioBuffer = AudioBuffer(dtype=np.int16)
+        self.__recognizing_speech_id: int | None = None
+        self.__last_partial_at: float = 0
+        self.skipped: int = 0
+
+    # 受信したパケットの音声を発話のバッファに書き込み、認識待ちのキューに入れる。
+    # voice_offsetが指定されている場合はその位置に書き込み、
+    # 欠落した区間は無音で埋め、受信済みの区間は読み飛ばす。
+    # パケットのvoiceは発話の先頭からの音声(バッファのビュー)に置き換えられる。
+    def add(self, extractor_result: SpeechExtractorResult) -> None:
+        if self.__speech_id != extractor_result.speech_id:
+            self.__speech_id = extractor_result.speech_id
+            # 認識中のビューを壊さないよう、発話ごとに新しいバッファを使う。
+            self.__speech_buffer = AudioBuffer(
+                capacity=extractor_result.voice_sampling_rate * 10, dtype=np.int16
+            )
+            self.__last_partial_at = 0
+        voice: np.ndarray = extractor_result.voice
+        offset: int = extractor_result.voice_offset
+        if offset > self.__speech_buffer.size:
+            self.__speech_buffer.append(
+                np.zeros(offset - self.__speech_buffer.size, dtype=np.int16)
+            )
+        elif 0 <= offset < self.__speech_buffer.size:
+            voice = voice[self.__speech_buffer.size - offset :]
+        self.__speech_buffer.append(voice)
+        # バッファのビューはwriteableのため、torch.from_numpy()の警告は出ない。
+        extractor_result.voice = self.__speech_buffer.view()
+
+        if not extractor_result.confirmed:
+            match self.__partial_policy:
+                case "skip":
+                    if self.__recognizing_speech_id == extractor_result.speech_id:
+                        self.skipped += 1
+                        return
+                case "coalesce":
+                    self.__drop_queued_partials(speech_id=extractor_result.speech_id)
+        else:
+            if self.__partial_policy != "all":
+                self.__drop_queued_partials(speech_id=extractor_result.speech_id)
+        self.__queue.append(extractor_result)
+        self.__queued.set()
+
+    def __drop_queued_partials(self, speech_id: int) -> None:
+        while (
+            len(self.__queue) > 0
+            and self.__queue[-1].speech_id == speech_id
+            and not self.__queue[-1].confirmed
+        ):
+            self.__queue.pop()
+            self.skipped += 1
+
+    # 次に認識するパケットを返す。
+    # 認識が終わったらdone()を呼ぶこと。
+    async def next(self) -> SpeechExtractorResult:
+        while True:
+            while len(self.__queue) == 0:
+                self.__queued.clear()
+                await self.__queued.wait()
+            extractor_result: SpeechExtractorResult = self.__queue.popleft()
+            if not extractor_result.confirmed and self.__partial_interval > 0:
+                now: float = time.monotonic()
+                if now - self.__last_partial_at < self.__partial_interval:
+                    self.skipped += 1
+                    continue
+                self.__last_partial_at = now
+            self.__recognizing_speech_id = extractor_result.speech_id
+            return extractor_result
+
+    def done(self) -> None:
+        self.__recognizing_speech_id = None
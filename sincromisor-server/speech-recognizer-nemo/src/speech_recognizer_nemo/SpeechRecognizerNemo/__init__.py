@@ -1,9 +1,17 @@
+from .SpeechRecognizerBatchScheduler import (
+    RecognizerOverloadError,
+    SpeechRecognizerBatchScheduler,
+)
 from .SpeechRecognizerMinioClient import SpeechRecognizerMinioClient
 from .SpeechRecognizerNemo import SpeechRecognizerNemo
 from .SpeechRecognizerNemoWorker import SpeechRecognizerNemoWorker
+from .SpeechRecognizerSession import SpeechRecognizerSession
 
 __all__ = [
+    "RecognizerOverloadError",
+    "SpeechRecognizerBatchScheduler",
     "SpeechRecognizerMinioClient",
     "SpeechRecognizerNemo",
     "SpeechRecognizerNemoWorker",
+    "SpeechRecognizerSession",
 ]
@@ -11,6 +11,11 @@ class SpeechRecognizerNemoProcessArgument(SincromisorArgumentParser):
     minio_access_key: str | None
     minio_secret_key: str | None
     voice_log_dir: str | None
+    partial_policy: str
+    partial_interval_ms: int
+    max_batch_size: int
+    max_batch_wait_ms: int
+    max_pending: int
 
     @classmethod
     def set_args(cls, parser: ArgumentParser) -> None:
@@ -73,4 +78,53 @@ class SpeechRecognizerNemoProcessArgument(SincromisorArgumentParser):
             default=None,
             help="voice log directory path",
         )
+
+        # 途中(confirmed=False)の音声パケットの認識方法
+        # all: すべて認識する
+        # coalesce: 未処理の途中パケットは同じ発話の新しいパケットにまとめる
+        # skip: 認識中に届いた同じ発話の途中パケットは認識しない
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--partial-policy",
+            env_name="SINCRO_RECOGNIZER_PARTIAL_POLICY",
+            default="coalesce",
+            help="Partial recognition policy, all, coalesce or skip(default: coalesce)",
+        )
+
+        # 同じ発話の途中パケットを認識する最小間隔(ミリ秒)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--partial-interval-ms",
+            env_name="SINCRO_RECOGNIZER_PARTIAL_INTERVAL_MS",
+            default=0,
+            help="Minimum interval of partial recognition in ms(default: 0)",
+        )
+
+        # 全セッションの認識要求をまとめて認識する際の最大件数
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--max-batch-size",
+            env_name="SINCRO_RECOGNIZER_MAX_BATCH_SIZE",
+            default=8,
+            help="Max batch size of recognition(default: 8)",
+        )
+
+        # バッチを作るために認識要求を待つ最大時間(ミリ秒)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--max-batch-wait-ms",
+            env_name="SINCRO_RECOGNIZER_MAX_BATCH_WAIT_MS",
+            default=10,
+            help="Max wait time for building a batch in ms(default: 10)",
+        )
+
+        # 認識待ちの上限
+        # 上限を超えた途中結果の認識要求は捨て、確定した要求は空きが出るまで待たせる。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--max-pending",
+            env_name="SINCRO_RECOGNIZER_MAX_PENDING",
+            default=64,
+            help="Max pending recognition requests(default: 64)",
+        )
         return
@@ -43,9 +43,9 @@ class SpeechRecognizer:
         decode_options |= self.decode_options
         audio_tensor: Tensor = torch.from_numpy(audio)
 
-        assert (
-            audio_tensor.dim() == 1
-        ), f"Only mono audio is supported - {audio_tensor.dim()}"
+        assert audio_tensor.dim() == 1, (
+            f"Only mono audio is supported - {audio_tensor.dim()}"
+        )
         # assert audio_tensor.shape[0] == 115200, f"Only mono audio is supported - {audio_tensor.shape[0]}"
 
         audio_tensor: Tensor = audio_tensor.to(self.model.dtype).reshape(1, -1)
@@ -68,6 +68,18 @@ class SpeechRecognizer:
         except RuntimeError as e:
             raise RecognizerError(e)
 
+    # 複数の音声を順に認識し、音声ごとの[inputs, outputs]を返す。
+    # NueASRModelは音声のマスクを受け取れないため、長さを揃えて1回で生成すると
+    # 短い音声の末尾の無音まで認識してしまう。
+    # まとめるのはキューからの取り出しまでとし、生成は1件ずつ行う。
+    def transcribe_batch(
+        self, audios: list[np.ndarray], decode_options: dict
+    ) -> list[list]:
+        return [
+            self.transcribe(audio, decode_options=dict(decode_options))
+            for audio in audios
+        ]
+
     def decode(self, outputs) -> str:
         return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
 
@@ -91,3 +103,12 @@ class SpeechRecognizer:
             token_and_prob.append((token_string, float(probability)))
 
         return token_and_prob
+
+    # transcribe_batch()の結果について、音声ごとにトークンとその確率の組を返す。
+    def transcribe_with_score_batch(
+        self, results: list[list], threshold=0.5
+    ) -> list[list[tuple[str, float]]]:
+        return [
+            self.transcribe_with_score(inputs, outputs, threshold)
+            for inputs, outputs in results
+        ]
@@ -1,10 +1,18 @@
 from .SpeechRecognizer import RecognizerError, SpeechRecognizer
+from .SpeechRecognizerBatchScheduler import (
+    RecognizerOverloadError,
+    SpeechRecognizerBatchScheduler,
+)
 from .SpeechRecognizerMinioClient import SpeechRecognizerMinioClient
+from .SpeechRecognizerSession import SpeechRecognizerSession
 from .SpeechRecognizerWorker import SpeechRecognizerWorker
 
 __all__ = [
     "SpeechRecognizer",
     "RecognizerError",
+    "RecognizerOverloadError",
+    "SpeechRecognizerBatchScheduler",
     "SpeechRecognizerMinioClient",
+    "SpeechRecognizerSession",
     "SpeechRecognizerWorker",
 ]
@@ -0,0 +1,112 @@
+# PyAV(プロセス内)とサブプロセス(opusenc, fdkaac)のエンコード速度を比較する。
+#
+# VOICEVOXで合成したwavを置いたディレクトリを指定して実行する。
+#   python AudioEncoderBenchmark.py --wav-dir ./wavs
+# --textsを指定すると、テキストファイルの各行をVOICEVOXで合成してwav-dirに保存してから計測する。
+#   python AudioEncoderBenchmark.py --wav-dir ./wavs --texts sentences.txt
+import resource
+import statistics
+import wave
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+
+from sincro_models import AudioEncoder, PyAVAudioEncoder, SubprocessAudioEncoder
+from voice_synthesizer.VoiceSynthesizer import VoiceVox
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description="Benchmark audio encoders.")
+    parser.add_argument("--wav-dir", type=Path, required=True)
+    parser.add_argument("--texts", type=Path, default=None)
+    parser.add_argument("--voicevox-host", default="127.0.0.1")
+    parser.add_argument("--voicevox-port", type=int, default=50021)
+    parser.add_argument("--style-id", type=int, default=0)
+    parser.add_argument(
+        "--audio-format",
+        default="audio/ogg;codecs=opus",
+        choices=["audio/ogg;codecs=opus", "audio/aac"],
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    return parser.parse_args()
+
+
+def synthesize_corpus(args: Namespace) -> None:
+    vvox = VoiceVox(host=args.voicevox_host, port=args.voicevox_port)
+    args.wav_dir.mkdir(parents=True, exist_ok=True)
+    lines: list[str] = [
+        line
+        for line in args.texts.read_text(encoding="UTF-8").splitlines()
+        if line.strip()
+    ]
+    for index, text in enumerate(lines):
+        wav: bytes = vvox.synthesis(text, style_id=args.style_id)
+        (args.wav_dir / f"{index:04d}.wav").write_bytes(wav)
+    print(f"synthesized {len(lines)} sentences into {args.wav_dir}")
+
+
+def load_corpus(wav_dir: Path) -> list[tuple[bytes, int, int]]:
+    corpus: list[tuple[bytes, int, int]] = []
+    for path in sorted(wav_dir.glob("*.wav")):
+        with wave.open(BytesIO(path.read_bytes()), "rb") as w:
+            corpus.append(
+                (w.readframes(w.getnframes()), w.getframerate(), w.getnchannels())
+            )
+    return corpus
+
+
+def run(
+    encoder: AudioEncoder, corpus: list[tuple[bytes, int, int]], args: Namespace
+) -> None:
+    def encode(voice: tuple[bytes, int, int]) -> tuple[float, int]:
+        start_t: float = perf_counter()
+        encoded: bytes = encoder.encode(*voice)
+        return perf_counter() - start_t, len(encoded)
+
+    # 初回のみ発生するコストを除外する
+    encode(corpus[0])
+
+    jobs: list[tuple[bytes, int, int]] = corpus * args.repeat
+    start_t: float = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results: list[tuple[float, int]] = list(executor.map(encode, jobs))
+    wall_time: float = perf_counter() - start_t
+
+    latencies: list[float] = sorted(result[0] * 1000 for result in results)
+    audio_sec: float = sum(len(pcm) / 2 / rate / ch for pcm, rate, ch in jobs)
+    print(
+        f"{encoder.__class__.__name__:24s}"
+        f" mean={statistics.mean(latencies):7.2f}ms"
+        f" p50={latencies[len(latencies) // 2]:7.2f}ms"
+        f" p95={latencies[int(len(latencies) * 0.95)]:7.2f}ms"
+        f" realtime={audio_sec / wall_time:7.1f}x"
+        f" bytes={sum(result[1] for result in results) // len(results)}"
+    )
+
+
+def print_rss() -> None:
+    # ru_maxrssはLinuxではKiB単位
+    self_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss: int = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(f"peak RSS: self={self_rss // 1024}MiB children={children_rss // 1024}MiB")
+
+
+if __name__ == "__main__":
+    args: Namespace = parse_args()
+    if args.texts is not None:
+        synthesize_corpus(args)
+    corpus: list[tuple[bytes, int, int]] = load_corpus(args.wav_dir)
+    if not corpus:
+        raise SystemExit(f"No wav files found in {args.wav_dir}")
+    print(
+        f"{len(corpus)} wavs, format={args.audio_format},"
+        f" repeat={args.repeat}, concurrency={args.concurrency}"
+    )
+    # サブプロセスのRSSはRUSAGE_CHILDRENに現れるため、先にPyAVを計測する
+    run(PyAVAudioEncoder(args.audio_format), corpus, args)
+    print_rss()
+    run(SubprocessAudioEncoder(args.audio_format), corpus, args)
+    print_rss()
@@ -2,7 +2,8 @@ import logging
 import logging.config
 import traceback
 from logging import Logger
-from threading import Event
+from pathlib import Path
+from threading import Event, Thread
 
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
@@ -15,7 +16,13 @@ from sincro_config import (
     SincromisorLoggerConfig,
 )
 from voice_synthesizer.models import VoiceSynthesizerProcessArgument
-from voice_synthesizer.VoiceSynthesizer import VoiceSynthesizerWorker
+from voice_synthesizer.VoiceSynthesizer import (
+    AsyncVoiceVox,
+    VoiceCacheManager,
+    VoiceMemoryCache,
+    VoiceSynthesizerWorker,
+    VoiceVoxDispatcher,
+)
 
 setproctitle("VSynthesizer")
 
@@ -31,6 +38,12 @@ class VoiceSynthesizerProcess:
         self.__logger.info("===== Starting VoiceSynthesizerProcess =====")
         self.__args: VoiceSynthesizerProcessArgument = args
         self.__sessions: int = 0
+        # 全セッションで共有するプロセス内の音声キャッシュ
+        self.__memory_cache: VoiceMemoryCache | None = None
+        if self.__args.voice_cache_memory_mb > 0:
+            self.__memory_cache = VoiceMemoryCache(
+                max_bytes=self.__args.voice_cache_memory_mb * 1024 * 1024
+            )
 
     def start(self):
         if not self.__args.consul_agent_host or not self.__args.consul_agent_port:
@@ -42,7 +55,17 @@ class VoiceSynthesizerProcess:
             consul_agent_host=self.__args.consul_agent_host,
             consul_agent_port=self.__args.consul_agent_port,
         )
-        app: FastAPI = FastAPI()
+        # 合成ごとに、最も空いているVOICEVOXエンジンを選ぶ
+        self.voicevox_dispatcher: VoiceVoxDispatcher = VoiceVoxDispatcher(
+            sd_referrer=self.sd_referrer,
+            max_connections=self.__args.voicevox_max_connections,
+        )
+        self.voicevox_dispatcher.start()
+        app: FastAPI = FastAPI(
+            on_startup=[self.__start_warmup],
+            # VOICEVOXとの接続は、イベントループを終える前に閉じる
+            on_shutdown=[AsyncVoiceVox.aclose_all],
+        )
         event: Event = Event()
         self.sd_reporter: ServiceDiscoveryReporter = ServiceDiscoveryReporter(
             worker_type="VoiceSynthesizer",
@@ -55,8 +78,16 @@ class VoiceSynthesizerProcess:
 
         @app.get("/api/v1/VoiceSynthesizer/statuses")
         async def get_status() -> JSONResponse:
+            voice_cache: dict = VoiceCacheManager.tier_statuses()
+            if self.__memory_cache is not None:
+                voice_cache["memory"] = self.__memory_cache.statuses()
             return JSONResponse(
-                {"worker_type": "VoiceSynthesizer", "sessions": self.__sessions}
+                {
+                    "worker_type": "VoiceSynthesizer",
+                    "sessions": self.__sessions,
+                    "voice_cache": voice_cache,
+                    "voicevox": self.voicevox_dispatcher.statuses(),
+                }
             )
 
         @app.websocket("/api/v1/VoiceSynthesizer/synthesize")
@@ -64,33 +95,17 @@ class VoiceSynthesizerProcess:
             self.__logger.info("Connected Websocket.")
             self.__sessions += 1
             try:
-                redis_description: ServiceDescription | None = (
-                    self.sd_referrer.get_random_worker(worker_type="SincroRedis")
+                voice_synthesizer: VoiceSynthesizerWorker = self.__create_worker(
+                    # ?stream=1で接続したクライアントにはストリーミングで送る。
+                    # 指定が無ければ従来通りVoiceSynthesizerResultを1つずつ送る。
+                    stream=ws.query_params.get("stream", "0") in ("1", "true"),
+                    # audio/pcm;rate=48000などを指定すると、その形式で送る。
+                    # キャッシュも形式ごとに別となる。
+                    audio_format=ws.query_params.get(
+                        "audio_format", "audio/ogg;codecs=opus"
+                    ),
                 )
-                if redis_description is None:
-                    raise RuntimeError("No SincroRedis worker found.")
-                minio_description: ServiceDescription | None = (
-                    self.sd_referrer.get_random_worker(worker_type="SincroMinio")
-                )
-                if minio_description is None:
-                    raise RuntimeError("No SincroMinio worker found.")
-                voicevox_description: ServiceDescription | None = (
-                    self.sd_referrer.get_random_worker(worker_type="SincroVoiceVox")
-                )
-                if voicevox_description is None:
-                    raise RuntimeError("No SincroVoiceVox worker found.")
                 await ws.accept()
-                voice_synthesizer = VoiceSynthesizerWorker(
-                    voicevox_host=voicevox_description.service_address,
-                    voicevox_port=voicevox_description.service_port,
-                    voicevox_style_id=self.__args.voicevox_default_style_id,
-                    redis_host=redis_description.service_address,
-                    redis_port=redis_description.service_port,
-                    minio_host=minio_description.service_address,
-                    minio_port=minio_description.service_port,
-                    minio_access_key=self.__args.minio_access_key,
-                    minio_secret_key=self.__args.minio_secret_key,
-                )
                 await voice_synthesizer.communicate(ws=ws)
             except WebSocketDisconnect:
                 self.__logger.info("Disconnected WebSocket.")
@@ -113,6 +128,59 @@ class VoiceSynthesizerProcess:
             pass
         finally:
             event.set()
+            self.voicevox_dispatcher.close()
+
+    def __create_worker(
+        self, stream: bool = False, audio_format: str = "audio/ogg;codecs=opus"
+    ) -> VoiceSynthesizerWorker:
+        redis_description: ServiceDescription | None = (
+            self.sd_referrer.get_random_worker(worker_type="SincroRedis")
+        )
+        if redis_description is None:
+            raise RuntimeError("No SincroRedis worker found.")
+        minio_description: ServiceDescription | None = (
+            self.sd_referrer.get_random_worker(worker_type="SincroMinio")
+        )
+        if minio_description is None:
+            raise RuntimeError("No SincroMinio worker found.")
+        if not self.voicevox_dispatcher.has_engines():
+            raise RuntimeError("No SincroVoiceVox worker found.")
+        return VoiceSynthesizerWorker(
+            voicevox_style_id=self.__args.voicevox_default_style_id,
+            redis_host=redis_description.service_address,
+            redis_port=redis_description.service_port,
+            minio_host=minio_description.service_address,
+            minio_port=minio_description.service_port,
+            minio_access_key=self.__args.minio_access_key,
+            minio_secret_key=self.__args.minio_secret_key,
+            stream=stream,
+            audio_encoder=self.__args.audio_encoder,
+            audio_format=audio_format,
+            memory_cache=self.__memory_cache,
+            voicevox_max_connections=self.__args.voicevox_max_connections,
+            voicevox_dispatcher=self.voicevox_dispatcher,
+        )
+
+    # フレーズのリスト(1行1フレーズ)から、プロセス内のキャッシュを温めておく。
+    # 起動を遅らせないよう、別スレッドで行う。
+    def __start_warmup(self) -> None:
+        if self.__memory_cache is None or not self.__args.voice_cache_warmup_file:
+            return
+        phrases: list[str] = [
+            line.strip()
+            for line in Path(self.__args.voice_cache_warmup_file)
+            .read_text(encoding="UTF-8")
+            .splitlines()
+            if line.strip()
+        ]
+        Thread(target=self.__warmup, args=(phrases,), daemon=True).start()
+
+    def __warmup(self, phrases: list[str]) -> None:
+        try:
+            for audio_format in self.__args.voice_cache_warmup_formats.split(","):
+                self.__create_worker(audio_format=audio_format.strip()).warmup(phrases)
+        except Exception as e:
+            self.__logger.error(f"UnknownError: {repr(e)}\n{traceback.format_exc()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+import asyncio
+from typing import ClassVar
+from weakref import WeakKeyDictionary
+
+import httpx
+from sincro_models.VoiceVoxQuery import VoiceVoxQuery
+
+# API reference
+# https://voicevox.github.io/voicevox_engine/api/
+
+
+# VoiceVoxのうち、音声合成に使うAPIの非同期版。
+# 同じエンジン(host, port)へのhttpx.AsyncClientはプロセス内で共有され、
+# 接続を使い回す(HTTP keep-alive)。
+# - max_connections: エンジンごとの同時接続数の上限。超えた分は空くまで待つ。
+# AsyncClientはイベントループに紐付くため、uvicornのイベントループ上からのみ使うこと。
+# イベントループを終える前にaclose_all()で閉じる。
+class AsyncVoiceVox:
+    class ProtocolError(Exception):
+        pass
+
+    # 接続、書き込みのタイムアウト(s)
+    CONNECT_TIMEOUT_SEC: float = 3.0
+    # 長い文章の合成を待つためのタイムアウト(s)
+    READ_TIMEOUT_SEC: float = 30.0
+    # 使われていない接続を閉じるまでの時間(s)
+    KEEPALIVE_EXPIRY_SEC: float = 60.0
+
+    # イベントループごとに、key: (host, port)
+    __clients: ClassVar[
+        WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[tuple[str, int], httpx.AsyncClient]
+        ]
+    ] = WeakKeyDictionary()
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 50021, max_connections: int = 8
+    ):
+        self.host: str = host
+        self.port: int = port
+        self.base_url: str = f"http://{self.host}:{self.port}"
+        self.style_id_key: str = "speaker"  # speaker(deprecated)、style_id(新)。
+        self.__max_connections: int = max_connections
+
+    # エンジンごとに共有されるAsyncClientを返す。
+    # プールが空くまでの待ち時間には上限を設けない(pool=None)。
+    def client(self) -> httpx.AsyncClient:
+        clients: dict[tuple[str, int], httpx.AsyncClient] = (
+            AsyncVoiceVox.__clients.setdefault(asyncio.get_running_loop(), {})
+        )
+        key: tuple[str, int] = (self.host, self.port)
+        client: httpx.AsyncClient | None = clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.__max_connections,
+                    max_keepalive_connections=self.__max_connections,
+                    keepalive_expiry=self.KEEPALIVE_EXPIRY_SEC,
+                ),
+                timeout=httpx.Timeout(
+                    connect=self.CONNECT_TIMEOUT_SEC,
+                    read=self.READ_TIMEOUT_SEC,
+                    write=self.CONNECT_TIMEOUT_SEC,
+                    pool=None,
+                ),
+            )
+            clients[key] = client
+        return client
+
+    # 実行中のイベントループで作られたAsyncClientを全て閉じる。
+    @classmethod
+    async def aclose_all(cls) -> None:
+        clients: dict[tuple[str, int], httpx.AsyncClient] = cls.__clients.pop(
+            asyncio.get_running_loop(), {}
+        )
+        for client in clients.values():
+            await client.aclose()
+
+    # VoiceVox.audio_query()の非同期版。
+    async def audio_query(self, text: str, style_id: int = 1) -> VoiceVoxQuery:
+        params: dict[str, str | int] = {self.style_id_key: style_id, "text": text}
+        res: httpx.Response = await self.client().post("/audio_query", params=params)
+        self.response_validator(res)
+        return VoiceVoxQuery.model_validate(res.json())
+
+    # VoiceVox.query_synthesis()の非同期版。
+    async def query_synthesis(self, query: VoiceVoxQuery, style_id: int = 1) -> bytes:
+        res: httpx.Response = await self.client().post(
+            "/synthesis",
+            params={self.style_id_key: style_id},
+            headers={"Content-Type": "application/json"},
+            content=query.model_dump_json(),
+        )
+        self.response_validator(res)
+        return res.content
+
+    # VoiceVox.synthesis()の非同期版。
+    async def synthesis(self, text: str, style_id: int = 1) -> bytes:
+        query: VoiceVoxQuery = await self.audio_query(text, style_id)
+        return await self.query_synthesis(query, style_id)
+
+    def response_validator(self, res: httpx.Response) -> bool:
+        if res.status_code == 200:
+            return True
+        raise self.ProtocolError(
+            f"{res.status_code} {res.reason_phrase} - {res.request.url}",
+        )
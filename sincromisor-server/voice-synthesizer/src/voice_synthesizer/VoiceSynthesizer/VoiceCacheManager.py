@@ -1,30 +1,62 @@
-import io
+import asyncio
 import logging
+from collections.abc import Callable, Generator, Iterable
 from logging import Logger
+from threading import Lock
+from typing import ClassVar
 
 from minio import Minio
 from minio.error import S3Error
 from redis import Redis
-from sincro_models import VoiceSynthesizerRequest, VoiceSynthesizerResult
+from sincro_models import (
+    VoiceSynthesizerRequest,
+    VoiceSynthesizerResult,
+    VoiceSynthesizerStreamChunk,
+    VoiceSynthesizerStreamHeader,
+)
 from urllib3.response import BaseHTTPResponse
 
+from .VoiceCacheWriter import VoiceCacheWriteJob, VoiceCacheWriter
+from .VoiceMemoryCache import VoiceMemoryCache
+from .VoiceSingleFlight import VoiceSingleFlight
 from .VoiceSynthesizer import VoiceSynthesizer
+from .VoiceVoxDispatcher import VoiceVoxDispatcher
 
 
+# 音声をプロセス内(VoiceMemoryCache)、Redis、MinIOの順に探し、
+# どこにも無ければVOICEVOXで合成して各キャッシュに保存する。
+# RedisとMinIOへの保存はVoiceCacheWriterが後から行うため、合成結果はすぐに返せる。
+# 同じ音声の合成が同時に要求された場合は、VoiceSingleFlightで1回にまとめる。
 class VoiceCacheManager:
     class VoiceSynthesizerServerException(Exception):
         pass
 
+    # Redisとプロセス内キャッシュの保存期間(s)
+    CACHE_TTL_SEC: int = 60 * 60 * 24 * 7
+
+    # 各層のヒット数などの統計(プロセス内の全セッションの合計)
+    redis_hits: int = 0
+    redis_misses: int = 0
+    minio_hits: int = 0
+    minio_misses: int = 0
+    synthesized: int = 0
+    # to_thread()のスレッドからも数えるため、ロックを取ってから増やす
+    __stats_lock: ClassVar[Lock] = Lock()
+
     def __init__(
         self,
-        voicevox_host: str,
-        voicevox_port: int,
         redis_host: str,
         redis_port: int,
         minio_host: str,
         minio_port: int,
         minio_access_key: str,
         minio_secret_key: str,
+        audio_encoder: str = "pyav",
+        memory_cache: VoiceMemoryCache | None = None,
+        voicevox_max_connections: int = 8,
+        voicevox_host: str = "127.0.0.1",
+        voicevox_port: int = 50021,
+        voicevox_dispatcher: VoiceVoxDispatcher | None = None,
     ):
         self.logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
         self.redis: Redis = Redis(
@@ -40,11 +72,42 @@ class VoiceCacheManager:
         )
         self.bucket_name: str = "voice-synthesizer"
         self.__setup_minio_bucket()
+        self.__writer: VoiceCacheWriter = VoiceCacheWriter.get_writer(
+            redis_host=redis_host,
+            redis_port=redis_port,
+            minio_host=minio_host,
+            minio_port=minio_port,
+            minio_access_key=minio_access_key,
+            minio_secret_key=minio_secret_key,
+            bucket_name=self.bucket_name,
+            ttl_sec=self.CACHE_TTL_SEC,
+        )
 
         self.vsynth: VoiceSynthesizer = VoiceSynthesizer(
             host=voicevox_host,
             port=voicevox_port,
+            audio_encoder=audio_encoder,
+            max_connections=voicevox_max_connections,
+            dispatcher=voicevox_dispatcher,
         )
+        # プロセス内で共有される。Noneの場合はRedisから探す。
+        self.__memory_cache: VoiceMemoryCache | None = memory_cache
+        self.__single_flight: VoiceSingleFlight = VoiceSingleFlight(redis=self.redis)
+
+    @classmethod
+    def tier_statuses(cls) -> dict:
+        return {
+            "redis": {"hits": cls.redis_hits, "misses": cls.redis_misses},
+            "minio": {"hits": cls.minio_hits, "misses": cls.minio_misses},
+            "synthesized": cls.synthesized,
+            "single_flight": VoiceSingleFlight.statuses(),
+            "write_behind": VoiceCacheWriter.statuses(),
+        }
+
+    @classmethod
+    def __count(cls, name: str) -> None:
+        with cls.__stats_lock:
+            setattr(cls, name, getattr(cls, name) + 1)
 
     def __setup_minio_bucket(self) -> None:
         if not self.minio_client.bucket_exists(self.bucket_name):
@@ -53,39 +116,221 @@ class VoiceCacheManager:
 
     def get_voice(self, vs_request: VoiceSynthesizerRequest) -> VoiceSynthesizerResult:
         self.logger.info(f"SynthRequest: {vs_request.message}")
-        vs_result: VoiceSynthesizerResult | None
-        vs_result = self.__get_voice_redis(vs_request)
+        vs_result: VoiceSynthesizerResult | None = self.__get_voice_cache(vs_request)
         if vs_result:
-            self.logger.info(f"SynthRequest(Redis-HIT): {vs_request.message}")
             return vs_result
-        vs_result = self.__get_voice_minio(vs_request)
+        with self.__single_flight.claim(
+            vs_request.redis_key(), lambda: self.__get_voice_recent(vs_request)
+        ) as flight:
+            if flight.result:
+                self.logger.info(f"SynthRequest(Coalesced): {vs_request.message}")
+                return flight.result
+            try:
+                vs_result = self.vsynth.generate(
+                    vs_request=vs_request,
+                )
+                self.logger.info(f"SynthRequest(Cache-Miss): {vs_request.message}")
+            except Exception:
+                raise self.VoiceSynthesizerServerException
+            # Redisに保存されるまで、他のノードには合成中として待ってもらう
+            flight.keep_lock = True
+            self.__put_voice(vs_request, vs_result, on_redis_stored=flight.release_lock)
+            flight.result = vs_result
+        return vs_result
+
+    # get_voice()の非同期版。VOICEVOXとは共有の接続プールで非同期に通信し、
+    # キャッシュの読み込みやエンコードはスレッドで行う。
+    # イベントループを止めないため、1プロセスで多くのセッションを同時に扱える。
+    async def get_voice_async(
+        self, vs_request: VoiceSynthesizerRequest
+    ) -> VoiceSynthesizerResult:
+        self.logger.info(f"SynthRequest: {vs_request.message}")
+        vs_result: VoiceSynthesizerResult | None = await asyncio.to_thread(
+            self.__get_voice_cache, vs_request
+        )
         if vs_result:
-            self.logger.info(f"SynthRequest(MinIO-HIT): {vs_request.message}")
-            self.__put_voice_redis(vs_request, vs_result)
             return vs_result
-        try:
-            vs_result = self.vsynth.generate(
-                vs_request=vs_request,
-            )
-            self.logger.info(f"SynthRequest(Cache-Miss): {vs_request.message}")
-        except Exception:
-            raise self.VoiceSynthesizerServerException
-        self.__put_voice_redis(vs_request, vs_result)
-        self.__put_voice_minio(vs_request, vs_result)
+        async with self.__single_flight.claim_async(
+            vs_request.redis_key(), lambda: self.__get_voice_recent(vs_request)
+        ) as flight:
+            if flight.result:
+                self.logger.info(f"SynthRequest(Coalesced): {vs_request.message}")
+                return flight.result
+            try:
+                vs_result = await self.vsynth.generate_async(vs_request=vs_request)
+                self.logger.info(f"SynthRequest(Cache-Miss): {vs_request.message}")
+            except Exception:
+                raise self.VoiceSynthesizerServerException
+            flight.keep_lock = True
+            self.__put_voice(vs_request, vs_result, on_redis_stored=flight.release_lock)
+            flight.result = vs_result
         return vs_result
 
-    def __get_voice_redis(
+    # プロセス内、Redis、MinIOの順に探す。
+    # 下の層で見つかった場合は、上の層にも保存しておく。
+    def __get_voice_cache(
         self, vs_request: VoiceSynthesizerRequest
     ) -> VoiceSynthesizerResult | None:
         key: str = vs_request.redis_key()
-        if vs_pack := self.redis.get(key):
-            if isinstance(vs_pack, bytes):
-                return VoiceSynthesizerResult.from_msgpack(vs_pack)
+        vs_result: VoiceSynthesizerResult | None
+        if self.__memory_cache is not None and (
+            vs_result := self.__memory_cache.get(key)
+        ):
+            self.logger.info(f"SynthRequest(Memory-HIT): {vs_request.message}")
+            return vs_result
+        vs_result, ttl_sec = self.__get_voice_redis(vs_request)
+        if vs_result:
+            self.__count("redis_hits")
+            self.logger.info(f"SynthRequest(Redis-HIT): {vs_request.message}")
+            if self.__memory_cache is not None:
+                self.__memory_cache.put(key, vs_result, ttl_sec=ttl_sec)
+            return vs_result
+        self.__count("redis_misses")
+        if vs_pack := self.__get_voice_minio(vs_request):
+            self.__count("minio_hits")
+            self.logger.info(f"SynthRequest(MinIO-HIT): {vs_request.message}")
+            vs_result = VoiceSynthesizerResult.from_msgpack(vs_pack)
+            self.__writer.put(
+                VoiceCacheWriteJob(redis_key=key, minio_key=None, pack=vs_pack)
+            )
+            if self.__memory_cache is not None:
+                self.__memory_cache.put(key, vs_result, ttl_sec=self.CACHE_TTL_SEC)
+            return vs_result
+        self.__count("minio_misses")
         return None
 
-    def __get_voice_minio(
+    # 他の要求が合成を終えていないか、プロセス内とRedisのみを探す。
+    # 統計には数えない。
+    def __get_voice_recent(
         self, vs_request: VoiceSynthesizerRequest
     ) -> VoiceSynthesizerResult | None:
+        key: str = vs_request.redis_key()
+        vs_result: VoiceSynthesizerResult | None
+        if self.__memory_cache is not None and (
+            vs_result := self.__memory_cache.get(key, count=False)
+        ):
+            return vs_result
+        vs_result, ttl_sec = self.__get_voice_redis(vs_request)
+        if vs_result and self.__memory_cache is not None:
+            self.__memory_cache.put(key, vs_result, ttl_sec=ttl_sec)
+        return vs_result
+
+    # プロセス内のキャッシュにはすぐに、RedisとMinIOにはVoiceCacheWriterで保存する。
+    def __put_voice(
+        self,
+        vs_request: VoiceSynthesizerRequest,
+        vs_result: VoiceSynthesizerResult,
+        on_redis_stored: Callable[[], None] | None = None,
+    ) -> None:
+        self.__count("synthesized")
+        if self.__memory_cache is not None:
+            self.__memory_cache.put(
+                vs_request.redis_key(), vs_result, ttl_sec=self.CACHE_TTL_SEC
+            )
+        self.__writer.put(
+            VoiceCacheWriteJob(
+                redis_key=vs_request.redis_key(),
+                minio_key=vs_request.minio_key(),
+                pack=vs_result.to_msgpack(),
+                on_redis_stored=on_redis_stored,
+            )
+        )
+
+    # get_voice()のストリーミング版。
+    # VoiceSynthesizerStreamHeaderを返した後、エンコード済み音声を
+    # VoiceSynthesizerStreamChunkとして順に返す。最後のチャンクはlast=Trueとなる。
+    # キャッシュに無い場合はエンコードしながら返し、終わってからキャッシュに保存する。
+    # 同じ音声を合成中の要求があれば、その完了を待ってから返す。
+    def get_voice_stream(
+        self, vs_request: VoiceSynthesizerRequest, chunk_size: int = 4096
+    ) -> Generator[
+        VoiceSynthesizerStreamHeader | VoiceSynthesizerStreamChunk, None, None
+    ]:
+        self.logger.info(f"SynthStreamRequest: {vs_request.message}")
+        vs_result: VoiceSynthesizerResult | None = self.__get_voice_cache(vs_request)
+        if vs_result:
+            yield from self.__stream_result(vs_result, chunk_size)
+            return
+
+        with self.__single_flight.claim(
+            vs_request.redis_key(), lambda: self.__get_voice_recent(vs_request)
+        ) as flight:
+            if flight.result:
+                self.logger.info(f"SynthStreamRequest(Coalesced): {vs_request.message}")
+                yield from self.__stream_result(flight.result, chunk_size)
+                return
+            try:
+                wav_result: VoiceSynthesizerResult = self.vsynth.synthesize(
+                    vs_request=vs_request
+                )
+            except Exception:
+                raise self.VoiceSynthesizerServerException
+            self.logger.info(f"SynthStreamRequest(Cache-Miss): {vs_request.message}")
+            audio_format: str = self.vsynth.encoded_format(vs_request.audio_format)
+            yield VoiceSynthesizerStreamHeader.from_result(
+                wav_result.model_copy(update={"audio_format": audio_format})
+            )
+            encoded: list[bytes] = []
+            try:
+                for chunk in self.__stream_chunks(
+                    self.vsynth.encode_stream(
+                        wav_result.voice,
+                        vs_request.audio_format,
+                        chunk_size=chunk_size,
+                    )
+                ):
+                    encoded.append(chunk.voice)
+                    yield chunk
+            except Exception:
+                raise self.VoiceSynthesizerServerException
+            vs_result = wav_result.model_copy(
+                update={"voice": b"".join(encoded), "audio_format": audio_format}
+            )
+            flight.keep_lock = True
+            self.__put_voice(vs_request, vs_result, on_redis_stored=flight.release_lock)
+            flight.result = vs_result
+
+    # キャッシュ済み(合成済み)の音声を、ヘッダと断片に分けて返す。
+    def __stream_result(
+        self, vs_result: VoiceSynthesizerResult, chunk_size: int
+    ) -> Generator[
+        VoiceSynthesizerStreamHeader | VoiceSynthesizerStreamChunk, None, None
+    ]:
+        yield VoiceSynthesizerStreamHeader.from_result(vs_result)
+        voice: bytes = vs_result.voice
+        yield from self.__stream_chunks(
+            voice[position : position + chunk_size]
+            for position in range(0, len(voice), chunk_size)
+        )
+
+    # 断片を1つ遅らせて返し、最後の断片にlast=Trueを付ける。
+    def __stream_chunks(
+        self, chunks: Iterable[bytes]
+    ) -> Generator[VoiceSynthesizerStreamChunk, None, None]:
+        previous: bytes | None = None
+        for chunk in chunks:
+            if previous is not None:
+                yield VoiceSynthesizerStreamChunk(voice=previous)
+            previous = chunk
+        yield VoiceSynthesizerStreamChunk(voice=previous or b"", last=True)
+
+    # 見つかった音声と、Redisに残っている期限(s)を返す。
+    def __get_voice_redis(
+        self, vs_request: VoiceSynthesizerRequest
+    ) -> tuple[VoiceSynthesizerResult | None, int]:
+        key: str = vs_request.redis_key()
+        with self.redis.pipeline() as pipe:
+            pipe.get(key)
+            pipe.ttl(key)
+            vs_pack, ttl_sec = pipe.execute()
+        if vs_pack and isinstance(vs_pack, bytes):
+            # 期限が無い(-1)場合は保存期間と同じとみなす
+            if ttl_sec < 0:
+                ttl_sec = self.CACHE_TTL_SEC
+            return VoiceSynthesizerResult.from_msgpack(vs_pack), ttl_sec
+        return None, 0
+
+    def __get_voice_minio(self, vs_request: VoiceSynthesizerRequest) -> bytes | None:
         try:
             minio_res: BaseHTTPResponse = self.minio_client.get_object(
                 bucket_name=self.bucket_name, object_name=vs_request.minio_key()
@@ -93,30 +338,6 @@ class VoiceCacheManager:
             vpack: bytes = minio_res.read()
             minio_res.close()
             minio_res.release_conn()
-            return VoiceSynthesizerResult.from_msgpack(vpack)
+            return vpack
         except S3Error:
             return None
-
-    def __put_voice_redis(
-        self, vs_request: VoiceSynthesizerRequest, vs_result: VoiceSynthesizerResult
-    ) -> None:
-        try:
-            self.redis.set(
-                vs_request.redis_key(), vs_result.to_msgpack(), ex=60 * 60 * 24 * 7
-            )
-        except S3Error as e:
-            self.logger.error(f"Failed to upload voice to Redis: {e}")
-
-    def __put_voice_minio(
-        self, vs_request: VoiceSynthesizerRequest, vs_result: VoiceSynthesizerResult
-    ) -> None:
-        try:
-            self.minio_client.put_object(
-                bucket_name=self.bucket_name,
-                object_name=vs_request.minio_key(),
-                data=io.BytesIO(vs_result.to_msgpack()),
-                length=len(vs_result.to_msgpack()),
-                content_type="application/octet-stream",
-            )
-        except S3Error as e:
-            self.logger.error(f"Failed to upload voice to MinIO: {e}")
@@ -0,0 +1,221 @@
+import io
+import logging
+import traceback
+from collections.abc import Callable
+from logging import Logger
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import sleep
+from typing import ClassVar
+
+from minio import Minio
+from minio.error import S3Error
+from redis import Redis
+from redis.exceptions import RedisError
+
+
+# RedisとMinIOへ書き込む音声1件分。
+# packはto_msgpack()済みのものを両方で使う。
+class VoiceCacheWriteJob:
+    def __init__(
+        self,
+        redis_key: str | None,
+        minio_key: str | None,
+        pack: bytes,
+        on_redis_stored: Callable[[], None] | None = None,
+    ):
+        self.redis_key: str | None = redis_key
+        self.minio_key: str | None = minio_key
+        self.pack: bytes = pack
+        # Redisへの書き込みが終わった(もしくは諦めた)後に呼ばれる
+        self.on_redis_stored: Callable[[], None] | None = on_redis_stored
+
+
+# 合成した音声のRedisとMinIOへの保存を、バックグラウンドのスレッドで行う。
+# 合成結果はキューに積むだけですぐにWebSocketへ返せる。
+# - キューが一杯の場合は保存を諦めて捨てる(dropped)。次に要求された時に再び合成される。
+# - Redisへはパイプラインでまとめて書き込む。
+# - 失敗した場合は間隔を倍にしながらMAX_RETRIES回までやり直す。
+# Redis、MinIOの接続先ごとに1つ作り、プロセス内の全セッションで共有する。
+class VoiceCacheWriter:
+    QUEUE_SIZE: int = 256
+    # 1回のRedisのパイプラインで書き込む最大件数
+    BATCH_SIZE: int = 32
+    MAX_RETRIES: int = 3
+    RETRY_INTERVAL_SEC: float = 0.2
+
+    __writers: ClassVar[dict[tuple, "VoiceCacheWriter"]] = {}
+    __writers_lock: ClassVar[Lock] = Lock()
+
+    # 統計(プロセス内の全VoiceCacheWriterの合計)
+    enqueued: int = 0
+    dropped: int = 0
+    redis_written: int = 0
+    minio_written: int = 0
+    retries: int = 0
+    failures: int = 0
+    # 書き込みスレッドは複数あり、put()は各セッションのスレッドから呼ばれる
+    __stats_lock: ClassVar[Lock] = Lock()
+
+    def __init__(
+        self,
+        redis_host: str,
+        redis_port: int,
+        minio_host: str,
+        minio_port: int,
+        minio_access_key: str,
+        minio_secret_key: str,
+        bucket_name: str,
+        ttl_sec: int,
+    ):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__redis: Redis = Redis(host=redis_host, port=redis_port)
+        self.__minio_client: Minio = Minio(
+            endpoint=f"{minio_host}:{minio_port}",
+            access_key=minio_access_key,
+            secret_key=minio_secret_key,
+            secure=False,
+        )
+        self.__bucket_name: str = bucket_name
+        self.__ttl_sec: int = ttl_sec
+        self.__queue: Queue[VoiceCacheWriteJob] = Queue(self.QUEUE_SIZE)
+        self.__thread: Thread = Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    # 接続先ごとに共有されるVoiceCacheWriterを返す。
+    @classmethod
+    def get_writer(
+        cls,
+        redis_host: str,
+        redis_port: int,
+        minio_host: str,
+        minio_port: int,
+        minio_access_key: str,
+        minio_secret_key: str,
+        bucket_name: str,
+        ttl_sec: int,
+    ) -> "VoiceCacheWriter":
+        key: tuple = (redis_host, redis_port, minio_host, minio_port, bucket_name)
+        with cls.__writers_lock:
+            writer: VoiceCacheWriter | None = cls.__writers.get(key)
+            if writer is None:
+                writer = cls(
+                    redis_host=redis_host,
+                    redis_port=redis_port,
+                    minio_host=minio_host,
+                    minio_port=minio_port,
+                    minio_access_key=minio_access_key,
+                    minio_secret_key=minio_secret_key,
+                    bucket_name=bucket_name,
+                    ttl_sec=ttl_sec,
+                )
+                cls.__writers[key] = writer
+            return writer
+
+    @classmethod
+    def statuses(cls) -> dict:
+        return {
+            "queued": sum(w.qsize() for w in cls.__writers.values()),
+            "enqueued": cls.enqueued,
+            "dropped": cls.dropped,
+            "redis_written": cls.redis_written,
+            "minio_written": cls.minio_written,
+            "retries": cls.retries,
+            "failures": cls.failures,
+        }
+
+    @classmethod
+    def __count(cls, name: str, n: int = 1) -> None:
+        with cls.__stats_lock:
+            setattr(cls, name, getattr(cls, name) + n)
+
+    # 書き込みを待っている件数
+    def qsize(self) -> int:
+        return self.__queue.qsize()
+
+    # 書き込みをキューに積む。キューが一杯で捨てた場合はFalseを返す。
+    def put(self, job: VoiceCacheWriteJob) -> bool:
+        try:
+            self.__queue.put_nowait(job)
+        except Full:
+            self.__count("dropped")
+            self.__logger.warning(
+                f"Write queue is full, dropped: {job.redis_key or job.minio_key}"
+            )
+            self.__notify_redis_stored(job)
+            return False
+        self.__count("enqueued")
+        return True
+
+    def __run(self) -> None:
+        while True:
+            batch: list[VoiceCacheWriteJob] = [self.__queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.__write_redis([job for job in batch if job.redis_key])
+                for job in batch:
+                    if job.minio_key:
+                        self.__write_minio(job)
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}",
+                )
+
+    def __write_redis(self, jobs: list[VoiceCacheWriteJob]) -> None:
+        if not jobs:
+            return
+        if self.__with_retry(lambda: self.__set_redis(jobs), "Redis"):
+            self.__count("redis_written", len(jobs))
+        for job in jobs:
+            self.__notify_redis_stored(job)
+
+    # 1件の失敗で、残りの通知やMinIOへの書き込みを止めないようにする。
+    def __notify_redis_stored(self, job: VoiceCacheWriteJob) -> None:
+        if job.on_redis_stored is None:
+            return
+        try:
+            job.on_redis_stored()
+        except Exception as e:
+            self.__logger.error(
+                f"UnknownError: {repr(e)}\n{traceback.format_exc()}",
+            )
+
+    def __set_redis(self, jobs: list[VoiceCacheWriteJob]) -> None:
+        with self.__redis.pipeline(transaction=False) as pipe:
+            for job in jobs:
+                pipe.set(job.redis_key, job.pack, ex=self.__ttl_sec)
+            pipe.execute()
+
+    def __write_minio(self, job: VoiceCacheWriteJob) -> None:
+        assert job.minio_key is not None
+        minio_key: str = job.minio_key
+        if self.__with_retry(
+            lambda: self.__minio_client.put_object(
+                bucket_name=self.__bucket_name,
+                object_name=minio_key,
+                data=io.BytesIO(job.pack),
+                length=len(job.pack),
+                content_type="application/octet-stream",
+            ),
+            "MinIO",
+        ):
+            self.__count("minio_written")
+
+    # 最後まで失敗した場合はログに残してFalseを返す。
+    def __with_retry(self, write: Callable[[], object], target: str) -> bool:
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                write()
+                return True
+            except (RedisError, S3Error, OSError) as e:
+                if attempt == self.MAX_RETRIES:
+                    self.__count("failures")
+                    self.__logger.error(f"Failed to upload voice to {target}: {e}")
+                    return False
+                self.__count("retries")
+                sleep(self.RETRY_INTERVAL_SEC * 2**attempt)
+        return False
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from sincro_models import VoiceSynthesizerResult
+
+
+# プロセス内でデコード済みのVoiceSynthesizerResultを保持するLRUキャッシュ。
+# 「はい」「ですね」のような頻出する短い文を、RedisやMinIOへの問い合わせと
+# from_msgpack()を経ずに返すためのもの。
+# - max_bytes: 保持する音声データの合計サイズの上限。超えた分は古いものから捨てる。
+# - 各エントリはRedisと同じ期限(expire_at)を持ち、期限を過ぎたものは返さない。
+# 返したVoiceSynthesizerResultは他のセッションとも共有されるため、書き換えないこと。
+class VoiceMemoryCache:
+    # 音声データ以外(クエリやモーラのモデル)の大きさの見積もり
+    ENTRY_OVERHEAD_BYTES: int = 4096
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.__max_bytes: int = max_bytes
+        # key: (VoiceSynthesizerResult, サイズ, 期限(monotonic))
+        self.__entries: OrderedDict[str, tuple[VoiceSynthesizerResult, int, float]] = (
+            OrderedDict()
+        )
+        self.__bytes: int = 0
+        self.__lock: Lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    # count: Falseの場合はhits/missesに数えない(同じリクエスト内での再確認用)
+    def get(self, key: str, count: bool = True) -> VoiceSynthesizerResult | None:
+        with self.__lock:
+            entry: tuple[VoiceSynthesizerResult, int, float] | None = (
+                self.__entries.get(key)
+            )
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            vs_result, size, expire_at = entry
+            if expire_at <= monotonic():
+                self.__remove(key, size)
+                self.expirations += 1
+                if count:
+                    self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return vs_result
+
+    # ttl_sec: Redisに保存されている残りの期限に合わせる
+    def put(self, key: str, vs_result: VoiceSynthesizerResult, ttl_sec: float) -> None:
+        if ttl_sec <= 0:
+            return
+        size: int = len(vs_result.voice) + self.ENTRY_OVERHEAD_BYTES
+        if size > self.__max_bytes:
+            return
+        with self.__lock:
+            if old := self.__entries.get(key):
+                self.__remove(key, old[1])
+            self.__entries[key] = (vs_result, size, monotonic() + ttl_sec)
+            self.__bytes += size
+            while self.__bytes > self.__max_bytes:
+                old_key, (_, old_size, _) = next(iter(self.__entries.items()))
+                self.__remove(old_key, old_size)
+                self.evictions += 1
+
+    def __remove(self, key: str, size: int) -> None:
+        del self.__entries[key]
+        self.__bytes -= size
+
+    def statuses(self) -> dict:
+        return {
+            "entries": len(self.__entries),
+            "bytes": self.__bytes,
+            "max_bytes": self.__max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
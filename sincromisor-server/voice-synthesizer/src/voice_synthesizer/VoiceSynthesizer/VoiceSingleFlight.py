@@ -0,0 +1,286 @@
+import asyncio
+import logging
+from asyncio import AbstractEventLoop
+from collections.abc import AsyncGenerator, Callable, Generator
+from contextlib import asynccontextmanager, contextmanager, suppress
+from logging import Logger
+from threading import Event, Lock
+from time import monotonic, sleep
+from typing import ClassVar
+
+from redis import Redis
+from redis.exceptions import LockError
+from redis.lock import Lock as RedisLock
+from sincro_models import VoiceSynthesizerResult
+
+
+# 同じキーに対する合成1回分。
+# 合成を担当した側がresultを設定し、finish()で待っている側に知らせる。
+# スレッドからはevent、イベントループからはwait_async()で待つ。
+class VoiceFlight:
+    def __init__(self):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.event: Event = Event()
+        self.result: VoiceSynthesizerResult | None = None
+        # 他のノードに合成中であることを示すRedisのロック
+        self.redis_lock: RedisLock | None = None
+        # Trueの場合、claim()を抜けてもロックを保持する。
+        # Redisへの保存を後から行う場合に、保存が終わってからrelease_lock()を呼ぶ。
+        self.keep_lock: bool = False
+        # wait_async()で待っている要求のイベントループとFuture
+        self.__waiters: list[tuple[AbstractEventLoop, asyncio.Future]] = []
+        self.__waiters_lock: Lock = Lock()
+
+    def release_lock(self) -> None:
+        if self.redis_lock is None:
+            return
+        try:
+            self.redis_lock.release()
+        except LockError:
+            self.__logger.warning("Redis lock has already expired.")
+        self.redis_lock = None
+
+    # 合成の終わりを、待っている全ての要求に知らせる。
+    # 合成を担当した側のスレッド、イベントループのどちらから呼んでもよい。
+    def finish(self) -> None:
+        with self.__waiters_lock:
+            self.event.set()
+            waiters: list[tuple[AbstractEventLoop, asyncio.Future]] = self.__waiters
+            self.__waiters = []
+        for loop, waiter in waiters:
+            # 待っていたイベントループが既に閉じられている場合は何もしない
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(self.__wake, waiter)
+
+    @staticmethod
+    def __wake(waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    # event.wait()の非同期版。スレッドを占有せずに待つ。
+    # タイムアウトした場合はFalseを返す。
+    async def wait_async(self, timeout: float) -> bool:
+        loop: AbstractEventLoop = asyncio.get_running_loop()
+        waiter: asyncio.Future = loop.create_future()
+        with self.__waiters_lock:
+            if self.event.is_set():
+                return True
+            self.__waiters.append((loop, waiter))
+        try:
+            async with asyncio.timeout(timeout):
+                await waiter
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            with self.__waiters_lock:
+                if (loop, waiter) in self.__waiters:
+                    self.__waiters.remove((loop, waiter))
+
+
+# キャッシュに無い同じ音声への要求が同時に来た時、合成を1回にまとめる。
+# - プロセス内: 最初の要求だけが合成し、残りはその結果を待つ。
+# - ノード間: Redisのロックを取れなかった場合は、他のノードが合成して
+#   Redisに保存するのを待つ。
+# 待っている間に合成した側が失敗した場合は、改めて合成を担当する。
+class VoiceSingleFlight:
+    # 1回の合成(とエンコード)に掛かる時間の上限(s)
+    # これを超えて待たされた場合は、待つのを諦めて自分で合成する。
+    FLIGHT_TIMEOUT_SEC: float = 30.0
+    # 他のノードの合成を待つ間の、Redisを確認する間隔(s)
+    POLL_INTERVAL_SEC: float = 0.05
+
+    # プロセス内で合成中のキー
+    __flights: ClassVar[dict[str, VoiceFlight]] = {}
+    __flights_lock: ClassVar[Lock] = Lock()
+
+    # 統計(プロセス内の全セッションの合計)
+    coalesced: int = 0
+    remote_coalesced: int = 0
+    timeouts: int = 0
+    __stats_lock: ClassVar[Lock] = Lock()
+
+    def __init__(self, redis: Redis):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__redis: Redis = redis
+
+    @classmethod
+    def statuses(cls) -> dict:
+        return {
+            "in_flight": len(cls.__flights),
+            "coalesced": cls.coalesced,
+            "remote_coalesced": cls.remote_coalesced,
+            "timeouts": cls.timeouts,
+        }
+
+    # 待っている要求はスレッドとイベントループの両方から数える
+    @classmethod
+    def __count(cls, name: str) -> None:
+        with cls.__stats_lock:
+            setattr(cls, name, getattr(cls, name) + 1)
+
+    # flight.resultが設定されていれば、他の要求による合成結果なのでそのまま使う。
+    # Noneの場合は呼び出し元が合成し、flight.resultに設定すること。
+    # lookup: プロセス内のキャッシュとRedisから探す関数。合成を担当する前と、
+    # 他のノードを待つ間に使う。
+    @contextmanager
+    def claim(
+        self, key: str, lookup: Callable[[], VoiceSynthesizerResult | None]
+    ) -> Generator[VoiceFlight, None, None]:
+        flight: VoiceFlight = self.__join(key)
+        if flight.result is not None:
+            yield flight
+            return
+
+        try:
+            self.__lead(key, lookup, flight)
+            if flight.result is None and flight.redis_lock is None:
+                flight.result = self.__wait_remote(key, lookup)
+            yield flight
+        finally:
+            self.__leave(key, flight)
+
+    # claim()の非同期版。
+    # 他の要求やノードを待つ間はイベントループ上で待ち、スレッドを占有しない。
+    # スレッドで行うのはキャッシュとRedisへの問い合わせのみ。
+    @asynccontextmanager
+    async def claim_async(
+        self, key: str, lookup: Callable[[], VoiceSynthesizerResult | None]
+    ) -> AsyncGenerator[VoiceFlight, None]:
+        flight: VoiceFlight = await self.__join_async(key)
+        if flight.result is not None:
+            yield flight
+            return
+
+        leading: asyncio.Future[None] = asyncio.ensure_future(
+            asyncio.to_thread(self.__lead, key, lookup, flight)
+        )
+        try:
+            await asyncio.shield(leading)
+        except asyncio.CancelledError:
+            # 待っている間にキャンセルされても、取ったロックは必ず手放す
+            leading.add_done_callback(lambda _: self.__leave(key, flight))
+            raise
+        except BaseException:
+            self.__leave(key, flight)
+            raise
+        try:
+            if flight.result is None and flight.redis_lock is None:
+                flight.result = await self.__wait_remote_async(key, lookup)
+            yield flight
+        finally:
+            self.__leave(key, flight)
+
+    # 合成中のキーとして登録する。
+    # 他の要求が既に合成中の場合は、そのVoiceFlightとFalseを返す。
+    def __register(self, key: str) -> tuple[VoiceFlight, bool]:
+        with VoiceSingleFlight.__flights_lock:
+            flight: VoiceFlight | None = VoiceSingleFlight.__flights.get(key)
+            if flight is None:
+                flight = VoiceFlight()
+                VoiceSingleFlight.__flights[key] = flight
+                return flight, True
+        self.__count("coalesced")
+        return flight, False
+
+    # 合成を担当する場合は新しいVoiceFlightを、
+    # 他の要求が合成を終えた場合はresultの入ったVoiceFlightを返す。
+    def __join(self, key: str) -> VoiceFlight:
+        while True:
+            flight, registered = self.__register(key)
+            if registered:
+                return flight
+            if not flight.event.wait(timeout=self.FLIGHT_TIMEOUT_SEC):
+                return self.__timeout_flight(key)
+            if flight.result is not None:
+                return flight
+
+    # __join()の非同期版。
+    async def __join_async(self, key: str) -> VoiceFlight:
+        while True:
+            flight, registered = self.__register(key)
+            if registered:
+                return flight
+            if not await flight.wait_async(timeout=self.FLIGHT_TIMEOUT_SEC):
+                return self.__timeout_flight(key)
+            if flight.result is not None:
+                return flight
+
+    # 登録されていないVoiceFlightとして、自分で合成する
+    def __timeout_flight(self, key: str) -> VoiceFlight:
+        self.__count("timeouts")
+        self.__logger.warning(f"Timed out waiting for synthesis: {key}")
+        return VoiceFlight()
+
+    # 直前に他の要求が合成を終えていればflight.resultに設定する。
+    # 終えていなければRedisのロックを取り、取れた場合はflight.redis_lockに設定する。
+    def __lead(
+        self,
+        key: str,
+        lookup: Callable[[], VoiceSynthesizerResult | None],
+        flight: VoiceFlight,
+    ) -> None:
+        flight.result = lookup()
+        if flight.result is not None:
+            return
+        # 保存が終わった後、VoiceCacheWriterのスレッドから手放すため、
+        # スレッドローカルにしない。
+        redis_lock: RedisLock = self.__redis.lock(
+            f"{key}:lock", timeout=self.FLIGHT_TIMEOUT_SEC, thread_local=False
+        )
+        if redis_lock.acquire(blocking=False):
+            flight.redis_lock = redis_lock
+
+    # ロックを手放せなかった場合も、待っている要求は先に解放する
+    def __leave(self, key: str, flight: VoiceFlight) -> None:
+        with VoiceSingleFlight.__flights_lock:
+            if VoiceSingleFlight.__flights.get(key) is flight:
+                del VoiceSingleFlight.__flights[key]
+        flight.finish()
+        if not flight.keep_lock:
+            flight.release_lock()
+
+    # 他のノードがまだ合成中か(ロックが残っているか)と、Redisに保存された結果を返す。
+    def __check_remote(
+        self, key: str, lookup: Callable[[], VoiceSynthesizerResult | None]
+    ) -> tuple[bool, VoiceSynthesizerResult | None]:
+        locked: bool = bool(self.__redis.exists(f"{key}:lock"))
+        return locked, lookup()
+
+    # 他のノードがロックを手放すまで待ち、Redisに保存された結果を返す。
+    # 他のノードが失敗した場合や、待ちきれなかった場合はNoneを返す。
+    def __wait_remote(
+        self, key: str, lookup: Callable[[], VoiceSynthesizerResult | None]
+    ) -> VoiceSynthesizerResult | None:
+        deadline: float = monotonic() + self.FLIGHT_TIMEOUT_SEC
+        while monotonic() < deadline:
+            locked, vs_result = self.__check_remote(key, lookup)
+            if vs_result:
+                self.__count("remote_coalesced")
+                return vs_result
+            if not locked:
+                return None
+            sleep(self.POLL_INTERVAL_SEC)
+        return self.__remote_timeout(key)
+
+    # __wait_remote()の非同期版。確認の間はイベントループ上で待つ。
+    async def __wait_remote_async(
+        self, key: str, lookup: Callable[[], VoiceSynthesizerResult | None]
+    ) -> VoiceSynthesizerResult | None:
+        deadline: float = monotonic() + self.FLIGHT_TIMEOUT_SEC
+        while monotonic() < deadline:
+            locked, vs_result = await asyncio.to_thread(
+                self.__check_remote, key, lookup
+            )
+            if vs_result:
+                self.__count("remote_coalesced")
+                return vs_result
+            if not locked:
+                return None
+            await asyncio.sleep(self.POLL_INTERVAL_SEC)
+        return self.__remote_timeout(key)
+
+    def __remote_timeout(self, key: str) -> None:
+        self.__count("timeouts")
+        self.__logger.warning(f"Timed out waiting for remote synthesis: {key}")
+        return None
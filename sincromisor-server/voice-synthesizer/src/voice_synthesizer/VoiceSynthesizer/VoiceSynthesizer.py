@@ -1,39 +1,148 @@
-import subprocess as sp
+import asyncio
 import wave
+from collections.abc import Generator
 from io import BytesIO
-from subprocess import CompletedProcess
 
 from sincro_models import (
+    AudioEncoder,
     VoiceSynthesizerMora,
     VoiceSynthesizerRequest,
     VoiceSynthesizerResult,
     VoiceVoxAccentPhrase,
     VoiceVoxMora,
     VoiceVoxQuery,
+    get_audio_encoder,
+    pcm_sampling_rate,
 )
 
+from .AsyncVoiceVox import AsyncVoiceVox
 from .VoiceVox import VoiceVox
+from .VoiceVoxDispatcher import VoiceVoxDispatcher
 
 
 class VoiceSynthesizer(VoiceVox):
-    def __init__(self, host: str = "127.0.0.1", port: int = 50021):
+    # audio_encoder: pyav(プロセス内でエンコード), subprocess(fdkaac, opusenc)
+    # max_connections: 非同期版(synthesize_async、generate_async)で使う、
+    # エンジンへの同時接続数の上限
+    # dispatcher: 指定された場合はhost、portの代わりに、
+    # 合成ごとに最も空いているVOICEVOXエンジンを使う。
+    # この場合、VoiceVox(self)のセッションでhost、portへ接続することは無い。
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 50021,
+        audio_encoder: str = "pyav",
+        max_connections: int = 8,
+        dispatcher: VoiceVoxDispatcher | None = None,
+    ):
         super().__init__(host=host, port=port)
         self.host: str = host
         self.port: int = port
+        self.__audio_encoder: str = audio_encoder
+        self.__dispatcher: VoiceVoxDispatcher | None = dispatcher
+        # host、portへの非同期版の接続は、dispatcherが無い場合のみ使う
+        self.__async_vvox: AsyncVoiceVox | None = None
+        if dispatcher is None:
+            self.__async_vvox = AsyncVoiceVox(
+                host=host, port=port, max_connections=max_connections
+            )
 
     # テキストを元に音声を生成し、エンコード済み音声と母音タイミングデータをdictにまとめて返す。
     def generate(self, vs_request: VoiceSynthesizerRequest) -> VoiceSynthesizerResult:
-        query: VoiceVoxQuery = self.audio_query(
-            text=vs_request.message,
-            style_id=vs_request.style_id,
+        vs_result: VoiceSynthesizerResult = self.synthesize(vs_request)
+        enc_result: dict = self.encode(vs_result.voice, vs_request.audio_format)
+        return vs_result.model_copy(
+            update={
+                "voice": enc_result["voice"],
+                "audio_format": enc_result["audio_format"],
+            }
+        )
+
+    # generate()の非同期版。VOICEVOXとの通信を待つ間、イベントループを止めない。
+    # エンコードはスレッドで行う。
+    async def generate_async(
+        self, vs_request: VoiceSynthesizerRequest
+    ) -> VoiceSynthesizerResult:
+        vs_result: VoiceSynthesizerResult = await self.synthesize_async(vs_request)
+        enc_result: dict = await asyncio.to_thread(
+            self.encode, vs_result.voice, vs_request.audio_format
+        )
+        return vs_result.model_copy(
+            update={
+                "voice": enc_result["voice"],
+                "audio_format": enc_result["audio_format"],
+            }
+        )
+
+    # テキストを元に音声を生成し、エンコード前のwavと母音タイミングデータを返す。
+    # ストリーミングでは、これを元にヘッダを送ってからencode_stream()でエンコードする。
+    def synthesize(self, vs_request: VoiceSynthesizerRequest) -> VoiceSynthesizerResult:
+        query: VoiceVoxQuery
+        wav: bytes
+        if self.__dispatcher is None:
+            query, wav = self.__synthesize_wav(self, vs_request)
+        else:
+            query, wav = self.__dispatcher.call(
+                lambda engine: self.__synthesize_wav(engine.vvox, vs_request)
+            )
+        return self.__synthesized_result(vs_request, query, wav)
+
+    # synthesize()の非同期版。
+    async def synthesize_async(
+        self, vs_request: VoiceSynthesizerRequest
+    ) -> VoiceSynthesizerResult:
+        query: VoiceVoxQuery
+        wav: bytes
+        if self.__dispatcher is None:
+            assert self.__async_vvox is not None
+            query, wav = await self.__synthesize_wav_async(
+                self.__async_vvox, vs_request
+            )
+        else:
+            query, wav = await self.__dispatcher.call_async(
+                lambda engine: self.__synthesize_wav_async(
+                    engine.async_vvox, vs_request
+                )
+            )
+        return self.__synthesized_result(vs_request, query, wav)
+
+    # クエリの作成と音声の合成は、同じエンジンで行う。
+    def __synthesize_wav(
+        self, vvox: VoiceVox, vs_request: VoiceSynthesizerRequest
+    ) -> tuple[VoiceVoxQuery, bytes]:
+        query: VoiceVoxQuery = self.__filter_request_query(
+            vs_request,
+            vvox.audio_query(text=vs_request.message, style_id=vs_request.style_id),
+        )
+        return query, vvox.query_synthesis(query, style_id=vs_request.style_id)
+
+    async def __synthesize_wav_async(
+        self, async_vvox: AsyncVoiceVox, vs_request: VoiceSynthesizerRequest
+    ) -> tuple[VoiceVoxQuery, bytes]:
+        query: VoiceVoxQuery = self.__filter_request_query(
+            vs_request,
+            await async_vvox.audio_query(
+                text=vs_request.message, style_id=vs_request.style_id
+            ),
+        )
+        wav: bytes = await async_vvox.query_synthesis(
+            query, style_id=vs_request.style_id
         )
+        return query, wav
+
+    # リクエストで指定された前後の無音時間と、フレーズの間隔を設定する。
+    def __filter_request_query(
+        self, vs_request: VoiceSynthesizerRequest, query: VoiceVoxQuery
+    ) -> VoiceVoxQuery:
         query.prePhonemeLength = vs_request.pre_phoneme_length
         query.postPhonemeLength = vs_request.post_phoneme_length
-        query = self.query_filter(query)
-        wav: bytes = self.query_synthesis(query, style_id=vs_request.style_id)
+        return self.query_filter(query)
+
+    def __synthesized_result(
+        self, vs_request: VoiceSynthesizerRequest, query: VoiceVoxQuery, wav: bytes
+    ) -> VoiceSynthesizerResult:
         mora_list: list[VoiceSynthesizerMora] = self.__parse_phrases(query)
         sp_time: float = self.__wav_speaking_time(wav)
-        enc_result: dict = self.encode(wav, vs_request.audio_format)
         return VoiceSynthesizerResult(
             # 元となったメッセージテキスト
             message=vs_request.message,
@@ -43,36 +152,62 @@ class VoiceSynthesizer(VoiceVox):
             mora_queue=mora_list,
             # 音声データの再生時間(s)
             speaking_time=sp_time,
-            # 音声データ(エンコード済み)
-            voice=enc_result["voice"],
-            # 音声データフォーマット(audio/aac, audio/ogg;codecs=opus, audio/wavのいずれか)
-            audio_format=enc_result["audio_format"],
+            # 音声データ(エンコード前のwav)
+            voice=wav,
+            audio_format="audio/wav",
         )
 
+    # audio_formatでエンコードするエンコーダを返す。
+    # audio/wavなど、エンコードしない場合はNoneとなる。
+    # audio/pcm;rate=Nはエンコードせず、s16 2chのPCMをN Hzにリサンプリングして返す。
+    def encoder(self, audio_format: str | None) -> AudioEncoder | None:
+        if audio_format in ("audio/aac", "audio/ogg;codecs=opus"):
+            return get_audio_encoder(audio_format, backend=self.__audio_encoder)
+        if audio_format is not None and pcm_sampling_rate(audio_format) is not None:
+            return get_audio_encoder(audio_format)
+        return None
+
+    # エンコード後のaudio_formatを返す。
+    def encoded_format(self, audio_format: str | None) -> str:
+        encoder: AudioEncoder | None = self.encoder(audio_format)
+        return encoder.audio_format if encoder else "audio/wav"
+
     # voiceをaudio_formatで指定された形式でエンコードする。
-    # audio/aac、audio/ogg;codecs=opus、audio/wavのいずれか。
-    # 実行にはfdkaacとopusencコマンドが必要。
+    # audio/aac、audio/ogg;codecs=opus、audio/wav、audio/pcm;rate=Nのいずれか。
+    # audio_encoderがsubprocessの場合(もしくはPyAVが使えない場合)は
+    # fdkaacとopusencコマンドが必要。
     def encode(self, voice: bytes, audio_format: str | None) -> dict:
-        encoder_p: CompletedProcess
-        if audio_format == "audio/aac":
-            encoder_p = sp.run(
-                ["fdkaac", "-S", "-m3", "-f2", "-o-", "-"],
-                input=voice,
-                capture_output=True,
-                text=False,
-                check=True,
-            )
-            return {"voice": encoder_p.stdout, "audio_format": "audio/aac"}
-        if audio_format == "audio/ogg;codecs=opus":
-            encoder_p = sp.run(
-                ["opusenc", "-", "-"],
-                input=voice,
-                capture_output=True,
-                text=False,
-                check=True,
-            )
-            return {"voice": encoder_p.stdout, "audio_format": "audio/ogg;codecs=opus"}
-        return {"voice": voice, "audio_format": "audio/wav"}
+        encoder: AudioEncoder | None = self.encoder(audio_format)
+        if encoder is None:
+            return {"voice": voice, "audio_format": "audio/wav"}
+        pcm, sampling_rate, channels = self.__wav_pcm(voice)
+        return {
+            "voice": encoder.encode(pcm, sampling_rate, channels),
+            "audio_format": encoder.audio_format,
+        }
+
+    # encode()のストリーミング版。
+    # エンコーダの出力を待たずに、出てきた分から順に返す。
+    # 連結するとencode()の結果と同じ形式の音声データになる。
+    def encode_stream(
+        self, voice: bytes, audio_format: str | None, chunk_size: int = 4096
+    ) -> Generator[bytes, None, None]:
+        encoder: AudioEncoder | None = self.encoder(audio_format)
+        if encoder is None:
+            for position in range(0, len(voice), chunk_size):
+                yield voice[position : position + chunk_size]
+            return
+        pcm, sampling_rate, channels = self.__wav_pcm(voice)
+        yield from encoder.encode_stream(
+            pcm, sampling_rate, channels, chunk_size=chunk_size
+        )
+
+    # wavからPCM(int16)、サンプリングレート、チャンネル数を取り出す。
+    def __wav_pcm(self, wav: bytes) -> tuple[bytes, int, int]:
+        with wave.open(BytesIO(wav), "rb") as w:
+            if w.getsampwidth() != 2:
+                raise ValueError(f"Unsupported wav sample width: {w.getsampwidth()}")
+            return w.readframes(w.getnframes()), w.getframerate(), w.getnchannels()
 
     # フレーズの間隔を指定した秒数で上書きする。
     def query_filter(self, query: VoiceVoxQuery, sec: float = 0.1) -> VoiceVoxQuery:
@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from collections.abc import Generator
 from logging import Logger
 from time import perf_counter
 
@@ -7,16 +9,21 @@ from sincro_models import (
     TextProcessorResult,
     VoiceSynthesizerRequest,
     VoiceSynthesizerResult,
+    VoiceSynthesizerStreamChunk,
+    VoiceSynthesizerStreamHeader,
 )
 
 from .VoiceCacheManager import VoiceCacheManager
+from .VoiceMemoryCache import VoiceMemoryCache
+from .VoiceVoxDispatcher import VoiceVoxDispatcher
 
 
 class VoiceSynthesizerWorker:
+    # 1つの接続で同時に合成する文の数の上限
+    MAX_PIPELINED: int = 4
+
     def __init__(
         self,
-        voicevox_host: str,
-        voicevox_port: int,
         voicevox_style_id: int,
         redis_host: str,
         redis_port: int,
@@ -24,6 +31,14 @@ class VoiceSynthesizerWorker:
         minio_port: int,
         minio_access_key: str,
         minio_secret_key: str,
+        stream: bool = False,
+        audio_encoder: str = "pyav",
+        audio_format: str = "audio/ogg;codecs=opus",
+        memory_cache: VoiceMemoryCache | None = None,
+        voicevox_max_connections: int = 8,
+        voicevox_host: str = "127.0.0.1",
+        voicevox_port: int = 50021,
+        voicevox_dispatcher: VoiceVoxDispatcher | None = None,
     ):
         self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
         self.__vvox: VoiceCacheManager = VoiceCacheManager(
@@ -35,53 +50,180 @@ class VoiceSynthesizerWorker:
             minio_port=minio_port,
             minio_access_key=minio_access_key,
             minio_secret_key=minio_secret_key,
+            audio_encoder=audio_encoder,
+            memory_cache=memory_cache,
+            voicevox_max_connections=voicevox_max_connections,
+            voicevox_dispatcher=voicevox_dispatcher,
         )
         self.__voicevox_style_id: int = voicevox_style_id
+        # Trueの場合、VoiceSynthesizerResultの代わりにヘッダと音声の断片を順に送る。
+        self.__stream: bool = stream
+        # 接続ごとに指定される音声データフォーマット
+        self.__audio_format: str = audio_format
 
     async def communicate(self, ws: WebSocket) -> None:
+        if self.__stream:
+            await self.__communicate_stream(ws)
+            return
+        # 受信した文は順に合成を始め、結果は受信した順に送る。
+        # 前の文の合成を待たずに次の文の合成を始められる。
+        results: asyncio.Queue[asyncio.Task[bytes] | None] = asyncio.Queue(
+            self.MAX_PIPELINED
+        )
+        receiver: asyncio.Task[None] = asyncio.create_task(
+            self.__receive_requests(ws, results)
+        )
+        sender: asyncio.Task[None] = asyncio.create_task(
+            self.__send_results(ws, results)
+        )
+        try:
+            done, _ = await asyncio.wait(
+                (receiver, sender), return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                task.result()
+        finally:
+            receiver.cancel()
+            sender.cancel()
+            while not results.empty():
+                if (pending := results.get_nowait()) is not None:
+                    pending.cancel()
+
+    async def __receive_requests(
+        self, ws: WebSocket, results: asyncio.Queue[asyncio.Task[bytes] | None]
+    ) -> None:
         pack: bytes
         while pack := await ws.receive_bytes():
             tp_result: TextProcessorResult = TextProcessorResult.from_msgpack(pack=pack)
             self.__logger.info(f"Receive {repr(tp_result)}")
             if tp_result.voice_text:
-                self.__logger.info(
-                    {
-                        "type": "VoiceSynthesizerRequest",
-                        "session_id": tp_result.session_id,
-                        "speech_id": tp_result.speech_id,
-                        "voice_text": tp_result.voice_text,
-                    },
+                self.__log_request(tp_result)
+                await results.put(
+                    asyncio.create_task(self.__synthesize(tp_result=tp_result))
                 )
-                start_t = perf_counter()
-                vs_result: VoiceSynthesizerResult = self.__get_voice(
-                    vvox_cm=self.__vvox,
-                    voice_text=tp_result.voice_text,
-                )
-                self.__logger.info(
-                    {
-                        "type": "VoiceSynthesizerResult",
-                        "session_id": tp_result.session_id,
-                        "speech_id": tp_result.speech_id,
-                        "query_time": perf_counter() - start_t,
-                        "message": vs_result.message,
-                        "speeking_time": vs_result.speaking_time,
-                    },
+        await results.put(None)
+
+    async def __send_results(
+        self, ws: WebSocket, results: asyncio.Queue[asyncio.Task[bytes] | None]
+    ) -> None:
+        while (task := await results.get()) is not None:
+            await ws.send_bytes(await task)
+
+    async def __synthesize(self, tp_result: TextProcessorResult) -> bytes:
+        assert tp_result.voice_text is not None
+        start_t = perf_counter()
+        vs_result: VoiceSynthesizerResult = await self.__vvox.get_voice_async(
+            vs_request=self.__voice_request(tp_result.voice_text)
+        )
+        self.__logger.info(
+            {
+                "type": "VoiceSynthesizerResult",
+                "session_id": tp_result.session_id,
+                "speech_id": tp_result.speech_id,
+                "query_time": perf_counter() - start_t,
+                "message": vs_result.message,
+                "speeking_time": vs_result.speaking_time,
+            },
+        )
+        return vs_result.to_msgpack()
+
+    async def __communicate_stream(self, ws: WebSocket) -> None:
+        pack: bytes
+        while pack := await ws.receive_bytes():
+            tp_result: TextProcessorResult = TextProcessorResult.from_msgpack(pack=pack)
+            self.__logger.info(f"Receive {repr(tp_result)}")
+            if tp_result.voice_text:
+                self.__log_request(tp_result)
+                await self.__send_voice_stream(ws=ws, tp_result=tp_result)
+
+    def __log_request(self, tp_result: TextProcessorResult) -> None:
+        self.__logger.info(
+            {
+                "type": "VoiceSynthesizerRequest",
+                "session_id": tp_result.session_id,
+                "speech_id": tp_result.speech_id,
+                "voice_text": tp_result.voice_text,
+            },
+        )
+
+    # ヘッダを送った後、エンコードできた音声から順に送る。
+    # 長い文章でも、全体のエンコードを待たずに再生を始められる。
+    async def __send_voice_stream(
+        self, ws: WebSocket, tp_result: TextProcessorResult
+    ) -> None:
+        assert tp_result.voice_text is not None
+        start_t = perf_counter()
+        first_chunk_t: float | None = None
+        messages: Generator[
+            VoiceSynthesizerStreamHeader | VoiceSynthesizerStreamChunk, None, None
+        ] = self.__vvox.get_voice_stream(
+            vs_request=self.__voice_request(tp_result.voice_text)
+        )
+        header: VoiceSynthesizerStreamHeader | None = None
+        fetching: asyncio.Future | None = None
+        try:
+            # 合成とエンコードはブロックするため、スレッドで1つずつ取り出す。
+            while True:
+                fetching = asyncio.ensure_future(
+                    asyncio.to_thread(next, messages, None)
                 )
-                await ws.send_bytes(vs_result.to_msgpack())
+                message: (
+                    VoiceSynthesizerStreamHeader | VoiceSynthesizerStreamChunk | None
+                ) = await asyncio.shield(fetching)
+                if message is None:
+                    break
+                if isinstance(message, VoiceSynthesizerStreamHeader):
+                    header = message
+                elif first_chunk_t is None:
+                    first_chunk_t = perf_counter() - start_t
+                await ws.send_bytes(message.to_msgpack())
+        finally:
+            # 途中で切断やキャンセルされた場合も、取り出し中のものを待ってから閉じ、
+            # get_voice_stream()が持っている合成中のロックを手放させる。
+            if fetching is not None:
+                await asyncio.gather(fetching, return_exceptions=True)
+            await asyncio.to_thread(messages.close)
+        assert header is not None
+        self.__logger.info(
+            {
+                "type": "VoiceSynthesizerStream",
+                "session_id": tp_result.session_id,
+                "speech_id": tp_result.speech_id,
+                "first_chunk_time": first_chunk_t,
+                "query_time": perf_counter() - start_t,
+                "message": header.message,
+                "speeking_time": header.speaking_time,
+            },
+        )
 
-    def __get_voice(
-        self,
-        voice_text: str,
-        vvox_cm: VoiceCacheManager,
-    ) -> VoiceSynthesizerResult:
-        vs_request: VoiceSynthesizerRequest = VoiceSynthesizerRequest(
+    # 頻出するフレーズを合成(もしくはキャッシュから読み込み)し、
+    # プロセス内のキャッシュに載せておく。
+    def warmup(self, phrases: list[str]) -> None:
+        start_t = perf_counter()
+        for phrase in phrases:
+            try:
+                self.__get_voice(vvox_cm=self.__vvox, voice_text=phrase)
+            except VoiceCacheManager.VoiceSynthesizerServerException:
+                self.__logger.warning(f"Warmup failed: {phrase}")
+        self.__logger.info(
+            f"Warmup done: {len(phrases)} phrases, {perf_counter() - start_t:.2f}s"
+        )
+
+    def __voice_request(self, voice_text: str) -> VoiceSynthesizerRequest:
+        return VoiceSynthesizerRequest(
             message=voice_text,
-            # "audio/ogg;codecs=opus"にしたい
-            audio_format="audio/ogg;codecs=opus",
+            audio_format=self.__audio_format,
             style_id=self.__voicevox_style_id,
             pre_phoneme_length=0.1,
             post_phoneme_length=0.1,
         )
+
+    def __get_voice(
+        self,
+        voice_text: str,
+        vvox_cm: VoiceCacheManager,
+    ) -> VoiceSynthesizerResult:
+        vs_request: VoiceSynthesizerRequest = self.__voice_request(voice_text)
         vs_result: VoiceSynthesizerResult = vvox_cm.get_voice(vs_request=vs_request)
 
         return vs_result
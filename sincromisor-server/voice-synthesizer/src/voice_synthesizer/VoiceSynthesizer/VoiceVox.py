@@ -14,6 +14,8 @@ class VoiceVox:
         self.port = port
         self.base_url = f"http://{self.host}:{self.port}"
         self.style_id_key: str = "speaker"  # speaker(deprecated)、style_id(新)。
+        # 同じエンジンへの接続を使い回す(HTTP keep-alive)
+        self.session: requests.Session = requests.Session()
 
     # テキストを+synthesis+に渡せるクエリJSON(連想配列)に変換。
     # * +text+ - クエリに変換するテキスト文字列。
@@ -21,7 +23,7 @@ class VoiceVox:
     # * 戻り値 - クエリ連想配列
     def audio_query(self, text: str, style_id: int = 1) -> VoiceVoxQuery:
         params: dict[str, str | int] = {self.style_id_key: style_id, "text": text}
-        res = requests.post(
+        res = self.session.post(
             url=f"{self.base_url}/audio_query",
             params=params,
         )
@@ -51,7 +53,7 @@ class VoiceVox:
             "text": text,
             "is_kana": is_kana,
         }
-        res = requests.post(
+        res = self.session.post(
             url=f"{self.base_url}/accent_phrases",
             params=params,
         )
@@ -63,7 +65,7 @@ class VoiceVox:
     # * +speaker+ - 話者ID。+speakers+メソッドで得られる。(default: 1)
     # * 戻り値 - wavストリーム
     def query_synthesis(self, query: VoiceVoxQuery, style_id: int = 1) -> bytes:
-        res = requests.post(
+        res = self.session.post(
             url=f"{self.base_url}/synthesis",
             params={self.style_id_key: style_id},
             headers={"Content-Type": "application/json"},
@@ -93,7 +95,7 @@ class VoiceVox:
         target_style_id: int = 2,
         morph_rate: float = 0.5,
     ) -> bytes:
-        res = requests.post(
+        res = self.session.post(
             url=f"{self.base_url}/synthesis_morphing",
             params={
                 f"base_{self.style_id_key}": base_style_id,
@@ -109,7 +111,7 @@ class VoiceVox:
     # 話者の一覧を取得。
     # * 戻り値 - 話者一覧の配列。
     def speakers(self) -> list:
-        res = requests.get(url=f"{self.base_url}/speakers")
+        res = self.session.get(url=f"{self.base_url}/speakers")
         self.response_validator(res)
         return res.json()
 
@@ -117,7 +119,7 @@ class VoiceVox:
     # * +speaker_uuid+ - 話者のUUID。+speakers+メソッドで得られる...はず。
     # * 戻り値 - 話者の詳細情報の連想配列。
     def speaker_info(self, speaker_uuid: str) -> dict:
-        res = requests.get(
+        res = self.session.get(
             url=f"{self.base_url}/speaker_info",
             params={"speaker_uuid": speaker_uuid},
         )
@@ -145,21 +147,21 @@ class VoiceVox:
     # サーバエンジンが保持しているプリセットを取得。
     # * 戻り値 - 配列
     def presets(self) -> list:
-        res = requests.get(url=f"{self.base_url}/presets")
+        res = self.session.get(url=f"{self.base_url}/presets")
         self.response_validator(res)
         return res.json()
 
     # サーバのバージョンを取得。
     # 戻り値 - バージョン文字列
     def version(self) -> str:
-        res = requests.get(url=f"{self.base_url}/version")
+        res = self.session.get(url=f"{self.base_url}/version")
         self.response_validator(res)
         return res.json()
 
     # エンジンコアのバージョンを取得。
     # 戻り値 - バージョン文字列の配列
     def core_versions(self) -> list[str]:
-        res = requests.get(url=f"{self.base_url}/core_versions")
+        res = self.session.get(url=f"{self.base_url}/core_versions")
         self.response_validator(res)
         return res.json()
 
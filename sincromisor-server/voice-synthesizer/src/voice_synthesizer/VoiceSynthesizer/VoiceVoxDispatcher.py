@@ -0,0 +1,241 @@
+import logging
+import traceback
+from collections.abc import Awaitable, Callable
+from logging import Logger
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter
+from typing import TypeVar
+
+import httpx
+from sincro_config import (
+    ServiceDescription,
+    ServiceDiscoveryReferrer,
+    ServiceDiscoveryReferrerError,
+)
+
+from .AsyncVoiceVox import AsyncVoiceVox
+from .VoiceVox import VoiceVox
+
+T = TypeVar("T")
+
+
+# VoiceVoxDispatcherから見たVOICEVOXエンジン1台分の状態。
+class VoiceVoxEngine:
+    # 応答時間の指数移動平均の重み
+    EWMA_ALPHA: float = 0.2
+    # まだ応答時間が分からないエンジンの応答時間の見積もり(s)
+    INITIAL_LATENCY_SEC: float = 0.5
+
+    def __init__(self, service_id: str, host: str, port: int, max_connections: int):
+        self.service_id: str = service_id
+        self.host: str = host
+        self.port: int = port
+        self.vvox: VoiceVox = VoiceVox(host=host, port=port)
+        self.async_vvox: AsyncVoiceVox = AsyncVoiceVox(
+            host=host, port=port, max_connections=max_connections
+        )
+        # 処理中のリクエスト数
+        self.in_flight: int = 0
+        # 応答時間の指数移動平均(s)
+        self.latency: float = self.INITIAL_LATENCY_SEC
+        self.requests: int = 0
+        self.failures: int = 0
+        # 失敗した後、この時刻(monotonic)までは他のエンジンを優先する
+        self.cooldown_until: float = 0.0
+
+    # 小さいほど空いている。処理中のリクエストが全て終わるまでの見積もり。
+    def load(self) -> float:
+        return (self.in_flight + 1) * self.latency
+
+    def statuses(self) -> dict:
+        return {
+            "service_id": self.service_id,
+            "address": f"{self.host}:{self.port}",
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "cooldown": max(self.cooldown_until - monotonic(), 0.0),
+        }
+
+
+# 複数のVOICEVOXエンジンに、合成リクエストを振り分ける。
+# - Consulから正常稼働しているエンジンの一覧を定期的に取り直す。
+# - 処理中のリクエスト数と応答時間(EWMA)から、最も空いているエンジンを選ぶ。
+# - 失敗したエンジンはしばらく避け、別のエンジンでやり直す。
+# プロセス内の全セッションで共有する。
+class VoiceVoxDispatcher:
+    class NoEngineError(Exception):
+        pass
+
+    WORKER_TYPE: str = "SincroVoiceVox"
+    # Consulからエンジンの一覧を取り直す間隔(s)
+    REFRESH_INTERVAL_SEC: float = 5.0
+    # 1つのリクエストを試すエンジンの数
+    MAX_ATTEMPTS: int = 3
+    # 失敗したエンジンを避ける時間(s)
+    COOLDOWN_SEC: float = 5.0
+    # エンジン側の問題とみなし、別のエンジンでやり直す例外
+    RETRYABLE_ERRORS: tuple[type[Exception], ...] = (
+        OSError,
+        httpx.HTTPError,
+        VoiceVox.ProtocolError,
+        AsyncVoiceVox.ProtocolError,
+    )
+
+    def __init__(self, sd_referrer: ServiceDiscoveryReferrer, max_connections: int = 8):
+        self.__logger: Logger = logging.getLogger("sincro." + self.__class__.__name__)
+        self.__sd_referrer: ServiceDiscoveryReferrer = sd_referrer
+        self.__max_connections: int = max_connections
+        # key: service_id
+        self.__engines: dict[str, VoiceVoxEngine] = {}
+        self.__lock: Lock = Lock()
+        self.__stop_event: Event = Event()
+        self.__thread: Thread | None = None
+        self.retries: int = 0
+
+    # 最初の一覧を取得してから、バックグラウンドでの更新を始める。
+    def start(self) -> None:
+        self.refresh()
+        self.__thread = Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def close(self) -> None:
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def has_engines(self) -> bool:
+        return len(self.__engines) > 0
+
+    def statuses(self) -> dict:
+        with self.__lock:
+            return {
+                "engines": [e.statuses() for e in self.__engines.values()],
+                "retries": self.retries,
+            }
+
+    def __run(self) -> None:
+        while not self.__stop_event.wait(self.REFRESH_INTERVAL_SEC):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.__logger.error(
+                    f"UnknownError: {repr(e)}\n{traceback.format_exc()}",
+                )
+
+    # Consulから正常稼働しているエンジンの一覧を取り直す。
+    # 引き続き存在するエンジンの統計はそのまま引き継ぐ。
+    # Consulに接続できない場合は、今の一覧を使い続ける。
+    def refresh(self) -> None:
+        try:
+            workers: list[ServiceDescription] = self.__sd_referrer.get_healthy_workers(
+                worker_type=self.WORKER_TYPE
+            )
+        except ServiceDiscoveryReferrerError as e:
+            self.__logger.warning(f"Failed to refresh VOICEVOX engines: {e}")
+            return
+        with self.__lock:
+            engines: dict[str, VoiceVoxEngine] = {}
+            for worker in workers:
+                engine: VoiceVoxEngine | None = self.__engines.get(worker.service_id)
+                if (
+                    engine is None
+                    or engine.host != worker.service_address
+                    or engine.port != worker.service_port
+                ):
+                    self.__logger.info(
+                        f"Add VOICEVOX engine: {worker.service_id} "
+                        f"{worker.service_address}:{worker.service_port}"
+                    )
+                    engine = VoiceVoxEngine(
+                        service_id=worker.service_id,
+                        host=worker.service_address,
+                        port=worker.service_port,
+                        max_connections=self.__max_connections,
+                    )
+                engines[worker.service_id] = engine
+            for service_id in self.__engines.keys() - engines.keys():
+                self.__logger.info(f"Remove VOICEVOX engine: {service_id}")
+            self.__engines = engines
+
+    # 最も空いているエンジンを選び、処理中のリクエスト数を増やす。
+    # 失敗して間もないエンジンは、他に選べるエンジンが無い場合のみ選ぶ。
+    def __acquire(self, tried: set[str]) -> VoiceVoxEngine:
+        with self.__lock:
+            candidates: list[VoiceVoxEngine] = [
+                e for e in self.__engines.values() if e.service_id not in tried
+            ]
+            if not candidates:
+                raise self.NoEngineError("No SincroVoiceVox worker found.")
+            now: float = monotonic()
+            engine: VoiceVoxEngine = min(
+                candidates, key=lambda e: (e.cooldown_until > now, e.load())
+            )
+            engine.in_flight += 1
+            engine.requests += 1
+            return engine
+
+    # elapsed: 応答時間(s)。キャンセルされた場合などはNoneとし、平均には含めない。
+    def __release(
+        self, engine: VoiceVoxEngine, elapsed: float | None, ok: bool
+    ) -> None:
+        with self.__lock:
+            engine.in_flight -= 1
+            if not ok:
+                engine.failures += 1
+                engine.cooldown_until = monotonic() + self.COOLDOWN_SEC
+            elif elapsed is not None:
+                engine.latency += VoiceVoxEngine.EWMA_ALPHA * (elapsed - engine.latency)
+                engine.cooldown_until = 0.0
+
+    # request(エンジン)を空いているエンジンで実行する。
+    # エンジン側の問題で失敗した場合は、別のエンジンでやり直す。
+    def call(self, request: Callable[[VoiceVoxEngine], T]) -> T:
+        tried: set[str] = set()
+        while True:
+            engine: VoiceVoxEngine = self.__acquire(tried)
+            start_t: float = perf_counter()
+            try:
+                result: T = request(engine)
+            except self.RETRYABLE_ERRORS as e:
+                self.__release(engine, perf_counter() - start_t, ok=False)
+                tried.add(engine.service_id)
+                self.__retry_or_raise(engine, tried, e)
+                continue
+            except BaseException:
+                self.__release(engine, None, ok=True)
+                raise
+            self.__release(engine, perf_counter() - start_t, ok=True)
+            return result
+
+    # call()の非同期版。
+    async def call_async(self, request: Callable[[VoiceVoxEngine], Awaitable[T]]) -> T:
+        tried: set[str] = set()
+        while True:
+            engine: VoiceVoxEngine = self.__acquire(tried)
+            start_t: float = perf_counter()
+            try:
+                result: T = await request(engine)
+            except self.RETRYABLE_ERRORS as e:
+                self.__release(engine, perf_counter() - start_t, ok=False)
+                tried.add(engine.service_id)
+                self.__retry_or_raise(engine, tried, e)
+                continue
+            except BaseException:
+                self.__release(engine, None, ok=True)
+                raise
+            self.__release(engine, perf_counter() - start_t, ok=True)
+            return result
+
+    def __retry_or_raise(
+        self, engine: VoiceVoxEngine, tried: set[str], error: Exception
+    ) -> None:
+        self.__logger.warning(
+            f"VOICEVOX engine failed: {engine.service_id} "
+            f"{engine.host}:{engine.port} - {repr(error)}"
+        )
+        with self.__lock:
+            if len(tried) >= self.MAX_ATTEMPTS or len(tried) >= len(self.__engines):
+                raise error
+            self.retries += 1
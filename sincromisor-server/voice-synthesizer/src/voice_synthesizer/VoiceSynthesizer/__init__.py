@@ -1,11 +1,24 @@
+from .AsyncVoiceVox import AsyncVoiceVox
 from .VoiceCacheManager import VoiceCacheManager
+from .VoiceCacheWriter import VoiceCacheWriteJob, VoiceCacheWriter
+from .VoiceMemoryCache import VoiceMemoryCache
+from .VoiceSingleFlight import VoiceFlight, VoiceSingleFlight
 from .VoiceSynthesizer import VoiceSynthesizer
 from .VoiceSynthesizerWorker import VoiceSynthesizerWorker
 from .VoiceVox import VoiceVox
+from .VoiceVoxDispatcher import VoiceVoxDispatcher, VoiceVoxEngine
 
 __all__ = [
     "VoiceVox",
+    "AsyncVoiceVox",
+    "VoiceVoxDispatcher",
+    "VoiceVoxEngine",
     "VoiceSynthesizer",
     "VoiceCacheManager",
+    "VoiceCacheWriteJob",
+    "VoiceCacheWriter",
+    "VoiceMemoryCache",
+    "VoiceFlight",
+    "VoiceSingleFlight",
     "VoiceSynthesizerWorker",
 ]
@@ -9,8 +9,13 @@ class VoiceSynthesizerProcessArgument(SincromisorArgumentParser):
     public_bind_host: str
     public_bind_port: int
     voicevox_default_style_id: int
+    voicevox_max_connections: int
     minio_access_key: str
     minio_secret_key: str
+    audio_encoder: str
+    voice_cache_memory_mb: int
+    voice_cache_warmup_file: str | None
+    voice_cache_warmup_formats: str
 
     @classmethod
     def set_args(cls, parser: ArgumentParser) -> None:
@@ -74,4 +79,52 @@ class VoiceSynthesizerProcessArgument(SincromisorArgumentParser):
             help="MinIO secret key(default: None)",
         )
 
+        # VOICEVOXエンジンごとの同時接続数の上限
+        # 接続はプロセス内の全セッションで共有される。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--voicevox-max-connections",
+            env_name="SINCRO_SYNTHESIZER_VOICEVOX_MAX_CONNECTIONS",
+            default=8,
+            help="Max concurrent connections per VOICEVOX engine(default: 8)",
+        )
+
+        # 合成した音声のエンコード方法
+        # pyav: PyAVでプロセス内でエンコードする(使えない場合はsubprocessになる)
+        # subprocess: fdkaac、opusencコマンドを文ごとに起動する
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--audio-encoder",
+            env_name="SINCRO_SYNTHESIZER_AUDIO_ENCODER",
+            default="pyav",
+            help="Audio encoder backend, pyav or subprocess(default: pyav)",
+        )
+
+        # プロセス内の音声キャッシュの上限(MiB)。0の場合は使わない。
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--voice-cache-memory-mb",
+            env_name="SINCRO_SYNTHESIZER_VOICE_CACHE_MEMORY_MB",
+            default=256,
+            help="In-process voice cache size in MiB, 0 to disable(default: 256)",
+        )
+
+        # 起動時にプロセス内の音声キャッシュに載せるフレーズのリスト(1行1フレーズ)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--voice-cache-warmup-file",
+            env_name="SINCRO_SYNTHESIZER_VOICE_CACHE_WARMUP_FILE",
+            default=None,
+            help="Phrase list to warm up the in-process voice cache(default: None)",
+        )
+
+        # ウォームアップする音声データフォーマット(カンマ区切り)
+        cls.add_argument(
+            parser=parser,
+            cmd_name="--voice-cache-warmup-formats",
+            env_name="SINCRO_SYNTHESIZER_VOICE_CACHE_WARMUP_FORMATS",
+            default="audio/ogg;codecs=opus",
+            help="Comma separated audio formats to warm up(default: audio/ogg;codecs=opus)",
+        )
+
         return